@@ -1,5 +1,8 @@
 import os
 from pathlib import Path
+
+import django
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -40,6 +43,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so its timings cover the rest of the stack
+    "nyumbaAI_app.middleware.ServerTimingMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -81,17 +86,227 @@ GROQ_CONFIG = {
 
 SERPAPI_KEY = os.getenv('SERP_API_KEY')
 
+# Upstream backends, see nyumbaAI_app.providers: 'serpapi'/'groq' are live,
+# 'fixture' replays recordings from PROVIDER_FIXTURES_DIR with synthetic
+# latency (seconds) and error rate (0-1). PROVIDER_RECORD saves live responses
+# there for replay.
+SEARCH_PROVIDER = os.getenv('SEARCH_PROVIDER', 'serpapi')
+LLM_PROVIDER = os.getenv('LLM_PROVIDER', 'groq')
+PROVIDER_FIXTURES_DIR = os.getenv('PROVIDER_FIXTURES_DIR', BASE_DIR / 'nyumbaAI_app' / 'replay')
+PROVIDER_RECORD = os.getenv('PROVIDER_RECORD') == 'True'
+PROVIDER_FIXTURE_SEED = int(os.getenv('PROVIDER_FIXTURE_SEED', 0))
+SEARCH_FIXTURE_LATENCY = float(os.getenv('SEARCH_FIXTURE_LATENCY', 0))
+SEARCH_FIXTURE_ERROR_RATE = float(os.getenv('SEARCH_FIXTURE_ERROR_RATE', 0))
+LLM_FIXTURE_LATENCY = float(os.getenv('LLM_FIXTURE_LATENCY', 0))
+LLM_FIXTURE_ERROR_RATE = float(os.getenv('LLM_FIXTURE_ERROR_RATE', 0))
+
+# Stages listings pass through, by name, see nyumbaAI_app.pipeline
+LISTING_PIPELINE = os.getenv('LISTING_PIPELINE', 'normalize,price,geo,dedupe,enrich').split(',')
+
+# Listings per results page / upstream request, upstream pages fetched per
+# paginated request, and how long and how much cursor state is kept
+SEARCH_PAGE_SIZE = int(os.getenv('SEARCH_PAGE_SIZE', 6))
+SEARCH_MAX_PAGES_PER_REQUEST = int(os.getenv('SEARCH_MAX_PAGES_PER_REQUEST', 3))
+SEARCH_CURSOR_TTL = int(os.getenv('SEARCH_CURSOR_TTL', 30 * 60))
+SEARCH_CURSOR_MAX_SEEN = int(os.getenv('SEARCH_CURSOR_MAX_SEEN', 1000))
+
+# Stored searches younger than SEARCH_FRESH_SECONDS are served from the
+# database; up to SEARCH_STALE_SECONDS they are served while refreshing
+SEARCH_FRESH_SECONDS = int(os.getenv('SEARCH_FRESH_SECONDS', 60 * 60))
+SEARCH_STALE_SECONDS = int(os.getenv('SEARCH_STALE_SECONDS', 24 * 60 * 60))
+
+# Client-side protection of the upstream APIs. Rate limits are per process and
+# should be sized to the plan quota divided by the number of workers (0 turns
+# a limit off); calls that would wait longer than UPSTREAM_MAX_WAIT_SECONDS for
+# a token fail instead. Transient errors (timeouts, 429, 5xx) are retried with
+# jittered exponential backoff, and after UPSTREAM_CIRCUIT_FAILURES consecutive
+# failures a provider is skipped for UPSTREAM_CIRCUIT_RESET_SECONDS. Meanwhile
+# results up to UPSTREAM_STALE_SECONDS old are served from the caches.
+SEARCH_RATE_PER_MINUTE = float(os.getenv('SEARCH_RATE_PER_MINUTE', 15))
+SEARCH_RATE_BURST = int(os.getenv('SEARCH_RATE_BURST', 5))
+LLM_RATE_PER_MINUTE = float(os.getenv('LLM_RATE_PER_MINUTE', 30))
+LLM_RATE_BURST = int(os.getenv('LLM_RATE_BURST', 5))
+UPSTREAM_MAX_WAIT_SECONDS = float(os.getenv('UPSTREAM_MAX_WAIT_SECONDS', 10))
+UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', 2))
+UPSTREAM_BACKOFF_SECONDS = float(os.getenv('UPSTREAM_BACKOFF_SECONDS', 0.5))
+UPSTREAM_BACKOFF_MAX_SECONDS = float(os.getenv('UPSTREAM_BACKOFF_MAX_SECONDS', 8))
+UPSTREAM_CIRCUIT_FAILURES = int(os.getenv('UPSTREAM_CIRCUIT_FAILURES', 5))
+UPSTREAM_CIRCUIT_RESET_SECONDS = float(os.getenv('UPSTREAM_CIRCUIT_RESET_SECONDS', 30))
+UPSTREAM_STALE_SECONDS = int(os.getenv('UPSTREAM_STALE_SECONDS', 24 * 60 * 60))
+
+# The sync search view queues the LLM analysis as a database job instead of
+# streaming it from the request. ANALYSIS_JOB_WORKERS threads per process
+# consume the queue; set it to 0 and run `manage.py run_analysis_jobs` to
+# consume it elsewhere. Failed jobs, and running jobs older than
+# ANALYSIS_JOB_TIMEOUT seconds (assumed lost), are retried, up to
+# ANALYSIS_JOB_MAX_ATTEMPTS runs in all. A failed job waits
+# ANALYSIS_JOB_RETRY_SECONDS before its first retry, doubling after each
+# failure up to ANALYSIS_JOB_RETRY_MAX_SECONDS, so an outage (e.g. an open
+# upstream circuit) doesn't use up its attempts at once.
+ANALYSIS_JOBS = os.getenv('ANALYSIS_JOBS', 'True') == 'True'
+ANALYSIS_JOB_WORKERS = int(os.getenv('ANALYSIS_JOB_WORKERS', 4))
+ANALYSIS_JOB_TIMEOUT = int(os.getenv('ANALYSIS_JOB_TIMEOUT', 5 * 60))
+ANALYSIS_JOB_MAX_ATTEMPTS = int(os.getenv('ANALYSIS_JOB_MAX_ATTEMPTS', 3))
+ANALYSIS_JOB_RETRY_SECONDS = float(os.getenv('ANALYSIS_JOB_RETRY_SECONDS', 10))
+ANALYSIS_JOB_RETRY_MAX_SECONDS = float(os.getenv('ANALYSIS_JOB_RETRY_MAX_SECONDS', 5 * 60))
+
+# Concurrent identical searches/analyses share one upstream call. With
+# SINGLEFLIGHT_SHARED the leader also holds a lock in the shared cache so other
+# processes wait for its result (needs a shared cache backend); waiters give
+# up and call upstream themselves after SINGLEFLIGHT_WAIT_SECONDS
+SINGLEFLIGHT_SHARED = os.getenv('SINGLEFLIGHT_SHARED') == 'True'
+SINGLEFLIGHT_WAIT_SECONDS = float(os.getenv('SINGLEFLIGHT_WAIT_SECONDS', 30))
+SINGLEFLIGHT_LOCK_SECONDS = int(os.getenv('SINGLEFLIGHT_LOCK_SECONDS', 60))
+
+# Multi-location searches: concurrent upstream calls, locations accepted per
+# request and merged listings passed to the single analysis call
+BATCH_SEARCH_WORKERS = int(os.getenv('BATCH_SEARCH_WORKERS', 8))
+BATCH_SEARCH_MAX_LOCATIONS = int(os.getenv('BATCH_SEARCH_MAX_LOCATIONS', 20))
+BATCH_ANALYSIS_LISTINGS = int(os.getenv('BATCH_ANALYSIS_LISTINGS', 30))
+
+# Estimated tokens of recent chat turns re-sent with each message; older turns
+# are folded into a running summary
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv('CHAT_HISTORY_TOKEN_BUDGET', 1500))
+
+# Estimated token budgets of prompt sections that grow with the search: the
+# listings table and market facts of the analysis prompt, and the analysis
+# quoted in each chat system prompt
+ANALYSIS_LISTINGS_TOKEN_BUDGET = int(os.getenv('ANALYSIS_LISTINGS_TOKEN_BUDGET', 1200))
+ANALYSIS_FACTS_TOKEN_BUDGET = int(os.getenv('ANALYSIS_FACTS_TOKEN_BUDGET', 400))
+CHAT_ANALYSIS_TOKEN_BUDGET = int(os.getenv('CHAT_ANALYSIS_TOKEN_BUDGET', 800))
+
+# Handled upstream and view errors are logged here (and counted in /metrics)
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'nyumbaAI_app': {
+            'handlers': ['console'],
+            'level': os.getenv('APP_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
+
 WSGI_APPLICATION = "nyumbaAI.wsgi.application"
 
 
 # Database
 # https://docs.djangoproject.com/en/4.2/ref/settings/#databases
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# DB_ENGINE picks SQLite (the default, for a single host) or Postgres.
+#
+# SQLite writers queue for up to SQLITE_BUSY_TIMEOUT seconds instead of
+# failing with "database is locked" (see nyumbaAI_app.db). The journal mode and
+# synchronous level are left as the database file has them unless set:
+# SQLITE_JOURNAL_MODE=WAL stops reads waiting for the writer and
+# SQLITE_SYNCHRONOUS=NORMAL, safe under WAL, saves an fsync per commit. WAL is
+# persistent in the file and keeps -wal/-shm files beside it.
+#
+# Postgres keeps connections open for DB_CONN_MAX_AGE seconds, checked before
+# reuse. DB_POOL=True uses psycopg 3's connection pool instead (Django 5.1+),
+# holding DB_POOL_MIN_SIZE to DB_POOL_MAX_SIZE connections per process.
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', '')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', '')
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', 20))
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": os.getenv('DB_NAME', 'nyumbaai'),
+            "USER": os.getenv('DB_USER', 'nyumbaai'),
+            "PASSWORD": os.getenv('DB_PASSWORD', ''),
+            "HOST": os.getenv('DB_HOST', 'localhost'),
+            "PORT": os.getenv('DB_PORT', '5432'),
+            "CONN_MAX_AGE": int(os.getenv('DB_CONN_MAX_AGE', 60)),
+            "CONN_HEALTH_CHECKS": True,
+            "OPTIONS": {},
+        }
     }
+    if os.getenv('DB_POOL', 'False') == 'True':
+        if django.VERSION < (5, 1):
+            raise ImproperlyConfigured("DB_POOL=True needs Django 5.1 or later")
+        # The pool hands out connections per request; persistent connections
+        # must be off with it
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["OPTIONS"]["pool"] = {
+            "min_size": int(os.getenv('DB_POOL_MIN_SIZE', 2)),
+            "max_size": int(os.getenv('DB_POOL_MAX_SIZE', 10)),
+            "timeout": float(os.getenv('DB_POOL_TIMEOUT', 10)),
+        }
+else:
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.getenv('DB_NAME', BASE_DIR / "db.sqlite3"),
+            "OPTIONS": {"timeout": SQLITE_BUSY_TIMEOUT},
+        }
+    }
+    if django.VERSION >= (5, 1):
+        # Take the write lock when a transaction starts. A deferred transaction
+        # that reads first fails at once, without waiting, if another write
+        # committed in between.
+        DATABASES["default"]["OPTIONS"]["transaction_mode"] = "IMMEDIATE"
+
+
+# Caches
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+# locmem evicts least-recently-used entries once MAX_ENTRIES is reached. Point
+# SEARCH_CACHE_BACKEND/SEARCH_CACHE_LOCATION at a shared backend (e.g. Redis)
+# in production so all workers share hits.
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "search_results": {
+        "BACKEND": os.getenv(
+            "SEARCH_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.getenv("SEARCH_CACHE_LOCATION", "search-results"),
+        "TIMEOUT": int(os.getenv("SEARCH_CACHE_TTL", 15 * 60)),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("SEARCH_CACHE_MAX_ENTRIES", 1000)),
+        },
+    },
+    "analysis": {
+        "BACKEND": os.getenv(
+            "ANALYSIS_CACHE_BACKEND", "django.core.cache.backends.locmem.LocMemCache"
+        ),
+        "LOCATION": os.getenv("ANALYSIS_CACHE_LOCATION", "analysis"),
+        "TIMEOUT": int(os.getenv("ANALYSIS_CACHE_TTL", 6 * 60 * 60)),
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", 500)),
+        },
+    },
+    # Last good results, served while an upstream fails. Kept apart so they
+    # don't take room from the live entries above.
+    "search_stale": {
+        "BACKEND": os.getenv(
+            "SEARCH_STALE_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv("SEARCH_STALE_CACHE_LOCATION", "search-stale"),
+        "TIMEOUT": UPSTREAM_STALE_SECONDS,
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("SEARCH_STALE_CACHE_MAX_ENTRIES", 1000)),
+        },
+    },
+    "analysis_stale": {
+        "BACKEND": os.getenv(
+            "ANALYSIS_STALE_CACHE_BACKEND",
+            "django.core.cache.backends.locmem.LocMemCache",
+        ),
+        "LOCATION": os.getenv("ANALYSIS_STALE_CACHE_LOCATION", "analysis-stale"),
+        "TIMEOUT": UPSTREAM_STALE_SECONDS,
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("ANALYSIS_STALE_CACHE_MAX_ENTRIES", 500)),
+        },
+    },
 }
 
 
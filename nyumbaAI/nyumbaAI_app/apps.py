@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class NyumbaaiAppConfig(AppConfig):
     default_auto_field = "django.db.models.BigAutoField"
     name = "nyumbaAI_app"
+
+    def ready(self):
+        # Connect the connection_created and request_started receivers
+        from . import db, jobs  # noqa: F401
@@ -0,0 +1,184 @@
+"""asyncio-native counterparts of the functions in services.py.
+
+These share params, cache keys, prompts and result processing with the sync
+versions and only swap the I/O: the providers' async search and LLM clients
+(httpx and AsyncGroq for the live backends) and Django's async ORM for
+persistence.
+"""
+
+import logging
+from datetime import timedelta
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from . import metrics
+from .cache import analysis_cache, normalize_location, search_cache
+from .models import SearchQuery
+from .providers import async_llm_client, search_provider
+from .services import (
+    analysis_cache_key,
+    analysis_model,
+    build_analysis_prompt,
+    build_search_params,
+    normalize_search_response,
+    save_search,
+    schedule_refresh,
+    search_cache_key,
+    search_listing_rows,
+)
+from .singleflight import analysis_flight, search_flight
+from .timing import timed
+
+logger = logging.getLogger(__name__)
+
+
+async def asearch_houses(location: str, use_cache: bool = True, start: int = 0) -> dict:
+    """Fetch raw API response and normalize structure"""
+    try:
+        if not location or not isinstance(location, str):
+            return {"local_results": []}
+
+        params = build_search_params(location, start)
+        cache_key = search_cache_key(params)
+        if use_cache:
+            cached = await search_cache.aget(cache_key)
+            if cached is not None:
+                return cached
+
+        async def fetch():
+            try:
+                with timed("search"):
+                    response = await search_provider().asearch(params)
+            except Exception as e:
+                # Serve the last good response while the provider is failing
+                stale = await search_cache.aget_stale(cache_key)
+                if stale is None:
+                    raise
+                metrics.errors.inc(where="search")
+                logger.warning("Search error, serving stale results: %s", e)
+                return stale
+            results = normalize_search_response(response)
+            if results is None:
+                return {"local_results": []}
+            await search_cache.aset(cache_key, results)
+            return results
+
+        async def recheck():
+            return await search_cache.backend.aget(cache_key)
+
+        return await search_flight.ado(cache_key, fetch, recheck if use_cache else None)
+
+    except Exception as e:
+        metrics.errors.inc(where="search")
+        logger.warning("Search error: %s", e)
+        return {"local_results": []}
+
+
+async def asave_search(query: str, location: str, listings: List[Dict]) -> SearchQuery:
+    """Persist a search and its listings"""
+    # The async ORM has no transaction support, so run the atomic bulk
+    # insert in a worker thread
+    return await sync_to_async(save_search)(query, location, listings)
+
+
+async def aget_stored_listings(
+    location: str, query: str = ""
+) -> Optional[Tuple[SearchQuery, List[Dict]]]:
+    """Serve a recent stored search for the location, if one exists"""
+    if not location or not isinstance(location, str):
+        return None
+
+    key = normalize_location(location)
+    search_query = await (
+        SearchQuery.objects.filter(normalized_location=key, results_count__gt=0)
+        .order_by("-timestamp")
+        .afirst()
+    )
+    if search_query is None:
+        return None
+
+    age = timezone.now() - search_query.timestamp
+    if age > timedelta(seconds=settings.SEARCH_STALE_SECONDS):
+        return None
+    if age > timedelta(seconds=settings.SEARCH_FRESH_SECONDS):
+        schedule_refresh(location, query)
+
+    return search_query, await aget_search_listings(search_query)
+
+
+async def aget_search_listings(search_query: SearchQuery) -> List[Dict]:
+    """Stored listings of a search as dicts, in the order they were found"""
+    return [listing async for listing in search_listing_rows(search_query)]
+
+
+async def astream_analysis(
+    query: str,
+    listings: List[Dict],
+    on_complete: Optional[Callable[[str], Awaitable[None]]] = None,
+    facts: str = "",
+) -> AsyncIterator[str]:
+    """Yield analysis markdown from Groq as it is generated"""
+    if not listings:
+        yield "No listings available for analysis"
+        return
+
+    model = analysis_model()
+    cache_key = analysis_cache_key(query, listings, model)
+    cached = await analysis_cache.aget(cache_key)
+    future = None
+    if cached is None:
+        # Identical streams on this loop wait for one generation
+        future, leader = analysis_flight.abegin(cache_key)
+        if not leader:
+            try:
+                cached = await analysis_flight.await_(future)
+            except Exception:
+                cached = None
+            future = None
+    if cached is not None:
+        yield cached
+        if on_complete is not None:
+            await on_complete(cached)
+        return
+
+    prompt = build_analysis_prompt(query, listings, facts)
+    parts = []
+    analysis = None
+    try:
+        stream = await async_llm_client().chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=model,
+            temperature=0.2,
+            stream=True,
+        )
+        async for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+        analysis = "".join(parts)
+
+    except Exception as e:
+        metrics.errors.inc(where="analysis")
+        logger.warning("Analysis error: %s", e)
+        if parts:
+            return
+        # Serve the last analysis of these listings while the LLM is failing
+        analysis = await analysis_cache.aget_stale(cache_key)
+        if analysis is None:
+            yield "Could not generate analysis"
+            return
+        yield analysis
+        if on_complete is not None:
+            await on_complete(analysis)
+        return
+    finally:
+        if future is not None:
+            analysis_flight.afinish(cache_key, future, analysis)
+
+    await analysis_cache.aset(cache_key, analysis)
+    if on_complete is not None:
+        await on_complete(analysis)
@@ -0,0 +1,120 @@
+import hashlib
+import json
+import threading
+from typing import Any, Dict, Optional
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace and case so "Westlands " and "westlands" share a key"""
+    return " ".join(text.split()).casefold()
+
+
+normalize_location = normalize_text
+
+
+class ResultCache:
+    """Thin wrapper over a Django cache alias that keeps hit/miss counters.
+
+    TTL and LRU eviction come from the alias configuration in ``settings.CACHES``
+    (``TIMEOUT`` and ``OPTIONS["MAX_ENTRIES"]``), so locmem can be used in
+    development and a shared backend in production without code changes.
+
+    With a ``stale_alias`` every value is also kept there for
+    UPSTREAM_STALE_SECONDS, for ``get_stale`` to serve while the upstream fails.
+    """
+
+    def __init__(self, alias: str, namespace: str, stale_alias: Optional[str] = None):
+        self.alias = alias
+        self.namespace = namespace
+        self.stale_alias = stale_alias
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    @property
+    def stale_backend(self):
+        return caches[self.stale_alias]
+
+    def stale_key(self, key: str) -> str:
+        # Prefixed so both aliases can point at one shared backend
+        return f"stale:{key}"
+
+    def make_key(self, payload: Dict[str, Any]) -> str:
+        """Stable key from a JSON-serializable payload"""
+        blob = json.dumps(payload, sort_keys=True, default=str)
+        digest = hashlib.sha256(blob.encode("utf-8")).hexdigest()
+        return f"{self.namespace}:{digest}"
+
+    def _count(self, value: Optional[Any]) -> None:
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        metrics.cache_lookups.inc(
+            cache=self.namespace, result="miss" if value is None else "hit"
+        )
+
+    def _count_stale(self, value: Optional[Any]) -> None:
+        metrics.cache_lookups.inc(
+            cache=self.namespace, result="stale_miss" if value is None else "stale"
+        )
+
+    def get(self, key: str) -> Optional[Any]:
+        value = self.backend.get(key)
+        self._count(value)
+        return value
+
+    def set(self, key: str, value: Any, timeout: Optional[int] = None) -> None:
+        if timeout is None:
+            self.backend.set(key, value)
+        else:
+            self.backend.set(key, value, timeout)
+        if self.stale_alias:
+            self.stale_backend.set(
+                self.stale_key(key), value, settings.UPSTREAM_STALE_SECONDS
+            )
+
+    def get_stale(self, key: str) -> Optional[Any]:
+        """Last value set for ``key`` even if expired, within the stale window"""
+        value = self.stale_backend.get(self.stale_key(key))
+        self._count_stale(value)
+        return value
+
+    async def aget(self, key: str) -> Optional[Any]:
+        value = await self.backend.aget(key)
+        self._count(value)
+        return value
+
+    async def aset(self, key: str, value: Any, timeout: Optional[int] = None) -> None:
+        if timeout is None:
+            await self.backend.aset(key, value)
+        else:
+            await self.backend.aset(key, value, timeout)
+        if self.stale_alias:
+            await self.stale_backend.aset(
+                self.stale_key(key), value, settings.UPSTREAM_STALE_SECONDS
+            )
+
+    async def aget_stale(self, key: str) -> Optional[Any]:
+        value = await self.stale_backend.aget(self.stale_key(key))
+        self._count_stale(value)
+        return value
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+search_cache = ResultCache("search_results", "search", stale_alias="search_stale")
+analysis_cache = ResultCache("analysis", "analysis", stale_alias="analysis_stale")
+cursor_cache = ResultCache("search_results", "cursor")
@@ -0,0 +1,159 @@
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import connection
+
+from . import metrics
+from .models import ChatMessage, ChatSession, SearchQuery
+from .prompts import estimate_tokens
+from .providers import llm_client
+from .services import build_chat_messages, stream_chat_completion
+
+SUMMARY_PROMPT = """Summarize this conversation between a home buyer and a real estate assistant in under 120 words.
+Keep budgets, preferences, properties and locations that were mentioned.
+
+Earlier summary:
+{summary}
+
+New turns:
+{turns}"""
+
+logger = logging.getLogger(__name__)
+
+_compact_executor: Optional[ThreadPoolExecutor] = None
+_compact_lock = threading.Lock()
+_compacting = set()
+
+
+def start_session(search_query: SearchQuery, query: str) -> ChatSession:
+    """Chat session for a results page; the analysis is attached once generated"""
+    return ChatSession.objects.create(search=search_query, query=query)
+
+
+async def astart_session(search_query: SearchQuery, query: str) -> ChatSession:
+    return await ChatSession.objects.acreate(search=search_query, query=query)
+
+
+def save_analysis(session_id: int, analysis: str) -> None:
+    ChatSession.objects.filter(pk=session_id).update(analysis=analysis)
+
+
+async def asave_analysis(session_id: int, analysis: str) -> None:
+    await ChatSession.objects.filter(pk=session_id).aupdate(analysis=analysis)
+
+
+def history_window(
+    history: List[ChatMessage], budget: int
+) -> Tuple[List[ChatMessage], List[ChatMessage]]:
+    """Split history into the newest turns that fit the budget and the rest.
+
+    A turn is a user message with the replies to it, and is kept or dropped
+    whole so the model never sees a reply without its question.
+    """
+    used = 0
+    start = len(history)
+    while start > 0:
+        turn = start - 1
+        while turn > 0 and history[turn].role != "user":
+            turn -= 1
+        tokens = sum(m.tokens for m in history[turn:start])
+        if used + tokens > budget:
+            break
+        used += tokens
+        start = turn
+    return history[start:], history[:start]
+
+
+def stream_reply(session: ChatSession, user_message: str) -> Iterator[str]:
+    """Stream a reply using the stored analysis and a token-budgeted history"""
+    history = list(session.messages.filter(summarized=False).order_by("id"))
+    window, _ = history_window(history, settings.CHAT_HISTORY_TOKEN_BUDGET)
+    messages = build_chat_messages(
+        user_message,
+        session.analysis,
+        session.summary,
+        [{"role": m.role, "content": m.content} for m in window],
+    )
+
+    parts = []
+    for token in stream_chat_completion(messages):
+        parts.append(token)
+        yield token
+
+    reply = "".join(parts)
+    ChatMessage.objects.bulk_create(
+        [
+            ChatMessage(
+                session=session,
+                role="user",
+                content=user_message,
+                tokens=estimate_tokens(user_message),
+            ),
+            ChatMessage(
+                session=session,
+                role="assistant",
+                content=reply,
+                tokens=estimate_tokens(reply),
+            ),
+        ]
+    )
+
+
+def compact_history(session: ChatSession) -> bool:
+    """Fold turns that fell out of the history window into the session summary"""
+    history = list(session.messages.filter(summarized=False).order_by("id"))
+    _, older = history_window(history, settings.CHAT_HISTORY_TOKEN_BUDGET)
+    if not older:
+        return False
+
+    turns = "\n".join(f"{m.role.title()}: {m.content}" for m in older)
+    completion = llm_client().chat.completions.create(
+        model="mistral-saba-24b",
+        messages=[
+            {
+                "role": "user",
+                "content": SUMMARY_PROMPT.format(
+                    summary=session.summary or "(none)", turns=turns
+                ),
+            }
+        ],
+        temperature=0.2,
+    )
+
+    session.summary = completion.choices[0].message.content
+    session.save(update_fields=["summary"])
+    ChatMessage.objects.filter(pk__in=[m.pk for m in older]).update(summarized=True)
+    return True
+
+
+def schedule_compaction(session_id: int) -> bool:
+    """Summarize a session's old turns in the background unless already running"""
+    global _compact_executor
+
+    with _compact_lock:
+        if session_id in _compacting:
+            return False
+        _compacting.add(session_id)
+        if _compact_executor is None:
+            _compact_executor = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix="chat-summary"
+            )
+    _compact_executor.submit(_compact_session, session_id)
+    return True
+
+
+def _compact_session(session_id: int) -> None:
+    try:
+        session = ChatSession.objects.filter(pk=session_id).first()
+        if session is not None:
+            compact_history(session)
+    except Exception as e:
+        metrics.errors.inc(where="chat_summary")
+        logger.warning("Chat summary error: %s", e)
+    finally:
+        connection.close()
+        with _compact_lock:
+            _compacting.discard(session_id)
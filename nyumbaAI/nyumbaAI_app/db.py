@@ -0,0 +1,31 @@
+"""Per-connection database tuning, applied as each connection opens."""
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+SYNCHRONOUS_LEVELS = {"OFF", "NORMAL", "FULL", "EXTRA"}
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    """Busy timeout, and journal mode and synchronous level when set"""
+    if connection.vendor != "sqlite":
+        return
+    journal_mode = settings.SQLITE_JOURNAL_MODE.upper()
+    synchronous = settings.SQLITE_SYNCHRONOUS.upper()
+    if journal_mode and journal_mode not in JOURNAL_MODES:
+        raise ImproperlyConfigured(f"Unknown SQLITE_JOURNAL_MODE {journal_mode!r}")
+    if synchronous and synchronous not in SYNCHRONOUS_LEVELS:
+        raise ImproperlyConfigured(f"Unknown SQLITE_SYNCHRONOUS {synchronous!r}")
+    with connection.cursor() as cursor:
+        if journal_mode:
+            # Persistent in the database file, but cheap to reassert
+            cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+        if synchronous:
+            cursor.execute(f"PRAGMA synchronous={synchronous}")
+        cursor.execute(
+            f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT * 1000)}"
+        )
@@ -0,0 +1,151 @@
+import math
+from typing import TYPE_CHECKING, List, Sequence, Tuple
+
+# numpy is imported by the radius functions that need it, keeping it out of
+# worker startup
+if TYPE_CHECKING:
+    import numpy as np
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+EARTH_RADIUS_KM = 6371.0088
+
+# Stored precision; 9 characters is a cell of roughly 5 m x 5 m
+GEOHASH_PRECISION = 9
+
+
+def encode_geohash(
+    latitude: float, longitude: float, precision: int = GEOHASH_PRECISION
+) -> str:
+    """Standard base32 geohash of a point"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True  # Geohash interleaves longitude bits first
+
+    while len(chars) < precision:
+        value, bounds = (longitude, lon_range) if even else (latitude, lat_range)
+        mid = (bounds[0] + bounds[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            bounds[0] = mid
+        else:
+            bits *= 2
+            bounds[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+
+    return "".join(chars)
+
+
+def cell_size(precision: int) -> Tuple[float, float]:
+    """(height, width) in degrees of a geohash cell at the given precision"""
+    bits = 5 * precision
+    lat_bits = bits // 2
+    lon_bits = bits - lat_bits
+    return 180.0 / 2**lat_bits, 360.0 / 2**lon_bits
+
+
+def covering_prefixes(
+    min_lat: float, min_lon: float, max_lat: float, max_lon: float, max_cells: int = 32
+) -> List[str]:
+    """Geohash prefixes whose cells together cover the bounding box.
+
+    Uses the finest precision that needs at most ``max_cells`` cells, so the
+    SQL range scans stay few while pruning as many rows as possible.
+    """
+    for precision in range(GEOHASH_PRECISION, 0, -1):
+        height, width = cell_size(precision)
+        rows = int((max_lat - min_lat) / height) + 2
+        cols = int((max_lon - min_lon) / width) + 2
+        if rows * cols > max_cells:
+            continue
+
+        # Sample points no further apart than one cell so every cell the box
+        # touches is hit at least once
+        cells = set()
+        for i in range(rows):
+            lat = min(min_lat + i * height, max_lat)
+            for j in range(cols):
+                lon = min(min_lon + j * width, max_lon)
+                cells.add(encode_geohash(lat, lon, precision))
+        return sorted(cells)
+
+    return [""]
+
+
+def radius_bboxes(
+    latitude: float, longitude: float, radius_km: float
+) -> List[Tuple[float, float, float, float]]:
+    """(min_lat, min_lon, max_lat, max_lon) boxes that together enclose a circle.
+
+    A circle across the antimeridian gets one box on each side of it, and one
+    reaching a pole spans every longitude.
+    """
+    # Same sphere as haversine_km, so the boxes never cut into the circle
+    angle = radius_km / EARTH_RADIUS_KM
+    dlat = math.degrees(angle)
+    min_lat, max_lat = latitude - dlat, latitude + dlat
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return [(max(-90.0, min_lat), -180.0, min(90.0, max_lat), 180.0)]
+
+    # Half-width in longitude at the circle's widest point
+    ratio = math.sin(angle) / math.cos(math.radians(latitude))
+    if ratio >= 1.0:
+        return [(min_lat, -180.0, max_lat, 180.0)]
+    dlon = math.degrees(math.asin(ratio))
+    min_lon, max_lon = longitude - dlon, longitude + dlon
+    if min_lon < -180.0:
+        return [
+            (min_lat, -180.0, max_lat, max_lon),
+            (min_lat, min_lon + 360.0, max_lat, 180.0),
+        ]
+    if max_lon > 180.0:
+        return [
+            (min_lat, min_lon, max_lat, 180.0),
+            (min_lat, -180.0, max_lat, max_lon - 360.0),
+        ]
+    return [(min_lat, min_lon, max_lat, max_lon)]
+
+
+def haversine_km(
+    latitude: float,
+    longitude: float,
+    latitudes: "np.ndarray",
+    longitudes: "np.ndarray",
+) -> "np.ndarray":
+    """Great-circle distances from one point to arrays of points, in km"""
+    import numpy as np
+
+    lat1 = math.radians(latitude)
+    lat2 = np.radians(latitudes)
+    dlat = lat2 - lat1
+    dlon = np.radians(longitudes) - math.radians(longitude)
+    a = np.sin(dlat / 2) ** 2 + math.cos(lat1) * np.cos(lat2) * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def within_radius(
+    latitude: float,
+    longitude: float,
+    latitudes: Sequence[float],
+    longitudes: Sequence[float],
+    radius_km: float,
+) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Indices of points within the radius, nearest first, and their distances"""
+    import numpy as np
+
+    distances = haversine_km(
+        latitude,
+        longitude,
+        np.asarray(latitudes, dtype=float),
+        np.asarray(longitudes, dtype=float),
+    )
+    inside = np.flatnonzero(distances <= radius_km)
+    order = inside[np.argsort(distances[inside], kind="stable")]
+    return order, distances[order]
@@ -0,0 +1,214 @@
+"""Database-backed queue for the LLM analysis of results pages.
+
+The search view enqueues an AnalysisJob and returns with the listings; the
+page then polls for the analysis. Jobs are consumed by a thread pool in the
+web process (ANALYSIS_JOB_WORKERS) or, with that set to 0, by the
+``run_analysis_jobs`` command in a separate process. The job table is the
+queue, so no broker is needed: consumers claim a job with a conditional
+UPDATE, so a job never runs twice at once. A job that fails is queued again
+after an exponential backoff, and one left running by a dead process is
+claimed again after ANALYSIS_JOB_TIMEOUT, for at most ANALYSIS_JOB_MAX_ATTEMPTS
+runs in all. Jobs still queued when a web process starts are drained on its
+first request.
+"""
+
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.dispatch import receiver
+from django.utils import timezone
+
+from . import metrics, timing
+from .chat import save_analysis
+from .models import AnalysisJob, ChatSession
+from .services import generate_analysis, get_search_listings
+from .stats import market_facts
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_draining = 0
+_rewake = False
+_resumed = False
+_lock = threading.Lock()
+
+
+def enqueue_analysis(session: ChatSession) -> AnalysisJob:
+    """Queue the analysis of a results page and wake a consumer"""
+    job = AnalysisJob.objects.create(session=session)
+    metrics.analysis_jobs.inc(outcome="queued")
+    if settings.ANALYSIS_JOB_WORKERS > 0:
+        transaction.on_commit(_wake)
+    return job
+
+
+def _wake_later(delay: float) -> None:
+    """Wake a consumer once a job waiting out its backoff is due"""
+    if settings.ANALYSIS_JOB_WORKERS <= 0:
+        return
+    timer = threading.Timer(delay, _wake)
+    # Left behind on shutdown; the job is resumed by the next process
+    timer.daemon = True
+    timer.start()
+
+
+def _wake() -> None:
+    global _executor, _draining, _rewake
+
+    with _lock:
+        # Each drain runs jobs until the queue is empty, so more drains than
+        # threads would only queue up behind them
+        if _draining >= settings.ANALYSIS_JOB_WORKERS:
+            _rewake = True
+            return
+        _draining += 1
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.ANALYSIS_JOB_WORKERS,
+                thread_name_prefix="analysis-job",
+            )
+    _executor.submit(_drain)
+
+
+@receiver(request_started, dispatch_uid="nyumbaAI_app.jobs.resume_pending")
+def resume_pending(sender, **kwargs) -> None:
+    """Wake the consumers for jobs queued before this process started.
+
+    Runs on the first request rather than at startup, so management commands
+    such as migrate never touch the job table.
+    """
+    global _resumed
+
+    with _lock:
+        if _resumed:
+            return
+        _resumed = True
+    if settings.ANALYSIS_JOB_WORKERS <= 0:
+        return
+    if AnalysisJob.objects.filter(
+        _claimable(), attempts__lt=settings.ANALYSIS_JOB_MAX_ATTEMPTS
+    ).exists():
+        _wake()
+        return
+    # Otherwise the first job still waiting out a backoff
+    due = (
+        AnalysisJob.objects.filter(
+            status=AnalysisJob.PENDING,
+            attempts__lt=settings.ANALYSIS_JOB_MAX_ATTEMPTS,
+        )
+        .order_by("available_at")
+        .values_list("available_at", flat=True)
+        .first()
+    )
+    if due is not None:
+        _wake_later(max(0.0, (due - timezone.now()).total_seconds()))
+
+
+def _drain() -> None:
+    global _draining, _rewake
+
+    try:
+        while True:
+            while run_next():
+                pass
+            with _lock:
+                # A job queued while this drain found the queue empty
+                if not _rewake:
+                    _draining -= 1
+                    return
+                _rewake = False
+    except Exception as e:
+        metrics.errors.inc(where="analysis_job")
+        logger.warning("Analysis queue error: %s", e)
+        with _lock:
+            _draining -= 1
+    finally:
+        # Pool threads outlive requests; don't hold a connection between jobs
+        connection.close()
+
+
+def _claimable() -> Q:
+    now = timezone.now()
+    expired = now - timedelta(seconds=settings.ANALYSIS_JOB_TIMEOUT)
+    return Q(status=AnalysisJob.PENDING, available_at__lte=now) | Q(
+        status=AnalysisJob.RUNNING, started__lt=expired
+    )
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds a job waits after its ``attempts``-th failed run"""
+    return min(
+        settings.ANALYSIS_JOB_RETRY_SECONDS * 2 ** (attempts - 1),
+        settings.ANALYSIS_JOB_RETRY_MAX_SECONDS,
+    )
+
+
+def claim_next() -> Optional[AnalysisJob]:
+    """Mark the oldest claimable job running and return it, None if idle"""
+    candidates = (
+        AnalysisJob.objects.filter(
+            _claimable(), attempts__lt=settings.ANALYSIS_JOB_MAX_ATTEMPTS
+        )
+        .order_by("created")
+        .values_list("pk", flat=True)[:10]
+    )
+    for pk in candidates:
+        # Another consumer may have taken it since the select
+        claimed = AnalysisJob.objects.filter(_claimable(), pk=pk).update(
+            status=AnalysisJob.RUNNING,
+            started=timezone.now(),
+            attempts=F("attempts") + 1,
+        )
+        if claimed:
+            return AnalysisJob.objects.select_related("session__search").get(pk=pk)
+    return None
+
+
+def run_next() -> bool:
+    """Claim and run one job; False when there was nothing to do"""
+    job = claim_next()
+    if job is None:
+        return False
+    run_job(job)
+    return True
+
+
+def run_job(job: AnalysisJob) -> None:
+    session = job.session
+    timing.record("analysis_queue", (job.started - job.created).total_seconds())
+    try:
+        listings = get_search_listings(session.search)
+        facts = market_facts(session.search.location)
+        analysis = generate_analysis(session.query, listings, facts)
+    except Exception as e:
+        metrics.errors.inc(where="analysis_job")
+        logger.warning("Analysis job %s error: %s", job.pk, e)
+        if job.attempts < settings.ANALYSIS_JOB_MAX_ATTEMPTS:
+            # Back to the queue once the backoff has passed
+            delay = retry_delay(job.attempts)
+            AnalysisJob.objects.filter(pk=job.pk).update(
+                status=AnalysisJob.PENDING,
+                error=str(e),
+                available_at=timezone.now() + timedelta(seconds=delay),
+            )
+            metrics.analysis_jobs.inc(outcome="retried")
+            transaction.on_commit(lambda: _wake_later(delay))
+        else:
+            AnalysisJob.objects.filter(pk=job.pk).update(
+                status=AnalysisJob.FAILED, error=str(e), finished=timezone.now()
+            )
+            metrics.analysis_jobs.inc(outcome="failed")
+        return
+
+    save_analysis(session.pk, analysis)
+    AnalysisJob.objects.filter(pk=job.pk).update(
+        status=AnalysisJob.DONE, error="", finished=timezone.now()
+    )
+    metrics.analysis_jobs.inc(outcome="done")
@@ -0,0 +1,71 @@
+import asyncio
+import html
+import re
+import time
+
+from asgiref.sync import sync_to_async
+
+ANALYSIS_URL = re.compile(rb'data-analysis-url="([^"]+)"')
+# Set on results pages whose analysis was queued as a job (ANALYSIS_JOBS)
+ANALYSIS_POLL = re.compile(rb"data-analysis-poll=")
+POLL_SECONDS = 0.02
+
+
+def analysis_url(content):
+    """Analysis stream or job URL from a results page, None if missing"""
+    match = ANALYSIS_URL.search(content)
+    return html.unescape(match.group(1).decode()) if match else None
+
+
+async def aread(response):
+    """Body of a streaming response from the AsyncClient"""
+    # Sync views such as chat stream a plain iterator even under ASGI
+    content = response.streaming_content
+    if hasattr(content, "__aiter__"):
+        return b"".join([part async for part in content])
+    return await sync_to_async(b"".join, thread_sensitive=False)(content)
+
+
+def _job_state(job):
+    """True when done, False when failed, None while still queued or running"""
+    status = job.get("status")
+    if status == "done":
+        return True
+    if status not in ("pending", "running"):
+        return False
+    return None
+
+
+def read_analysis(client, content):
+    """Wait for a results page's analysis like the page does; True once done.
+
+    Queued analyses are polled until the job finishes, streamed ones are read
+    to the end of the stream.
+    """
+    url = analysis_url(content)
+    if url is None:
+        return False
+    if ANALYSIS_POLL.search(content):
+        while True:
+            state = _job_state(client.get(url).json())
+            if state is not None:
+                return state
+            time.sleep(POLL_SECONDS)
+    events = b"".join(client.get(url).streaming_content)
+    return b"event: done" in events
+
+
+async def aread_analysis(client, content):
+    """read_analysis for the AsyncClient"""
+    url = analysis_url(content)
+    if url is None:
+        return False
+    if ANALYSIS_POLL.search(content):
+        while True:
+            response = await client.get(url)
+            state = _job_state(response.json())
+            if state is not None:
+                return state
+            await asyncio.sleep(POLL_SECONDS)
+    events = await aread(await client.get(url))
+    return b"event: done" in events
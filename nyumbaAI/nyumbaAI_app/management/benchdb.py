@@ -0,0 +1,57 @@
+import os
+import subprocess
+import tempfile
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+
+def git_commit():
+    """Commit of the checked-out code, recorded with benchmark results"""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@contextmanager
+def scratch_database():
+    """Point the default connection at a throwaway test database.
+
+    On SQLite the database is file-backed: the default shared-cache in-memory
+    test database locks whole tables, which would serialize concurrent
+    benchmark requests.
+    """
+    setup_test_environment()
+    if connection.vendor == "sqlite":
+        fd, path = tempfile.mkstemp(suffix=".sqlite3")
+        os.close(fd)
+        connection.settings_dict.setdefault("TEST", {})["NAME"] = path
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        yield
+    finally:
+        if connection.vendor == "postgresql":
+            _disconnect_others()
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def _disconnect_others():
+    """Close connections that benchmark threads left open, so the test
+    database can be dropped"""
+    # Django 5.1+ with DB_POOL
+    if getattr(connection, "pool", None) is not None:
+        connection.close_pool()
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT pg_terminate_backend(pid) FROM pg_stat_activity "
+            "WHERE datname = current_database() AND pid <> pg_backend_pid()"
+        )
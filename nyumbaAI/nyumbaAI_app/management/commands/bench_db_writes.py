@@ -0,0 +1,172 @@
+import json
+import random
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection
+from django.test import override_settings
+
+from nyumbaAI_app.chat import start_session
+from nyumbaAI_app.management.benchdb import git_commit, scratch_database
+from nyumbaAI_app.services import save_search
+
+LOCATIONS = ["Kilimani", "Westlands", "Karen", "Lavington", "Runda", "Kileleshwa"]
+
+
+def _listings(rng, count):
+    """Synthetic listings; about a third are properties other searches found"""
+    listings = []
+    for _ in range(count):
+        number = rng.randrange(2_000) if rng.random() < 0.3 else rng.getrandbits(48)
+        amount = rng.randrange(5, 90) * 1_000_000
+        listings.append(
+            {
+                "title": f"Apartment {number}",
+                "price": f"KSh {amount:,}",
+                "price_amount": Decimal(amount),
+                "price_currency": "KES",
+                "address": f"{number} Ngong Road",
+                "link": f"https://example.com/listing/{number}",
+                "latitude": -1.29 + rng.uniform(-0.05, 0.05),
+                "longitude": 36.8 + rng.uniform(-0.05, 0.05),
+                "rating": round(rng.uniform(3, 5), 1),
+            }
+        )
+    return listings
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark parallel search writes (save_search + chat session, as in "
+        "the search view) on a scratch copy of the configured database. Run "
+        "it once per DB_ENGINE / DB_POOL setting to compare them"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--searches", type=int, default=200)
+        parser.add_argument("--listings", type=int, default=20)
+        parser.add_argument("--concurrency", default="1,4,16")
+        parser.add_argument(
+            "--journal-modes",
+            default="WAL,DELETE",
+            help="SQLite journal modes to compare (ignored on other backends)",
+        )
+        parser.add_argument(
+            "--warmup",
+            type=int,
+            default=50,
+            help="Unmeasured searches written before each journal mode",
+        )
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument("--output", default="bench-db-writes.json")
+
+    def handle(self, *args, **options):
+        levels = [int(level) for level in options["concurrency"].split(",")]
+        results = []
+        with scratch_database():
+            vendor = connection.vendor
+            modes = [None]
+            if vendor == "sqlite":
+                modes = [mode.strip() for mode in options["journal_modes"].split(",")]
+            for mode in modes:
+                overrides = {} if mode is None else {"SQLITE_JOURNAL_MODE": mode}
+                with override_settings(**overrides):
+                    # Reconnect so the journal mode applies
+                    connection.close()
+                    # Otherwise whichever mode runs first is measured cold
+                    if options["warmup"]:
+                        self.run_level(1, {**options, "searches": options["warmup"]})
+                    for level in levels:
+                        result = self.run_level(level, options)
+                        result.update(vendor=vendor, journal_mode=mode)
+                        results.append(result)
+                        self.report(result)
+
+        document = {
+            "benchmark": "bench_db_writes",
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "options": {
+                key: options[key] for key in ("searches", "listings", "warmup", "seed")
+            },
+            "database": {
+                "vendor": vendor,
+                "conn_max_age": connection.settings_dict["CONN_MAX_AGE"],
+                "pool": bool(connection.settings_dict["OPTIONS"].get("pool")),
+            },
+            "levels": results,
+        }
+        with open(options["output"], "w") as output:
+            json.dump(document, output, indent=2)
+        self.stdout.write(f"Wrote {options['output']}")
+
+    def run_level(self, concurrency, options):
+        rng = random.Random(options["seed"])
+        work = [
+            (rng.choice(LOCATIONS), _listings(rng, options["listings"]))
+            for _ in range(options["searches"])
+        ]
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def write(item):
+            location, listings = item
+            started = time.perf_counter()
+            try:
+                search = save_search("bench", location, listings)
+                start_session(search, "bench")
+            except OperationalError as e:
+                with lock:
+                    errors.append(str(e))
+                return
+            finally:
+                close_old_connections()
+            with lock:
+                latencies.append(time.perf_counter() - started)
+
+        def run(items):
+            try:
+                for item in items:
+                    write(item)
+            finally:
+                connection.close()
+
+        # Each thread writes its share over its own connection
+        shares = [work[i::concurrency] for i in range(concurrency)]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(run, shares))
+        elapsed = time.perf_counter() - started
+
+        ordered = sorted(latencies)
+        return {
+            "concurrency": concurrency,
+            "searches": len(work),
+            "failed": len(errors),
+            "errors": sorted(set(errors))[:5],
+            "searches_per_second": len(latencies) / elapsed,
+            "listings_per_second": len(latencies) * options["listings"] / elapsed,
+            "p50_ms": statistics.median(ordered) * 1000 if ordered else None,
+            "p95_ms": (
+                ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000
+                if ordered
+                else None
+            ),
+        }
+
+    def report(self, result):
+        mode = f" {result['journal_mode']}" if result["journal_mode"] else ""
+        p50, p95 = result["p50_ms"], result["p95_ms"]
+        latency = f"p50 {p50:.1f} ms, p95 {p95:.1f} ms" if p50 is not None else "-"
+        self.stdout.write(
+            f"{result['vendor']}{mode} concurrency {result['concurrency']}: "
+            f"{result['searches_per_second']:.1f} searches/s "
+            f"({result['listings_per_second']:.0f} listings/s), {latency}, "
+            f"{result['failed']} failed"
+        )
@@ -0,0 +1,127 @@
+import math
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from nyumbaAI_app.geo import encode_geohash
+from nyumbaAI_app.management.benchdb import scratch_database
+from nyumbaAI_app.models import HouseListing
+from nyumbaAI_app.services import find_listings_near
+
+# Synthetic listings cluster around these towns, with some spread worldwide
+CENTERS = [
+    (-1.2864, 36.8172),  # Nairobi
+    (-4.0435, 39.6682),  # Mombasa
+    (-0.0917, 34.7680),  # Kisumu
+    (-0.3031, 36.0800),  # Nakuru
+    (0.5143, 35.2698),  # Eldoret
+]
+
+
+def _naive_near(latitude, longitude, radius_km):
+    """Baseline: scan every stored coordinate with a Python haversine"""
+    lat1 = math.radians(latitude)
+    hits = []
+    rows = HouseListing.objects.values_list("id", "latitude", "longitude")
+    for pk, lat, lon in rows.iterator(chunk_size=10000):
+        lat2 = math.radians(lat)
+        a = (
+            math.sin((lat2 - lat1) / 2) ** 2
+            + math.cos(lat1)
+            * math.cos(lat2)
+            * math.sin(math.radians(lon - longitude) / 2) ** 2
+        )
+        if 2 * 6371.0088 * math.asin(math.sqrt(min(a, 1.0))) <= radius_km:
+            hits.append(pk)
+    return hits
+
+
+def _summary(samples):
+    ordered = sorted(samples)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    return (
+        f"mean {statistics.mean(ordered) * 1000:.2f} ms, "
+        f"p50 {statistics.median(ordered) * 1000:.2f} ms, "
+        f"p95 {p95 * 1000:.2f} ms"
+    )
+
+
+class Command(BaseCommand):
+    help = "Benchmark radius search over synthetic listings on a scratch database"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=1_000_000)
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--baseline-queries", type=int, default=3)
+        parser.add_argument("--radius-km", type=float, default=3.0)
+        parser.add_argument("--batch-size", type=int, default=20_000)
+        parser.add_argument("--seed", type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        with scratch_database():
+            self.populate(rng, options["rows"], options["batch_size"])
+            self.run_queries(rng, options)
+
+    def populate(self, rng, total, batch_size):
+        started = time.perf_counter()
+        written = 0
+        while written < total:
+            batch = []
+            for _ in range(min(batch_size, total - written)):
+                if rng.random() < 0.9:
+                    center_lat, center_lon = rng.choice(CENTERS)
+                    latitude = rng.gauss(center_lat, 0.15)
+                    longitude = rng.gauss(center_lon, 0.15)
+                else:
+                    latitude = rng.uniform(-60, 60)
+                    longitude = rng.uniform(-180, 180)
+                batch.append(
+                    HouseListing(
+                        title="Synthetic listing",
+                        address="",
+                        latitude=latitude,
+                        longitude=longitude,
+                        geohash=encode_geohash(latitude, longitude),
+                    )
+                )
+            with transaction.atomic():
+                HouseListing.objects.bulk_create(batch)
+            written += len(batch)
+        elapsed = time.perf_counter() - started
+        self.stdout.write(
+            f"Inserted {written} listings in {elapsed:.1f}s "
+            f"({written / elapsed:.0f} rows/s)"
+        )
+
+    def run_queries(self, rng, options):
+        radius_km = options["radius_km"]
+        points = []
+        for _ in range(options["queries"]):
+            center_lat, center_lon = rng.choice(CENTERS)
+            points.append((rng.gauss(center_lat, 0.1), rng.gauss(center_lon, 0.1)))
+
+        timings = []
+        found = []
+        for latitude, longitude in points:
+            started = time.perf_counter()
+            results = find_listings_near(latitude, longitude, radius_km, limit=50)
+            timings.append(time.perf_counter() - started)
+            found.append(len(results))
+        self.stdout.write(
+            f"geohash + haversine ({len(points)} queries, {radius_km} km, "
+            f"limit 50): {_summary(timings)}"
+        )
+
+        baseline = []
+        for latitude, longitude in points[: options["baseline_queries"]]:
+            started = time.perf_counter()
+            _naive_near(latitude, longitude, radius_km)
+            baseline.append(time.perf_counter() - started)
+        if baseline:
+            self.stdout.write(
+                f"full scan baseline ({len(baseline)} queries): {_summary(baseline)}"
+            )
@@ -0,0 +1,133 @@
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from nyumbaAI_app.pipeline import iter_jsonl, run_pipeline
+from nyumbaAI_app.pricing import parse_price
+
+PRICES = ["$350,000", "KSh 12M", "Ksh 45,000 per month", "€1.2m", "Price on request"]
+
+
+def _synthetic_item(rng, index):
+    """A raw SerpAPI local result; roughly one in ten repeats an earlier one"""
+    if index and rng.random() < 0.1:
+        index = rng.randrange(index)
+    item = {
+        "title": f"House {index}",
+        "price": PRICES[index % len(PRICES)],
+        "address": f"{index} Riverside Drive, Nairobi",
+        "gps_coordinates": {
+            "latitude": -1.28 + (index % 1000) * 1e-4,
+            "longitude": 36.81 + (index // 1000) * 1e-4,
+        },
+        "rating": round(3 + (index % 20) / 10, 1),
+        "description": "Spacious family home",
+    }
+    if index % 3 == 0:
+        item["link"] = f"https://example.com/listings/{index}"
+    elif index % 3 == 1:
+        item["directions"] = {"google_url": f"https://maps.google.com/?cid={index}"}
+    return item
+
+
+def _legacy_process(items):
+    """Baseline: the eager list-building version process_search_results replaced"""
+    processed = []
+    for item in items:
+        price = item.get("price", "Price Not Available")
+        price_amount, price_currency = parse_price(price)
+        processed.append(
+            {
+                "title": item.get("title", "No Title Available"),
+                "price": price,
+                "price_amount": price_amount,
+                "price_currency": price_currency,
+                "address": item.get("address", "Address Not Available"),
+                "latitude": item.get("gps_coordinates", {}).get("latitude"),
+                "longitude": item.get("gps_coordinates", {}).get("longitude"),
+                "rating": item.get("rating"),
+                "description": item.get("description", "No Description Available"),
+                "link": item.get("link")
+                or item.get("links", {}).get("website")
+                or item.get("directions", {}).get("google_url")
+                or "#",
+            }
+        )
+    return processed
+
+
+def _drain(listings):
+    count = 0
+    for _ in listings:
+        count += 1
+    return count
+
+
+class Command(BaseCommand):
+    help = "Benchmark listings per second through the processing pipeline"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=200_000)
+        parser.add_argument("--seed", type=int, default=42)
+        parser.add_argument(
+            "--jsonl",
+            help="Stream this JSONL dump instead of a generated one",
+        )
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        total = options["items"]
+        items = [_synthetic_item(rng, index) for index in range(total)]
+        stages = list(settings.LISTING_PIPELINE)
+
+        started = time.perf_counter()
+        _legacy_process(items)
+        self.report("legacy list build", total, time.perf_counter() - started)
+
+        # Cumulative prefixes show what each stage adds
+        for end in range(1, len(stages) + 1):
+            started = time.perf_counter()
+            kept = _drain(run_pipeline(items, stages[:end]))
+            self.report(
+                " > ".join(stages[:end]), total, time.perf_counter() - started, kept
+            )
+
+        path = options["jsonl"]
+        if path is None:
+            fd, path = tempfile.mkstemp(suffix=".jsonl")
+            with os.fdopen(fd, "w") as dump:
+                for item in items:
+                    dump.write(json.dumps(item) + "\n")
+        del items
+
+        try:
+            with open(path) as dump:
+                read = _drain(iter_jsonl(dump))
+            started = time.perf_counter()
+            with open(path) as dump:
+                kept = _drain(run_pipeline(iter_jsonl(dump), stages))
+            elapsed = time.perf_counter() - started
+            self.report(f"JSONL {os.path.basename(path)}", read, elapsed, kept)
+
+            # Separate pass: tracing allocations slows everything down
+            tracemalloc.start()
+            with open(path) as dump:
+                _drain(run_pipeline(iter_jsonl(dump), stages))
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            self.stdout.write(f"  peak traced memory {peak / 2**20:.1f} MiB")
+        finally:
+            if options["jsonl"] is None:
+                os.remove(path)
+
+    def report(self, label, total, elapsed, kept=None):
+        line = f"{label}: {total / elapsed:,.0f} items/s ({elapsed:.2f}s)"
+        if kept is not None and kept != total:
+            line += f", {kept} kept"
+        self.stdout.write(line)
@@ -0,0 +1,298 @@
+import asyncio
+import json
+import re
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from unittest import mock
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import AsyncClient, Client, override_settings
+
+from nyumbaAI_app import jobs, timing
+from nyumbaAI_app.management.benchclient import aread, aread_analysis, read_analysis
+from nyumbaAI_app.management.benchdb import git_commit, scratch_database
+
+SESSION_ID = re.compile(rb"&session=(\d+)")
+
+STAGES = (
+    "search",
+    "process",
+    "db_write",
+    "render",
+    "analysis_queue",
+    "analysis",
+    "markdown",
+    "chat",
+)
+
+
+def _percentiles(samples):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.mean(ordered) * 1000,
+        "p50_ms": at(0.50) * 1000,
+        "p95_ms": at(0.95) * 1000,
+        "p99_ms": at(0.99) * 1000,
+    }
+
+
+def _session_id(content):
+    match = SESSION_ID.search(content)
+    return match.group(1).decode() if match else None
+
+
+class Flow:
+    """One user: search, read the streamed analysis, ask chat questions"""
+
+    def __init__(self, index, chat_messages):
+        self.index = index
+        self.chat_messages = chat_messages
+        self.latencies = {"search": [], "analysis": [], "chat": []}
+        self.stages = {}
+        self.ok = False
+
+    def post_data(self, mode):
+        # Unique location and query so every cache tier misses
+        return {
+            "location": f"bench-{mode}-{self.index}",
+            "query": f"bench {self.index}",
+        }
+
+    def measure(self, kind, started):
+        self.latencies[kind].append(time.perf_counter() - started)
+
+    def add_stages(self, stages):
+        for stage, seconds in stages.items():
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+
+class JobStages:
+    """Stage timings of queued analyses, by the session they were queued for.
+
+    Jobs run on the consumer threads, outside the flow that queued them, so
+    their stages would otherwise be missing from the flow's breakdown.
+    """
+
+    def __init__(self):
+        self.sessions = {}
+        self.run_job = jobs.run_job
+
+    def __call__(self, job):
+        with timing.collect() as stages:
+            # Registered before the job runs: the flow may see it done
+            # before this thread leaves the block
+            self.sessions[str(job.session_id)] = stages
+            self.run_job(job)
+
+    def pop(self, session):
+        return self.sessions.pop(session, {})
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the search, analysis stream and chat paths end to end against "
+        "the fixture providers and write the results as JSON"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--concurrency",
+            default="1,4,16",
+            help="Comma-separated concurrency levels",
+        )
+        parser.add_argument(
+            "--requests", type=int, default=50, help="Search flows per level"
+        )
+        parser.add_argument(
+            "--chat-messages", type=int, default=2, help="Chat turns per flow"
+        )
+        parser.add_argument(
+            "--asgi",
+            action="store_true",
+            help="Drive the async views through the ASGI handler",
+        )
+        parser.add_argument("--search-latency", type=float, default=0.0)
+        parser.add_argument("--llm-latency", type=float, default=0.0)
+        parser.add_argument("--output", default="bench-requests.json")
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options["concurrency"].split(",")]
+        except ValueError:
+            raise CommandError("--concurrency must be comma-separated integers")
+
+        mode = "asgi" if options["asgi"] else "wsgi"
+        providers = override_settings(
+            SEARCH_PROVIDER="fixture",
+            LLM_PROVIDER="fixture",
+            SEARCH_FIXTURE_LATENCY=options["search_latency"],
+            LLM_FIXTURE_LATENCY=options["llm_latency"],
+            SEARCH_FIXTURE_ERROR_RATE=0.0,
+            LLM_FIXTURE_ERROR_RATE=0.0,
+            # The fixtures have no quota to protect
+            SEARCH_RATE_PER_MINUTE=0,
+            LLM_RATE_PER_MINUTE=0,
+        )
+        results = []
+        self.job_stages = JobStages()
+        with scratch_database(), providers, mock.patch.object(
+            jobs, "run_job", self.job_stages
+        ):
+            for level in levels:
+                flows = [
+                    Flow(f"{level}-{i}", options["chat_messages"])
+                    for i in range(options["requests"])
+                ]
+                started = time.perf_counter()
+                if options["asgi"]:
+                    asyncio.run(self.run_async(flows, level))
+                else:
+                    self.run_sync(flows, level)
+                elapsed = time.perf_counter() - started
+                results.append(self.summarize(flows, level, elapsed))
+                self.report(mode, results[-1])
+
+        document = {
+            "benchmark": "bench_requests",
+            "mode": mode,
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "options": {
+                key: options[key]
+                for key in (
+                    "requests",
+                    "chat_messages",
+                    "search_latency",
+                    "llm_latency",
+                )
+            },
+            "levels": results,
+        }
+        with open(options["output"], "w") as output:
+            json.dump(document, output, indent=2)
+        self.stdout.write(f"Wrote {options['output']}")
+
+    def run_sync(self, flows, concurrency):
+        def run(flow):
+            with timing.collect() as stages:
+                client = Client()
+                started = time.perf_counter()
+                response = client.post("/search/", flow.post_data("wsgi"))
+                flow.measure("search", started)
+                session = _session_id(response.content)
+                if session is None:
+                    return
+
+                started = time.perf_counter()
+                analyzed = read_analysis(client, response.content)
+                flow.measure("analysis", started)
+
+                events = b""
+                for turn in range(flow.chat_messages):
+                    started = time.perf_counter()
+                    reply = client.post(
+                        "/chat/",
+                        {"message": f"Question {turn}?", "session": session},
+                    )
+                    events += b"".join(reply.streaming_content)
+                    flow.measure("chat", started)
+                flow.ok = (
+                    analyzed and events.count(b"event: done") == flow.chat_messages
+                )
+            flow.stages = stages
+            flow.add_stages(self.job_stages.pop(session))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(run, flows))
+
+    async def run_async(self, flows, concurrency):
+        semaphore = asyncio.Semaphore(concurrency)
+        client = AsyncClient()
+
+        async def run(flow):
+            async with semaphore:
+                with timing.collect() as stages:
+                    started = time.perf_counter()
+                    response = await client.post(
+                        "/search/async/", flow.post_data("asgi")
+                    )
+                    flow.measure("search", started)
+                    session = _session_id(response.content)
+                    if session is None:
+                        return
+
+                    started = time.perf_counter()
+                    analyzed = await aread_analysis(client, response.content)
+                    flow.measure("analysis", started)
+
+                    events = b""
+                    for turn in range(flow.chat_messages):
+                        started = time.perf_counter()
+                        reply = await client.post(
+                            "/chat/",
+                            {"message": f"Question {turn}?", "session": session},
+                        )
+                        events += await aread(reply)
+                        flow.measure("chat", started)
+                    flow.ok = (
+                        analyzed and events.count(b"event: done") == flow.chat_messages
+                    )
+                flow.stages = stages
+                flow.add_stages(self.job_stages.pop(session))
+
+        await asyncio.gather(*(run(flow) for flow in flows))
+
+    def summarize(self, flows, concurrency, elapsed):
+        completed = [flow for flow in flows if flow.ok]
+        requests = sum(
+            len(samples) for flow in flows for samples in flow.latencies.values()
+        )
+        return {
+            "concurrency": concurrency,
+            "flows": len(flows),
+            "failed": len(flows) - len(completed),
+            "requests": requests,
+            "seconds": elapsed,
+            "requests_per_second": requests / elapsed if elapsed else 0.0,
+            "latency": {
+                kind: _percentiles(
+                    [sample for flow in flows for sample in flow.latencies[kind]]
+                )
+                for kind in ("search", "analysis", "chat")
+            },
+            # Per search flow, summed over its requests
+            "stages": {
+                stage: _percentiles(
+                    [flow.stages[stage] for flow in completed if stage in flow.stages]
+                )
+                for stage in STAGES
+            },
+        }
+
+    def report(self, mode, level):
+        self.stdout.write(
+            f"{mode} concurrency {level['concurrency']}: "
+            f"{level['requests_per_second']:.1f} req/s over {level['requests']} "
+            f"requests, {level['failed']} failed flows"
+        )
+        for kind, stats in level["latency"].items():
+            if stats:
+                self.stdout.write(
+                    f"  {kind:<9} p50 {stats['p50_ms']:8.1f} ms  "
+                    f"p95 {stats['p95_ms']:8.1f} ms  p99 {stats['p99_ms']:8.1f} ms"
+                )
+        for stage, stats in level["stages"].items():
+            if stats:
+                self.stdout.write(
+                    f"  stage {stage:<14} p50 {stats['p50_ms']:8.2f} ms  "
+                    f"p95 {stats['p95_ms']:8.2f} ms"
+                )
@@ -0,0 +1,131 @@
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from nyumbaAI_app.management.benchdb import git_commit
+
+# Boot a worker the way gunicorn/uvicorn do, then load the URLconf (and with it
+# every view module) as the first request would, and report time and memory
+WORKER = """
+import json, resource, time
+started = time.perf_counter()
+from nyumbaAI.{entry} import application
+from django.urls import get_resolver
+get_resolver().url_patterns
+seconds = time.perf_counter() - started
+rss_kb = None
+try:
+    with open("/proc/self/status") as status:
+        for line in status:
+            if line.startswith("VmRSS:"):
+                rss_kb = int(line.split()[1])
+except OSError:
+    rss_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print(json.dumps({{"import_seconds": seconds, "rss_kb": rss_kb}}))
+"""
+
+IMPORTTIME = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \| (\s*)(\S+)")
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure cold-start time and RSS of a fresh web worker, with a "
+        "per-package breakdown from python -X importtime"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=5)
+        parser.add_argument("--asgi", action="store_true")
+        parser.add_argument(
+            "--top", type=int, default=15, help="Packages listed in the breakdown"
+        )
+        parser.add_argument("--output", default="bench-startup.json")
+
+    def handle(self, *args, **options):
+        entry = "asgi" if options["asgi"] else "wsgi"
+        script = WORKER.format(entry=entry)
+        env = {
+            **os.environ,
+            "DJANGO_SETTINGS_MODULE": os.environ.get(
+                "DJANGO_SETTINGS_MODULE", settings.SETTINGS_MODULE
+            ),
+        }
+
+        runs = []
+        for _ in range(options["runs"]):
+            started = time.perf_counter()
+            output = self.run_worker([sys.executable, "-c", script], env)
+            wall = time.perf_counter() - started
+            runs.append({**json.loads(output.stdout), "wall_seconds": wall})
+
+        # One more run for the breakdown; importtime itself slows imports down
+        traced = self.run_worker(
+            [sys.executable, "-X", "importtime", "-c", script], env
+        )
+        packages = self.breakdown(traced.stderr)
+
+        summary = {
+            "wall_seconds": statistics.median(run["wall_seconds"] for run in runs),
+            "import_seconds": statistics.median(run["import_seconds"] for run in runs),
+            "rss_mb": statistics.median(run["rss_kb"] for run in runs) / 1024,
+        }
+        self.stdout.write(
+            f"{entry} worker cold start over {len(runs)} runs (median): "
+            f"{summary['wall_seconds'] * 1000:.0f} ms wall, "
+            f"{summary['import_seconds'] * 1000:.0f} ms importing the app, "
+            f"{summary['rss_mb']:.1f} MB RSS"
+        )
+        self.stdout.write("Import time by top-level package (-X importtime, self):")
+        for name, micros, modules in packages[: options["top"]]:
+            self.stdout.write(
+                f"  {name:<24} {micros / 1000:8.1f} ms  {modules} modules"
+            )
+
+        document = {
+            "benchmark": "bench_startup",
+            "entry": entry,
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "python": sys.version.split()[0],
+            "summary": summary,
+            "runs": runs,
+            "packages": [
+                {"package": name, "self_ms": micros / 1000, "modules": modules}
+                for name, micros, modules in packages
+            ],
+        }
+        with open(options["output"], "w") as output:
+            json.dump(document, output, indent=2)
+        self.stdout.write(f"Wrote {options['output']}")
+
+    def run_worker(self, command, env):
+        result = subprocess.run(
+            command, capture_output=True, text=True, env=env, cwd=settings.BASE_DIR
+        )
+        if result.returncode != 0:
+            raise CommandError(f"Worker failed to start:\n{result.stderr[-2000:]}")
+        return result
+
+    def breakdown(self, stderr):
+        """(package, self microseconds, module count), slowest first"""
+        micros = defaultdict(int)
+        modules = defaultdict(int)
+        for line in stderr.splitlines():
+            match = IMPORTTIME.match(line)
+            if match:
+                package = match.group(4).split(".")[0]
+                micros[package] += int(match.group(1))
+                modules[package] += 1
+        return sorted(
+            ((name, micros[name], modules[name]) for name in micros),
+            key=lambda item: -item[1],
+        )
@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from nyumbaAI_app.models import HouseListing, SearchResult
+from nyumbaAI_app.services import row_fingerprint
+
+
+class Command(BaseCommand):
+    help = (
+        "Fingerprint listings stored before deduplication, or under an older "
+        "fingerprint, and merge the ones that are the same property"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=2000)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Report what would be merged without writing",
+        )
+
+    def handle(self, *args, **options):
+        # Fingerprint -> id of the row kept for it. Newest rows are seen first,
+        # so each property keeps its most recent data.
+        keepers = {}
+        kept = merged = 0
+        last_id = None
+        while True:
+            stored = HouseListing.objects.all()
+            if last_id is not None:
+                stored = stored.filter(pk__lt=last_id)
+            rows = list(stored.order_by("-pk")[: options["batch_size"]])
+            if not rows:
+                break
+            last_id = rows[-1].pk
+
+            fingerprints = {row.pk: row_fingerprint(row) for row in rows}
+            # Rows already under their current fingerprint need no change
+            stale = [row for row in rows if row.fingerprint != fingerprints[row.pk]]
+            if not stale:
+                continue
+            keepers.update(
+                HouseListing.objects.filter(
+                    fingerprint__in={fingerprints[row.pk] for row in stale}
+                ).values_list("fingerprint", "pk")
+            )
+            fresh, duplicates = [], []
+            for row in stale:
+                fingerprint = fingerprints[row.pk]
+                if fingerprint in keepers:
+                    duplicates.append((row.pk, keepers[fingerprint]))
+                else:
+                    keepers[fingerprint] = row.pk
+                    row.fingerprint = fingerprint
+                    fresh.append(row)
+            kept += len(fresh)
+            merged += len(duplicates)
+            if not options["dry_run"]:
+                with transaction.atomic():
+                    HouseListing.objects.bulk_update(fresh, ["fingerprint"])
+                    self.merge(duplicates)
+
+        verb = "Would merge" if options["dry_run"] else "Merged"
+        self.stdout.write(
+            f"{verb} {merged} duplicate listings; {kept} listings re-fingerprinted"
+        )
+
+    def merge(self, duplicates):
+        """Move each duplicate's search links to its keeper, then delete it"""
+        for duplicate, keeper in duplicates:
+            # A search that found both keeps its link to the keeper only
+            SearchResult.objects.filter(
+                listing_id=duplicate,
+                search_id__in=SearchResult.objects.filter(listing_id=keeper).values(
+                    "search_id"
+                ),
+            ).delete()
+            SearchResult.objects.filter(listing_id=duplicate).update(listing_id=keeper)
+        HouseListing.objects.filter(
+            pk__in=[duplicate for duplicate, _ in duplicates]
+        ).delete()
@@ -0,0 +1,171 @@
+import gzip
+import time
+from datetime import timezone
+from multiprocessing import Pool
+
+import django
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from nyumbaAI_app.pipeline import iter_json_array, iter_json_lines
+from nyumbaAI_app.services import process_search_results, save_searches
+
+
+def _open(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8")
+    return open(path, encoding="utf-8")
+
+
+def _is_jsonl(path):
+    return path.endswith((".jsonl", ".ndjson", ".jsonl.gz", ".ndjson.gz"))
+
+
+def _iter_records(path, on_error=None):
+    """Responses of a dump, one per JSONL line or per element of a JSON array.
+
+    Both are read incrementally, so memory does not grow with the dump.
+    """
+    with _open(path) as dump:
+        if _is_jsonl(path):
+            yield from iter_json_lines(dump, on_error)
+        else:
+            yield from iter_json_array(dump)
+
+
+def _crawl_time(response):
+    """When SerpAPI ran the search (search_metadata.created_at), None if unknown"""
+    created = (response.get("search_metadata") or {}).get("created_at")
+    if not isinstance(created, str):
+        return None
+    # SerpAPI writes "2024-01-15 10:20:30 UTC"
+    created = created.strip()
+    if created.endswith(" UTC"):
+        created = created[: -len(" UTC")] + "+00:00"
+    try:
+        crawled = parse_datetime(created)
+    except ValueError:
+        return None
+    if crawled is not None and crawled.tzinfo is None:
+        crawled = crawled.replace(tzinfo=timezone.utc)
+    return crawled
+
+
+def _parse_record(response, query="", location=""):
+    """save_searches tuple for one raw google_local response, or None.
+
+    Carries the crawl time when the response records it, so archived searches
+    are not taken for fresh ones.
+    """
+    if not isinstance(response, dict) or "local_results" not in response:
+        return None
+
+    params = response.get("search_parameters") or {}
+    location = location or params.get("location_requested") or params.get("location")
+    if not location:
+        return None
+    search = (
+        query or params.get("q", ""),
+        location,
+        process_search_results(response),
+    )
+    crawled = _crawl_time(response)
+    return search if crawled is None else (*search, crawled)
+
+
+def _parse_worker(args):
+    return _parse_record(*args)
+
+
+class Command(BaseCommand):
+    help = "Load raw SerpAPI google_local responses from JSON/JSONL dumps"
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help=".json, .jsonl or gzipped")
+        parser.add_argument(
+            "--query", default="", help="Query to record instead of search_parameters.q"
+        )
+        parser.add_argument(
+            "--location",
+            default="",
+            help="Location to record instead of search_parameters.location",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=5000,
+            help="Listings per transaction",
+        )
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=0,
+            help="Parse in this many processes (0 parses in this process)",
+        )
+
+    def handle(self, *args, **options):
+        self.chunk_size = options["chunk_size"]
+        self.batch_size = options["batch_size"]
+        self.pending = []
+        self.pending_listings = 0
+        self.searches = self.listings = self.skipped = 0
+
+        started = time.perf_counter()
+        pool = None
+        if options["workers"] > 0:
+            pool = Pool(options["workers"], initializer=django.setup)
+        try:
+            for path in options["paths"]:
+                tasks = (
+                    (record, options["query"], options["location"])
+                    for record in _iter_records(path, self.skip)
+                )
+                if pool is None:
+                    parsed = map(_parse_worker, tasks)
+                else:
+                    parsed = pool.imap(_parse_worker, tasks, chunksize=64)
+                try:
+                    for search in parsed:
+                        self.add(search)
+                except (OSError, ValueError) as e:
+                    raise CommandError(f"Could not read {path}: {e}")
+                self.flush()
+                self.stdout.write(
+                    f"{path}: {self.searches} searches, {self.listings} listings so far"
+                )
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+        elapsed = time.perf_counter() - started
+        rows = self.searches + self.listings
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Ingested {self.searches} searches and {self.listings} listings "
+                f"in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s), "
+                f"skipped {self.skipped} records"
+            )
+        )
+
+    def skip(self, line):
+        self.skipped += 1
+
+    def add(self, search):
+        if search is None:
+            self.skipped += 1
+            return
+        self.pending.append(search)
+        self.pending_listings += len(search[2]) + 1
+        if self.pending_listings >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if not self.pending:
+            return
+        save_searches(self.pending, batch_size=self.batch_size)
+        self.searches += len(self.pending)
+        self.listings += sum(len(search[2]) for search in self.pending)
+        self.pending = []
+        self.pending_listings = 0
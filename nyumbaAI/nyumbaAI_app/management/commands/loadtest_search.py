@@ -0,0 +1,118 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client, override_settings
+
+from nyumbaAI_app.management.benchclient import aread_analysis, read_analysis
+from nyumbaAI_app.management.benchdb import scratch_database
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare search throughput (results page plus its analysis) of the "
+        "sync and async views against the replaying fixture providers"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=100)
+        parser.add_argument(
+            "--sync-workers",
+            type=int,
+            default=4,
+            help="Concurrent requests on the sync path (one per worker)",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=100,
+            help="In-flight requests on the single async event loop",
+        )
+        parser.add_argument("--search-latency", type=float, default=1.0)
+        parser.add_argument("--llm-latency", type=float, default=4.0)
+        parser.add_argument("--error-rate", type=float, default=0.0)
+
+    def handle(self, *args, **options):
+        providers = override_settings(
+            SEARCH_PROVIDER="fixture",
+            LLM_PROVIDER="fixture",
+            SEARCH_FIXTURE_LATENCY=options["search_latency"],
+            LLM_FIXTURE_LATENCY=options["llm_latency"],
+            SEARCH_FIXTURE_ERROR_RATE=options["error_rate"],
+            LLM_FIXTURE_ERROR_RATE=options["error_rate"],
+            # The fixtures have no quota to protect
+            SEARCH_RATE_PER_MINUTE=0,
+            LLM_RATE_PER_MINUTE=0,
+        )
+        with scratch_database(), providers:
+            sync_stats = self.run_sync(options)
+            async_stats = self.run_async(options)
+
+        self.stdout.write(
+            f"{'path':<8}{'concurrency':>12}{'requests':>10}{'seconds':>10}{'req/s':>10}"
+        )
+        for name, stats in (("sync", sync_stats), ("async", async_stats)):
+            self.stdout.write(
+                f"{name:<8}{stats['concurrency']:>12}{stats['requests']:>10}"
+                f"{stats['seconds']:>10.2f}{stats['rps']:>10.2f}"
+            )
+
+    def run_sync(self, options):
+        def post(i):
+            client = Client()
+            # Unique location and query per request so every cache tier misses
+            response = client.post(
+                "/search/",
+                {"location": f"loadtest-sync-{i}", "query": f"loadtest {i}"},
+            )
+            # Failed searches render error.html, which has no analysis URL
+            if response.status_code != 200:
+                return False
+            return read_analysis(client, response.content)
+
+        total = options["requests"]
+        workers = options["sync_workers"]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            statuses = list(pool.map(post, range(total)))
+        elapsed = time.perf_counter() - started
+
+        return self._stats(statuses, workers, elapsed)
+
+    def run_async(self, options):
+        total = options["requests"]
+        concurrency = options["concurrency"]
+
+        async def drive():
+            semaphore = asyncio.Semaphore(concurrency)
+            client = AsyncClient()
+
+            async def post(i):
+                async with semaphore:
+                    response = await client.post(
+                        "/search/async/",
+                        {"location": f"loadtest-async-{i}", "query": f"loadtest {i}"},
+                    )
+                    if response.status_code != 200:
+                        return False
+                    return await aread_analysis(client, response.content)
+
+            return await asyncio.gather(*(post(i) for i in range(total)))
+
+        started = time.perf_counter()
+        statuses = asyncio.run(drive())
+        elapsed = time.perf_counter() - started
+
+        return self._stats(statuses, concurrency, elapsed)
+
+    def _stats(self, outcomes, concurrency, elapsed):
+        failed = outcomes.count(False)
+        if failed:
+            self.stderr.write(f"{failed} requests failed")
+        return {
+            "concurrency": concurrency,
+            "requests": len(outcomes),
+            "seconds": elapsed,
+            "rps": len(outcomes) / elapsed if elapsed else 0.0,
+        }
@@ -0,0 +1,23 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from nyumbaAI_app.stats import rebuild_stats
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute per-location market statistics from stored searches, e.g. "
+        "after migrating or running compact_listings"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=20_000)
+
+    def handle(self, *args, **options):
+        started = time.perf_counter()
+        count = rebuild_stats(chunk_size=options["chunk_size"])
+        self.stdout.write(
+            f"Rebuilt statistics for {count} locations in "
+            f"{time.perf_counter() - started:.2f}s"
+        )
@@ -0,0 +1,57 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from nyumbaAI_app.jobs import run_next
+
+
+class Command(BaseCommand):
+    help = (
+        "Consume queued analysis jobs, for deployments that set "
+        "ANALYSIS_JOB_WORKERS=0 in the web processes"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=4)
+        parser.add_argument(
+            "--poll",
+            type=float,
+            default=1.0,
+            help="Seconds to sleep when the queue is empty",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Exit once the queue is empty",
+        )
+
+    def handle(self, *args, **options):
+        stop = threading.Event()
+        with ThreadPoolExecutor(max_workers=options["workers"]) as pool:
+            futures = [
+                pool.submit(self.consume, stop, options["poll"], options["once"])
+                for _ in range(options["workers"])
+            ]
+            try:
+                ran = sum(future.result() for future in futures)
+            except KeyboardInterrupt:
+                # Let the jobs in progress finish
+                stop.set()
+                ran = sum(future.result() for future in futures)
+        self.stdout.write(f"Ran {ran} analysis jobs")
+
+    def consume(self, stop, poll, once):
+        ran = 0
+        try:
+            while not stop.is_set():
+                if run_next():
+                    ran += 1
+                elif once:
+                    break
+                else:
+                    stop.wait(poll)
+        finally:
+            connection.close()
+        return ran
@@ -0,0 +1,214 @@
+"""In-process counters and histograms exposed in Prometheus text format.
+
+Kept dependency-free and cheap (one lock acquisition per observation) so it
+can stay on in production. Values are per process; with several workers,
+scrape each one or aggregate in Prometheus.
+"""
+
+import bisect
+import threading
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+from . import timing
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry: List["_Metric"] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, str]) -> Tuple:
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self) -> Iterable[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> Iterable[str]:
+        yield from super().render()
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}_total{_labels(self.labelnames, key)} {value}"
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def value(self, **labels: str) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+    def render(self) -> Iterable[str]:
+        yield from super().render()
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_labels(self.labelnames, key)} {value}"
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # Per-bucket counts (made cumulative on render), sum, count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    def render(self) -> Iterable[str]:
+        yield from super().render()
+        with self._lock:
+            values = sorted(
+                (key, (list(counts), total, count))
+                for key, (counts, total, count) in self._values.items()
+            )
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                labels = _labels(self.labelnames, key, f'le="{le}"')
+                yield f"{self.name}_bucket{labels} {cumulative}"
+            labels = _labels(self.labelnames, key)
+            yield f"{self.name}_sum{labels} {total}"
+            yield f"{self.name}_count{labels} {count}"
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+request_seconds = Histogram(
+    "nyumbaai_request_seconds",
+    "Time to produce a response (streamed bodies excluded), by view",
+    ["view", "method", "status"],
+)
+stage_seconds = Histogram(
+    "nyumbaai_stage_seconds",
+    "Time spent per request stage (search, process, db_write, analysis, ...)",
+    ["stage"],
+)
+upstream_calls = Counter(
+    "nyumbaai_upstream_calls",
+    "Calls to the search and LLM providers",
+    ["provider", "outcome"],
+)
+cache_lookups = Counter(
+    "nyumbaai_cache_lookups",
+    "Result cache lookups",
+    ["cache", "result"],
+)
+llm_tokens = Counter(
+    "nyumbaai_llm_tokens",
+    "LLM tokens reported by the provider",
+    ["model", "kind"],
+)
+prompt_tokens = Counter(
+    "nyumbaai_prompt_tokens",
+    "Estimated prompt tokens sent, and saved by fitting prompts to budgets",
+    ["prompt", "kind"],
+)
+coalesced_calls = Counter(
+    "nyumbaai_coalesced_calls",
+    "Upstream calls avoided by waiting on an identical in-flight call",
+    ["flight", "scope"],
+)
+analysis_jobs = Counter(
+    "nyumbaai_analysis_jobs",
+    "Background analysis jobs by outcome (queued, done, retried, failed)",
+    ["outcome"],
+)
+upstream_retries = Counter(
+    "nyumbaai_upstream_retries",
+    "Upstream calls retried after a transient error",
+    ["provider"],
+)
+circuit_state = Gauge(
+    "nyumbaai_circuit_state",
+    "Upstream circuit breaker state: 0 closed, 1 half-open, 2 open",
+    ["provider"],
+)
+rate_limit_wait_seconds = Histogram(
+    "nyumbaai_rate_limit_wait_seconds",
+    "Time upstream calls waited for a client-side rate limit token",
+    ["provider"],
+    buckets=(0.0, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0),
+)
+errors = Counter(
+    "nyumbaai_errors",
+    "Handled errors, by where they happened",
+    ["where"],
+)
+
+
+def record_usage(model: str, usage) -> None:
+    """Count prompt/completion tokens from a provider ``usage`` object"""
+    if usage is None:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        tokens = getattr(usage, kind, None)
+        if tokens:
+            llm_tokens.inc(tokens, model=model or "", kind=kind.split("_")[0])
+
+
+timing.add_listener(lambda stage, seconds: stage_seconds.observe(seconds, stage=stage))
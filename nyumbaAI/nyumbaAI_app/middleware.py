@@ -0,0 +1,52 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from . import metrics, timing
+
+
+class ServerTimingMiddleware:
+    """Collect stage timings per request into a Server-Timing header.
+
+    Also records the request duration histogram. Streamed bodies are produced
+    after the response leaves this middleware, so their stages only reach the
+    metrics, not the header.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        with timing.collect() as timings:
+            response = self.get_response(request)
+        return self._finish(request, response, timings, started)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        with timing.collect() as timings:
+            response = await self.get_response(request)
+        return self._finish(request, response, timings, started)
+
+    def _finish(self, request, response, timings, started):
+        elapsed = time.perf_counter() - started
+        match = getattr(request, "resolver_match", None)
+        metrics.request_seconds.observe(
+            elapsed,
+            view=match.view_name if match else "unmatched",
+            method=request.method,
+            status=str(response.status_code),
+        )
+        entries = [
+            f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()
+        ]
+        entries.append(f"total;dur={elapsed * 1000:.1f}")
+        response["Server-Timing"] = ", ".join(entries)
+        return response
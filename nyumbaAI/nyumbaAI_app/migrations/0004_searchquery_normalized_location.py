@@ -0,0 +1,24 @@
+from django.db import migrations, models
+
+
+def backfill_normalized_location(apps, schema_editor):
+    SearchQuery = apps.get_model("nyumbaAI_app", "SearchQuery")
+    for search in SearchQuery.objects.only("id", "location").iterator():
+        search.normalized_location = " ".join(search.location.split()).casefold()
+        search.save(update_fields=["normalized_location"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nyumbaAI_app", "0003_alter_houselisting_link"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="searchquery",
+            name="normalized_location",
+            field=models.CharField(blank=True, db_index=True, max_length=255),
+        ),
+        migrations.RunPython(backfill_normalized_location, migrations.RunPython.noop),
+    ]
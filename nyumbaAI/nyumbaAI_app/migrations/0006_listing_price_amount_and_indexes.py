@@ -0,0 +1,129 @@
+import re
+from decimal import Decimal, InvalidOperation
+
+from django.db import migrations, models
+
+# Frozen copy of pricing.parse_price as of this migration
+
+CURRENCIES = {
+    "kshs": "KES",
+    "ksh": "KES",
+    "kes": "KES",
+    "us$": "USD",
+    "usd": "USD",
+    "$": "USD",
+    "eur": "EUR",
+    "€": "EUR",
+    "gbp": "GBP",
+    "£": "GBP",
+}
+CURRENCY_RE = re.compile(
+    r"(?<![a-z])(?:kshs|ksh|kes|us\$|usd|eur|gbp)(?![a-z])|[$€£]", re.IGNORECASE
+)
+MULTIPLIERS = {
+    "k": Decimal(1_000),
+    "m": Decimal(1_000_000),
+    "mn": Decimal(1_000_000),
+    "million": Decimal(1_000_000),
+    "b": Decimal(1_000_000_000),
+    "bn": Decimal(1_000_000_000),
+    "billion": Decimal(1_000_000_000),
+}
+MAX_AMOUNT = Decimal(10) ** 14
+AMOUNT_RE = re.compile(
+    r"(?<![\w.,])(\d[\d,]*(?:\.\d+)?)\s*(billion|million|bn|mn|k|m|b)?(?!\w)",
+    re.IGNORECASE,
+)
+
+
+def parse_price(text):
+    if not text or not isinstance(text, str):
+        return None, ""
+    text = CURRENCY_RE.sub(lambda m: f" {m.group()} ", text)
+    found = CURRENCY_RE.search(text)
+    currency = CURRENCIES[found.group().lower()] if found else ""
+    if found:
+        match = AMOUNT_RE.search(text, found.end())
+        if match is None:
+            match = next(
+                (
+                    m
+                    for m in AMOUNT_RE.finditer(text, 0, found.start())
+                    if not text[m.end() : found.start()].strip()
+                ),
+                None,
+            )
+    else:
+        match = next((m for m in AMOUNT_RE.finditer(text) if m.group(2)), None)
+    if match is None:
+        return None, ""
+    try:
+        amount = Decimal(match.group(1).replace(",", ""))
+        amount *= MULTIPLIERS.get((match.group(2) or "").lower(), Decimal(1))
+        amount = amount.quantize(Decimal("0.01"))
+    except InvalidOperation:
+        return None, ""
+    if amount >= MAX_AMOUNT:
+        return None, ""
+    return amount, currency
+
+
+def backfill_price_amount(apps, schema_editor):
+    HouseListing = apps.get_model("nyumbaAI_app", "HouseListing")
+    batch = []
+    for listing in HouseListing.objects.only("id", "price").iterator(chunk_size=2000):
+        listing.price_amount, listing.price_currency = parse_price(listing.price)
+        if listing.price_amount is not None:
+            batch.append(listing)
+        if len(batch) >= 2000:
+            HouseListing.objects.bulk_update(batch, ["price_amount", "price_currency"])
+            batch = []
+    if batch:
+        HouseListing.objects.bulk_update(batch, ["price_amount", "price_currency"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nyumbaAI_app", "0005_chatsession_chatmessage"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="houselisting",
+            name="price_amount",
+            field=models.DecimalField(
+                blank=True, db_index=True, decimal_places=2, max_digits=16, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="houselisting",
+            name="price_currency",
+            field=models.CharField(blank=True, default="", max_length=3),
+        ),
+        migrations.AlterField(
+            model_name="searchquery",
+            name="normalized_location",
+            field=models.CharField(blank=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name="houselisting",
+            index=models.Index(
+                fields=["latitude", "longitude"], name="nyumbaAI_ap_latitud_c9866d_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="searchquery",
+            index=models.Index(
+                fields=["location", "timestamp"], name="nyumbaAI_ap_locatio_7a6b5b_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="searchquery",
+            index=models.Index(
+                fields=["normalized_location", "timestamp"],
+                name="nyumbaAI_ap_normali_3d693e_idx",
+            ),
+        ),
+        migrations.RunPython(backfill_price_amount, migrations.RunPython.noop),
+    ]
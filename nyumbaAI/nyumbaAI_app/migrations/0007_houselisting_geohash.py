@@ -0,0 +1,63 @@
+from django.db import migrations, models
+
+BASE32 = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def encode_geohash(latitude, longitude, precision=9):
+    """Frozen copy of geo.encode_geohash as of this migration"""
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    bit_count = 0
+    even = True
+    while len(chars) < precision:
+        value, bounds = (longitude, lon_range) if even else (latitude, lat_range)
+        mid = (bounds[0] + bounds[1]) / 2
+        if value >= mid:
+            bits = bits * 2 + 1
+            bounds[0] = mid
+        else:
+            bits *= 2
+            bounds[1] = mid
+        even = not even
+        bit_count += 1
+        if bit_count == 5:
+            chars.append(BASE32[bits])
+            bits = 0
+            bit_count = 0
+    return "".join(chars)
+
+
+def backfill_geohash(apps, schema_editor):
+    HouseListing = apps.get_model("nyumbaAI_app", "HouseListing")
+    rows = HouseListing.objects.filter(
+        latitude__isnull=False, longitude__isnull=False
+    ).only("id", "latitude", "longitude")
+    batch = []
+    for listing in rows.iterator(chunk_size=2000):
+        listing.geohash = encode_geohash(listing.latitude, listing.longitude)
+        batch.append(listing)
+        if len(batch) >= 2000:
+            HouseListing.objects.bulk_update(batch, ["geohash"])
+            batch = []
+    if batch:
+        HouseListing.objects.bulk_update(batch, ["geohash"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nyumbaAI_app", "0006_listing_price_amount_and_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="houselisting",
+            name="geohash",
+            field=models.CharField(
+                blank=True, db_index=True, default="", max_length=12
+            ),
+        ),
+        migrations.RunPython(backfill_geohash, migrations.RunPython.noop),
+    ]
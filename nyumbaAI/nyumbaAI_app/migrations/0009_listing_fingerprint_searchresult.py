@@ -0,0 +1,119 @@
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def copy_search_links(apps, schema_editor):
+    """One SearchResult per existing listing, numbered in insertion order"""
+    HouseListing = apps.get_model("nyumbaAI_app", "HouseListing")
+    SearchResult = apps.get_model("nyumbaAI_app", "SearchResult")
+    rows = HouseListing.objects.order_by("search_id", "id").values_list(
+        "id", "search_id"
+    )
+    batch = []
+    previous, position = None, 0
+    for listing_id, search_id in rows.iterator(chunk_size=2000):
+        position = position + 1 if search_id == previous else 0
+        previous = search_id
+        batch.append(
+            SearchResult(search_id=search_id, listing_id=listing_id, position=position)
+        )
+        if len(batch) >= 2000:
+            SearchResult.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        SearchResult.objects.bulk_create(batch)
+
+
+def copy_first_search(apps, schema_editor):
+    HouseListing = apps.get_model("nyumbaAI_app", "HouseListing")
+    SearchResult = apps.get_model("nyumbaAI_app", "SearchResult")
+    first = {}
+    for listing_id, search_id in SearchResult.objects.order_by("-id").values_list(
+        "listing_id", "search_id"
+    ):
+        first[listing_id] = search_id
+    for listing_id, search_id in first.items():
+        HouseListing.objects.filter(pk=listing_id).update(search_id=search_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nyumbaAI_app", "0008_analysisjob"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="houselisting",
+            name="fingerprint",
+            field=models.CharField(blank=True, max_length=16, null=True, unique=True),
+        ),
+        migrations.CreateModel(
+            name="SearchResult",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("position", models.PositiveIntegerField(default=0)),
+                (
+                    "listing",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="appearances",
+                        to="nyumbaAI_app.houselisting",
+                    ),
+                ),
+                (
+                    "search",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="results",
+                        to="nyumbaAI_app.searchquery",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["search", "position"],
+                        name="nyumbaAI_ap_search__863744_idx",
+                    )
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("search", "listing"), name="unique_search_listing"
+                    )
+                ],
+            },
+        ),
+        migrations.AddField(
+            model_name="houselisting",
+            name="searches",
+            field=models.ManyToManyField(
+                related_name="listings",
+                through="nyumbaAI_app.SearchResult",
+                to="nyumbaAI_app.searchquery",
+            ),
+        ),
+        # Nullable first so the field can be restored when migrating back
+        migrations.AlterField(
+            model_name="houselisting",
+            name="search",
+            field=models.ForeignKey(
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                to="nyumbaAI_app.searchquery",
+            ),
+        ),
+        migrations.RunPython(copy_search_links, copy_first_search),
+        migrations.RemoveField(
+            model_name="houselisting",
+            name="search",
+        ),
+    ]
@@ -0,0 +1,46 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nyumbaAI_app", "0009_listing_fingerprint_searchresult"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="LocationStats",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("normalized_location", models.CharField(max_length=255, unique=True)),
+                ("location", models.CharField(max_length=255)),
+                ("listing_count", models.IntegerField(default=0)),
+                ("currency", models.CharField(blank=True, default="", max_length=3)),
+                ("priced_count", models.IntegerField(default=0)),
+                (
+                    "price_min",
+                    models.DecimalField(
+                        blank=True, decimal_places=2, max_digits=16, null=True
+                    ),
+                ),
+                (
+                    "price_max",
+                    models.DecimalField(
+                        blank=True, decimal_places=2, max_digits=16, null=True
+                    ),
+                ),
+                ("price_histogram", models.JSONField(default=dict)),
+                ("rating_histograms", models.JSONField(default=dict)),
+                ("monthly", models.JSONField(default=dict)),
+                ("updated", models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
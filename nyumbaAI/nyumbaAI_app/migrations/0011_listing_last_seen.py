@@ -0,0 +1,37 @@
+import django.utils.timezone
+from django.db import migrations, models
+from django.db.models import Max, OuterRef, Subquery
+
+
+def backfill_last_seen(apps, schema_editor):
+    """Time of the newest search that found each listing"""
+    HouseListing = apps.get_model("nyumbaAI_app", "HouseListing")
+    SearchResult = apps.get_model("nyumbaAI_app", "SearchResult")
+    newest = (
+        SearchResult.objects.filter(listing=OuterRef("pk"))
+        .values("listing")
+        .annotate(newest=Max("search__timestamp"))
+        .values("newest")
+    )
+    HouseListing.objects.update(last_seen=Subquery(newest))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("nyumbaAI_app", "0010_locationstats"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="houselisting",
+            name="last_seen",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name="searchquery",
+            name="timestamp",
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.RunPython(backfill_last_seen, migrations.RunPython.noop),
+    ]
@@ -1,18 +1,40 @@
 from django.db import models
+from django.utils import timezone
 
 class SearchQuery(models.Model):
     query = models.TextField()
     location = models.CharField(max_length=255)
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Lookup key for serving recent results, see services.normalize_location
+    normalized_location = models.CharField(max_length=255, blank=True)
+    # When the search ran; imports set it to the crawl time
+    timestamp = models.DateTimeField(default=timezone.now)
     results_count = models.IntegerField(default=0)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=["location", "timestamp"]),
+            models.Index(fields=["normalized_location", "timestamp"]),
+        ]
+
     def __str__(self):
         return f"{self.query} - {self.location}"
 
 class HouseListing(models.Model):
-    search = models.ForeignKey(SearchQuery, on_delete=models.CASCADE)
+    """One distinct property, shared by every search that found it"""
+    # pipeline.fingerprint_key of link, address and rounded coordinates; saves
+    # upsert on it. NULL for rows stored before deduplication until
+    # `manage.py compact_listings` merges them.
+    fingerprint = models.CharField(max_length=16, unique=True, null=True, blank=True)
+    searches = models.ManyToManyField(
+        SearchQuery, through="SearchResult", related_name="listings"
+    )
     title = models.CharField(max_length=255)
     price = models.CharField(max_length=100, null=True, blank=True)
+    # Parsed from price by pricing.parse_price, for filtering and sorting
+    price_amount = models.DecimalField(
+        max_digits=16, decimal_places=2, null=True, blank=True, db_index=True
+    )
+    price_currency = models.CharField(max_length=3, blank=True, default='')
     address = models.TextField(
         default='Address not available',  # Add default
         blank=True,  # Allow blank
@@ -27,7 +49,130 @@ class HouseListing(models.Model):
     )
     latitude = models.FloatField(null=True, blank=True)
     longitude = models.FloatField(null=True, blank=True)
+    # Geohash of (latitude, longitude) so radius searches can prune by prefix
+    geohash = models.CharField(max_length=12, blank=True, default='', db_index=True)
     rating = models.FloatField(null=True, blank=True)
     description = models.TextField(null=True, blank=True)
+    # Time of the newest search its data came from; older data doesn't
+    # overwrite it
+    last_seen = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["latitude", "longitude"]),
+        ]
+
+    def __str__(self):
+        return self.title
+
+
+class SearchResult(models.Model):
+    """A property as found by one search, in the order the API returned it"""
+    search = models.ForeignKey(
+        SearchQuery, on_delete=models.CASCADE, related_name="results"
+    )
+    listing = models.ForeignKey(
+        HouseListing, on_delete=models.CASCADE, related_name="appearances"
+    )
+    position = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["search", "listing"], name="unique_search_listing"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["search", "position"]),
+        ]
+
+    def __str__(self):
+        return f"{self.search} #{self.position}: {self.listing}"
+
+
+class ChatSession(models.Model):
+    """Analysis and chat history behind one results page"""
+    search = models.ForeignKey(SearchQuery, on_delete=models.CASCADE)
+    query = models.TextField(blank=True)
+    analysis = models.TextField(blank=True)
+    # Rolling summary of turns that no longer fit the history token budget
+    summary = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Chat {self.pk} - {self.search}"
+
+
+class ChatMessage(models.Model):
+    ROLE_CHOICES = [("user", "User"), ("assistant", "Assistant")]
+
+    session = models.ForeignKey(
+        ChatSession, on_delete=models.CASCADE, related_name="messages"
+    )
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    content = models.TextField()
+    tokens = models.IntegerField(default=0)
+    summarized = models.BooleanField(default=False)
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.role}: {self.content[:50]}"
+
+
+class AnalysisJob(models.Model):
+    """Queued LLM analysis of a results page, consumed by jobs.py"""
+    PENDING = "pending"
+    RUNNING = "running"
+    DONE = "done"
+    FAILED = "failed"
+    STATUS_CHOICES = [
+        (PENDING, "Pending"),
+        (RUNNING, "Running"),
+        (DONE, "Done"),
+        (FAILED, "Failed"),
+    ]
+
+    # The analysis itself is saved on the session
+    session = models.OneToOneField(
+        ChatSession, on_delete=models.CASCADE, related_name="analysis_job"
+    )
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    attempts = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    # A failed job waits until then before it is claimed again
+    available_at = models.DateTimeField(default=timezone.now)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["status", "created"]),
+        ]
+
+    def __str__(self):
+        return f"Analysis job {self.pk} ({self.status})"
+
+
+class LocationStats(models.Model):
+    """Market statistics per normalized location, maintained by stats.py"""
+    normalized_location = models.CharField(max_length=255, unique=True)
+    location = models.CharField(max_length=255)
+    # Distinct properties found by searches of this location
+    listing_count = models.IntegerField(default=0)
+    # Prices in other currencies than the location's main one are left out
+    currency = models.CharField(max_length=3, blank=True, default='')
+    priced_count = models.IntegerField(default=0)
+    price_min = models.DecimalField(max_digits=16, decimal_places=2, null=True, blank=True)
+    price_max = models.DecimalField(max_digits=16, decimal_places=2, null=True, blank=True)
+    # Sparse log-scale price histograms ({bin: count}, see stats.price_bin) so
+    # new listings can be added without rereading the old ones
+    price_histogram = models.JSONField(default=dict)
+    # {rating bucket: histogram}
+    rating_histograms = models.JSONField(default=dict)
+    # {"YYYY-MM": {"listings": count, "prices": histogram}} by search month
+    monthly = models.JSONField(default=dict)
+    updated = models.DateTimeField(auto_now=True)
+
     def __str__(self):
-        return self.title
\ No newline at end of file
+        return f"Stats for {self.location} ({self.listing_count} listings)"
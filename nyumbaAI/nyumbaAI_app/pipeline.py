@@ -0,0 +1,279 @@
+"""Lazy processing pipeline turning raw SerpAPI local results into listings.
+
+Each stage takes an iterator of dicts and yields dicts one at a time, so the
+same pipeline runs over a live API response, a cached response or a JSONL dump
+of any size without holding more than one listing at a time (dedupe keeps only
+fingerprints). Stages are registered by name with ``@stage`` and the default
+order comes from ``settings.LISTING_PIPELINE``.
+"""
+
+import hashlib
+import json
+import math
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from .cache import normalize_text
+from .geo import encode_geohash
+from .pricing import parse_price
+
+Stage = Callable[[Iterator[Dict], Dict[str, Any]], Iterator[Dict]]
+
+STAGES: Dict[str, Stage] = {}
+
+# Display fallback for listings without an address; not part of their identity
+ADDRESS_PLACEHOLDER = "Address Not Available"
+
+# Where a listing's link can come from, most specific first; maps is the fallback
+LINK_SOURCES = (
+    ("link",),
+    ("links", "website"),
+    ("directions", "google_url"),
+)
+
+
+def stage(name: str) -> Callable[[Stage], Stage]:
+    """Register a pipeline stage under ``name``"""
+
+    def register(func: Stage) -> Stage:
+        STAGES[name] = func
+        return func
+
+    return register
+
+
+def _lookup(item: Dict, path: Sequence[str]) -> Any:
+    value = item
+    for key in path:
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    return value
+
+
+@stage("normalize")
+def normalize(items: Iterator[Dict], context: Dict[str, Any]) -> Iterator[Dict]:
+    """Map raw API items onto the listing fields, with display fallbacks"""
+    for item in items:
+        if not isinstance(item, dict):
+            continue
+        gps = item.get("gps_coordinates") or {}
+        link = None
+        for path in LINK_SOURCES:
+            link = _lookup(item, path)
+            if link:
+                break
+        yield {
+            "title": item.get("title", "No Title Available"),
+            "price": item.get("price", "Price Not Available"),
+            "address": item.get("address", ADDRESS_PLACEHOLDER),
+            "latitude": gps.get("latitude"),
+            "longitude": gps.get("longitude"),
+            "rating": item.get("rating"),
+            "description": item.get("description", "No Description Available"),
+            "link": link or "#",
+        }
+
+
+@stage("price")
+def parse_prices(items: Iterator[Dict], context: Dict[str, Any]) -> Iterator[Dict]:
+    """Add price_amount and price_currency parsed from the price text"""
+    for listing in items:
+        listing["price_amount"], listing["price_currency"] = parse_price(
+            listing.get("price")
+        )
+        yield listing
+
+
+def _coordinate(value: Any, limit: float) -> Optional[float]:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+    if math.isnan(value) or not -limit <= value <= limit:
+        return None
+    return value
+
+
+@stage("geo")
+def validate_coordinates(
+    items: Iterator[Dict], context: Dict[str, Any]
+) -> Iterator[Dict]:
+    """Coerce coordinates to floats and blank out unusable pairs.
+
+    Listings without a position are kept, they just can't be mapped or found
+    by radius search.
+    """
+    for listing in items:
+        latitude = _coordinate(listing.get("latitude"), 90.0)
+        longitude = _coordinate(listing.get("longitude"), 180.0)
+        if latitude is None or longitude is None:
+            latitude = longitude = None
+        listing["latitude"], listing["longitude"] = latitude, longitude
+        yield listing
+
+
+@stage("dedupe")
+def dedupe(items: Iterator[Dict], context: Dict[str, Any]) -> Iterator[Dict]:
+    """Drop listings whose fingerprint was already seen.
+
+    ``context["seen"]`` can be shared between runs to deduplicate across pages
+    or files. It holds listing_fingerprint tuples unless ``context["key"]``
+    names another function, e.g. fingerprint_key for state that is serialized.
+    """
+    seen = context.setdefault("seen", set())
+    make_key = context.get("key", listing_fingerprint)
+    for listing in items:
+        key = make_key(listing)
+        if key in seen:
+            continue
+        seen.add(key)
+        yield listing
+
+
+@stage("enrich")
+def enrich(items: Iterator[Dict], context: Dict[str, Any]) -> Iterator[Dict]:
+    """Add derived fields such as the geohash used for radius search"""
+    for listing in items:
+        latitude = listing.get("latitude")
+        longitude = listing.get("longitude")
+        if latitude is not None and longitude is not None:
+            listing["geohash"] = encode_geohash(latitude, longitude)
+        else:
+            listing["geohash"] = ""
+        yield listing
+
+
+def run_pipeline(
+    items: Iterable[Dict],
+    stages: Optional[Sequence[str]] = None,
+    context: Optional[Dict[str, Any]] = None,
+) -> Iterator[Dict]:
+    """Chain the named stages over raw items and return the lazy result"""
+    context = {} if context is None else context
+    stream = iter(items)
+    for name in stages or settings.LISTING_PIPELINE:
+        stream = STAGES[name](stream, context)
+    return stream
+
+
+def iter_raw_items(raw_results: Any) -> Iterator[Dict]:
+    """Raw items of a normalized API response, tolerating a single dict"""
+    listings = raw_results.get("local_results", [])
+    if isinstance(listings, dict):
+        yield listings
+    elif isinstance(listings, list):
+        yield from listings
+
+
+def iter_json_lines(
+    lines: Iterable[str], on_error: Optional[Callable[[str], None]] = None
+) -> Iterator[Any]:
+    """Parsed records of JSONL lines, skipping blank lines.
+
+    Malformed lines are skipped too, after being passed to ``on_error``.
+    """
+    for line in lines:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            if on_error is not None:
+                on_error(line)
+            continue
+        yield record
+
+
+def iter_json_array(stream, chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """Elements of a top-level JSON array, decoded as the file is read.
+
+    Holds one element and one read chunk at a time. A file holding a single
+    value rather than an array yields that value.
+    """
+    decoder = json.JSONDecoder()
+    buffer = stream.read(chunk_size).lstrip()
+    if not buffer.startswith("["):
+        yield json.loads(buffer + stream.read())
+        return
+
+    buffer = buffer[1:]
+    eof = False
+    while True:
+        buffer = buffer.lstrip()
+        if buffer.startswith(","):
+            buffer = buffer[1:].lstrip()
+        if buffer.startswith("]"):
+            return
+        try:
+            value, end = decoder.raw_decode(buffer)
+        except ValueError:
+            value, end = None, -1
+        # A value ending with the buffer may continue in the next chunk
+        if end < 0 or (end == len(buffer) and not eof):
+            if eof:
+                raise ValueError("Truncated JSON array")
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield value
+        buffer = buffer[end:]
+
+
+def iter_jsonl(lines: Iterable[str]) -> Iterator[Dict]:
+    """Raw items from JSONL lines of either single items or whole responses"""
+    for record in iter_json_lines(lines):
+        if isinstance(record, dict) and "local_results" in record:
+            yield from iter_raw_items(record)
+        elif isinstance(record, dict):
+            yield record
+
+
+def fingerprint_key(listing: Dict) -> str:
+    """Compact string form of listing_fingerprint"""
+    blob = json.dumps(listing_fingerprint(listing), default=str)
+    return hashlib.sha1(blob.encode("utf-8")).hexdigest()[:16]
+
+
+def listing_fingerprint(listing: Dict) -> Tuple:
+    """Identity of a property across searches: its link, address and position.
+
+    The fields are combined, so listings that only share a link (e.g. an
+    agency homepage) stay apart. Coordinates are rounded to ~10 m.
+    """
+    link = normalize_link(listing.get("link"))
+    address = normalize_text(str(listing.get("address") or ""))
+    if address == normalize_text(ADDRESS_PLACEHOLDER):
+        address = ""
+    latitude = listing.get("latitude")
+    longitude = listing.get("longitude")
+    if not link and not address and latitude is None:
+        # Nothing locates it; don't fold every such listing into one
+        return ("title", normalize_text(str(listing.get("title") or "")))
+    return (
+        "property",
+        link,
+        address,
+        round(latitude, 4) if latitude is not None else None,
+        round(longitude, 4) if longitude is not None else None,
+    )
+
+
+def normalize_link(link: Optional[str]) -> str:
+    """Link without scheme, "www.", trailing slash or utm_ parameters"""
+    if not link or link == "#":
+        return ""
+    rest = link.strip().split("://", 1)[-1]
+    if rest.startswith("www."):
+        rest = rest[4:]
+    rest, _, query = rest.partition("?")
+    host, slash, path = rest.partition("/")
+    normalized = host.lower() + (slash + path).rstrip("/")
+    if query and "utm_" in query:
+        query = "&".join(
+            param for param in query.split("&") if not param.startswith("utm_")
+        )
+    return f"{normalized}?{query}" if query else normalized
@@ -0,0 +1,92 @@
+import re
+from functools import lru_cache
+from decimal import Decimal, InvalidOperation
+from typing import Optional, Tuple
+
+CURRENCIES = {
+    "kshs": "KES",
+    "ksh": "KES",
+    "kes": "KES",
+    "us$": "USD",
+    "usd": "USD",
+    "$": "USD",
+    "eur": "EUR",
+    "€": "EUR",
+    "gbp": "GBP",
+    "£": "GBP",
+}
+
+# Letter codes only count as whole words ("Lakes" holds no "kes"), longest
+# spellings first so "Kshs" is not read as "Ksh" + "s"
+CURRENCY_RE = re.compile(
+    r"(?<![a-z])(?:kshs|ksh|kes|us\$|usd|eur|gbp)(?![a-z])|[$€£]", re.IGNORECASE
+)
+
+MULTIPLIERS = {
+    "k": Decimal(1_000),
+    "m": Decimal(1_000_000),
+    "mn": Decimal(1_000_000),
+    "million": Decimal(1_000_000),
+    "b": Decimal(1_000_000_000),
+    "bn": Decimal(1_000_000_000),
+    "billion": Decimal(1_000_000_000),
+}
+
+# Amounts must fit HouseListing.price_amount (max_digits=16, decimal_places=2)
+MAX_AMOUNT = Decimal(10) ** 14
+
+# Whole numbers only: neither digit of "1e9" is an amount
+AMOUNT_RE = re.compile(
+    r"(?<![\w.,])(\d[\d,]*(?:\.\d+)?)\s*(billion|million|bn|mn|k|m|b)?(?!\w)",
+    re.IGNORECASE,
+)
+
+
+# Listings repeat a small set of price strings ("Price Not Available", ...)
+@lru_cache(maxsize=4096)
+def parse_price(text: Optional[str]) -> Tuple[Optional[Decimal], str]:
+    """Parse free-text prices like "$350,000" or "KSh 12M" into (amount, currency).
+
+    The first amount wins for ranges ("$300K - $400K"). A number only counts
+    as a price next to a currency ("KSh 45,000", "45,000 KES") or with a
+    magnitude ("3M"); otherwise, e.g. "2 Bedroom Apartment" or "Price Not
+    Available", returns (None, ""). So do amounts too large to store.
+    """
+    if not text or not isinstance(text, str):
+        return None, ""
+
+    # Space out currency tokens so "KSh12M" reads as "KSh 12M"
+    text = CURRENCY_RE.sub(lambda m: f" {m.group()} ", text)
+    found = CURRENCY_RE.search(text)
+    currency = CURRENCIES[found.group().lower()] if found else ""
+
+    match = None
+    if found:
+        # Prefer the amount right after the currency ("3 bedroom Ksh 45,000"),
+        # then one right before it ("45,000 KES")
+        match = AMOUNT_RE.search(text, found.end())
+        if match is None:
+            match = next(
+                (
+                    m
+                    for m in AMOUNT_RE.finditer(text, 0, found.start())
+                    if not text[m.end() : found.start()].strip()
+                ),
+                None,
+            )
+    else:
+        match = next((m for m in AMOUNT_RE.finditer(text) if m.group(2)), None)
+    if match is None:
+        return None, ""
+
+    suffix = (match.group(2) or "").lower()
+    try:
+        amount = Decimal(match.group(1).replace(",", ""))
+        amount *= MULTIPLIERS.get(suffix, Decimal(1))
+        amount = amount.quantize(Decimal("0.01"))
+    except InvalidOperation:
+        return None, ""
+    if amount >= MAX_AMOUNT:
+        return None, ""
+
+    return amount, currency
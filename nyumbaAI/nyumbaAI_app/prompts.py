@@ -0,0 +1,179 @@
+"""Token-budgeted sections for the analysis and chat prompts.
+
+Listings and the stored analysis both grow with the search, so they are fitted
+into budgets from settings instead of being pasted verbatim: listings become a
+dense table that drops its least informative rows first, and long text loses
+detail sentences before whole lines. Tokens are estimated locally (no
+tokenizer download); what each call saves over the verbatim text is counted
+in the ``nyumbaai_prompt_tokens`` metric.
+"""
+
+import logging
+import re
+from typing import Dict, List, Optional, Tuple
+
+from . import metrics
+from .cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# Letter runs, digit groups (BPE vocabularies hold up to three digits) and
+# single symbols
+TOKEN_RE = re.compile(r"[^\W\d_]+|\d{1,3}|\S")
+SENTENCE_END_RE = re.compile(r"(?<=[.!?])\s")
+
+# (listing field, column width in characters) of the listings table
+LISTING_COLUMNS = [("title", 48), ("price", 20), ("address", 40), ("rating", 4)]
+
+# Fallback values stored for missing fields, see services._listing_row
+PLACEHOLDERS = {
+    "no title available",
+    "price not available",
+    "address not available",
+    "no description available",
+    "unknown",
+    "unknown location",
+    "n/a",
+    "#",
+}
+
+# Room kept for the "+N more" line when listings are dropped
+OMITTED_RESERVE = 24
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate BPE token count of text.
+
+    Letter runs count one token per six characters, digit groups and symbols
+    one each, which tracks real tokenizers on prices and addresses better than
+    a flat characters-per-token ratio.
+    """
+    count = 0
+    for match in TOKEN_RE.finditer(text):
+        piece = match.group()
+        count += (len(piece) + 5) // 6 if piece[0].isalpha() else 1
+    return count
+
+
+def record_savings(prompt: str, verbatim: str, sent: str) -> int:
+    """Count the tokens sent and saved for one prompt; returns tokens saved"""
+    sent_tokens = estimate_tokens(sent)
+    saved = max(estimate_tokens(verbatim) - sent_tokens, 0)
+    metrics.prompt_tokens.inc(sent_tokens, prompt=prompt, kind="sent")
+    metrics.prompt_tokens.inc(saved, prompt=prompt, kind="saved")
+    logger.debug("%s prompt: %d tokens, %d saved", prompt, sent_tokens, saved)
+    return saved
+
+
+def _cell(value, width: int) -> str:
+    if value is None:
+        return ""
+    text = " ".join(str(value).split()).replace("|", "/")
+    if normalize_text(text) in PLACEHOLDERS:
+        return ""
+    return text if len(text) <= width else text[: width - 1].rstrip() + "…"
+
+
+def _value(row: List[str]) -> int:
+    """How much a row tells the model: price counts double"""
+    return sum(2 if i == 1 else 1 for i, cell in enumerate(row) if cell)
+
+
+def listing_table(listings: List[Dict], budget: int) -> Tuple[str, int]:
+    """Listings as a pipe-separated table within ``budget`` tokens.
+
+    Rows missing a price, rating or address are dropped before complete ones,
+    and later rows before earlier ones at equal value; kept rows stay in their
+    original order. Returns the table and the number of rows dropped.
+    """
+    header = " | ".join(name for name, _ in LISTING_COLUMNS)
+    rows = [
+        [_cell(listing.get(name), width) for name, width in LISTING_COLUMNS]
+        for listing in listings
+    ]
+    lines = [" | ".join(cell or "-" for cell in row) for row in rows]
+    costs = [estimate_tokens(line) + 1 for line in lines]
+
+    available = budget - estimate_tokens(header) - 1
+    if sum(costs) > available:
+        available -= OMITTED_RESERVE
+    keep = set()
+    for index in sorted(range(len(rows)), key=lambda i: (-_value(rows[i]), i)):
+        if costs[index] <= available:
+            keep.add(index)
+            available -= costs[index]
+
+    table = [header] + [line for index, line in enumerate(lines) if index in keep]
+    dropped = len(lines) - len(keep)
+    if dropped:
+        table.append(f"(+{dropped} more listings{_price_range(listings, keep)})")
+    return "\n".join(table), dropped
+
+
+def _price_range(listings: List[Dict], keep: set) -> str:
+    """Price range of the dropped rows, when they share a currency"""
+    dropped = [
+        listing
+        for index, listing in enumerate(listings)
+        if index not in keep and listing.get("price_amount")
+    ]
+    currencies = {listing.get("price_currency", "") for listing in dropped}
+    if not dropped or len(currencies) != 1:
+        return ""
+    amounts = [float(listing["price_amount"]) for listing in dropped]
+    return f", priced {currencies.pop()} {min(amounts):,.0f}-{max(amounts):,.0f}"
+
+
+def _squeeze(text: str) -> List[str]:
+    """Non-empty lines with markdown emphasis and runs of spaces removed"""
+    text = text.replace("**", "").replace("__", "")
+    return [" ".join(line.split()) for line in text.splitlines() if line.strip()]
+
+
+def _first_sentence(line: str) -> Optional[str]:
+    parts = SENTENCE_END_RE.split(line, maxsplit=1)
+    return parts[0] if len(parts) > 1 else None
+
+
+def fit_text(text: str, budget: int) -> str:
+    """Shorten markdown to ``budget`` tokens, least valuable content first.
+
+    Blank lines and emphasis go first, then the longest lines are cut to their
+    first sentence, then lines are dropped from the end (headings last), and
+    finally the text is truncated.
+    """
+    if estimate_tokens(text) <= budget:
+        return text
+    lines = _squeeze(text)
+    costs = [estimate_tokens(line) + 1 for line in lines]
+    used = sum(costs)
+
+    for index in sorted(range(len(lines)), key=lambda i: -costs[i]):
+        if used <= budget:
+            break
+        shorter = _first_sentence(lines[index])
+        if shorter is not None:
+            lines[index] = shorter
+            cost = estimate_tokens(shorter) + 1
+            used -= costs[index] - cost
+            costs[index] = cost
+
+    order = [i for i in reversed(range(len(lines))) if not lines[i].startswith("#")]
+    order += [i for i in reversed(range(len(lines))) if lines[i].startswith("#")]
+    dropped = set()
+    for index in order:
+        if used <= budget - 1:
+            break
+        dropped.add(index)
+        used -= costs[index]
+    kept = [line for index, line in enumerate(lines) if index not in dropped]
+    if dropped:
+        kept.append("…")
+
+    fitted = "\n".join(kept)
+    # Headings alone, or one line, still over budget
+    tokens = estimate_tokens(fitted)
+    while tokens > budget and fitted:
+        fitted = fitted[: len(fitted) * budget // tokens - 1].rstrip()
+        tokens = estimate_tokens(fitted) + 1
+    return fitted if fitted == "\n".join(kept) else fitted + "…"
@@ -0,0 +1,605 @@
+"""Search and LLM backends, selected with SEARCH_PROVIDER and LLM_PROVIDER.
+
+``serpapi`` and ``groq`` talk to the live services. ``fixture`` replays
+recorded SerpAPI payloads and completions from PROVIDER_FIXTURES_DIR with
+configurable synthetic latency and error rate, so the full search path can be
+benchmarked offline and repeatably. Setting PROVIDER_RECORD makes the live
+backends write what they receive into that directory for later replay.
+
+LLM backends hand out clients with the Groq ``chat.completions.create``
+interface, so callers do not care which one is configured.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+import weakref
+from pathlib import Path
+from types import SimpleNamespace
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+from . import metrics
+from .cache import normalize_location
+from .prompts import estimate_tokens
+from .upstream import Guard, status_code
+
+# The client libraries are imported on first use, so workers that never call
+# a backend (or only replay fixtures) don't pay for them at startup
+if TYPE_CHECKING:
+    import httpx
+
+logger = logging.getLogger(__name__)
+
+SERPAPI_URL = "https://serpapi.com/search.json"
+SERPAPI_TIMEOUT = 30.0
+
+FALLBACK_COMPLETION = "## Analysis\n\nRecorded completions are not available."
+
+# Connection errors worth retrying, by client library module
+TRANSIENT_ERRORS = [
+    ("httpx", ["TransportError"]),
+    ("requests", ["ConnectionError", "Timeout"]),
+    ("groq", ["APIConnectionError"]),
+]
+
+
+class ProviderError(Exception):
+    """Raised by a backend when the upstream call fails (or is made to fail)"""
+
+    def __init__(self, message: str, status_code: Optional[int] = None):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _transient(error: BaseException) -> bool:
+    """Whether a failed upstream call is worth retrying"""
+    if isinstance(error, ProviderError):
+        return True
+    if isinstance(error, _transient_errors()):
+        return True
+    status = status_code(error)
+    return status is not None and (status in (408, 409, 429) or status >= 500)
+
+
+def _transient_errors() -> tuple:
+    # An error can only come from a library that is already loaded, so look
+    # the types up there instead of importing every client library
+    errors = []
+    for module, names in TRANSIENT_ERRORS:
+        loaded = sys.modules.get(module)
+        if loaded is not None:
+            errors.extend(getattr(loaded, name) for name in names)
+    return tuple(errors)
+
+
+def _check_status(status: int) -> None:
+    # SerpAPI answers quota and server errors with a JSON error body, which
+    # would otherwise read as an empty result
+    if status == 429 or status >= 500:
+        raise ProviderError(f"SerpAPI returned HTTP {status}", status)
+
+
+def search_fixture_key(params: Dict[str, Any]) -> str:
+    """Recording key of a search: everything but the API key, location normalized"""
+    payload = {k: v for k, v in params.items() if k != "api_key"}
+    payload["location"] = normalize_location(payload.get("location", ""))
+    return _digest(payload)
+
+
+def completion_fixture_key(messages: List[Dict], model: str) -> str:
+    return _digest({"messages": messages, "model": model})
+
+
+def _digest(payload: Any) -> str:
+    blob = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()[:24]
+
+
+def _fixtures_dir(kind: str) -> Path:
+    return Path(settings.PROVIDER_FIXTURES_DIR) / kind
+
+
+def _record(kind: str, key: str, payload: Dict) -> None:
+    directory = _fixtures_dir(kind)
+    try:
+        directory.mkdir(parents=True, exist_ok=True)
+        (directory / f"{key}.json").write_text(json.dumps(payload), encoding="utf-8")
+    except OSError as e:
+        metrics.errors.inc(where="fixture_record")
+        logger.warning("Fixture recording error: %s", e)
+
+
+class SerpApiSearch:
+    """Live Google Local results through SerpAPI"""
+
+    def __init__(self):
+        # httpx clients hold connections tied to the loop that created them
+        self._http_clients = weakref.WeakKeyDictionary()
+
+    def search(self, params: Dict[str, Any]) -> Any:
+        from serpapi import GoogleSearch
+
+        response = GoogleSearch(params).get_response()
+        _check_status(response.status_code)
+        results = response.json()
+        self._maybe_record(params, results)
+        return results
+
+    async def asearch(self, params: Dict[str, Any]) -> Any:
+        response = await self._http_client().get(SERPAPI_URL, params=params)
+        _check_status(response.status_code)
+        results = response.json()
+        self._maybe_record(params, results)
+        return results
+
+    def _http_client(self) -> "httpx.AsyncClient":
+        import httpx
+
+        loop = asyncio.get_running_loop()
+        if loop not in self._http_clients:
+            self._http_clients[loop] = httpx.AsyncClient(timeout=SERPAPI_TIMEOUT)
+        return self._http_clients[loop]
+
+    def _maybe_record(self, params: Dict[str, Any], results: Any) -> None:
+        if settings.PROVIDER_RECORD and isinstance(results, dict):
+            _record("search", search_fixture_key(params), results)
+
+
+class _Replay:
+    """Recorded payloads of one kind plus the latency/error simulation"""
+
+    def __init__(self, kind: str, latency: float, error_rate: float):
+        self.kind = kind
+        self.latency = latency
+        self.error_rate = error_rate
+        self._random = random.Random(settings.PROVIDER_FIXTURE_SEED)
+        self._lock = threading.Lock()
+        self.payloads = {}
+        directory = _fixtures_dir(kind)
+        if directory.is_dir():
+            for path in sorted(directory.glob("*.json")):
+                self.payloads[path.stem] = json.loads(path.read_text("utf-8"))
+        self._keys = sorted(self.payloads)
+
+    def lookup(self, key: str) -> Optional[Dict]:
+        """The recording for ``key``, else a stable pick among all recordings"""
+        if key in self.payloads:
+            return self.payloads[key]
+        if not self._keys:
+            return None
+        return self.payloads[self._keys[int(key, 16) % len(self._keys)]]
+
+    def _fails(self) -> bool:
+        with self._lock:
+            return self._random.random() < self.error_rate
+
+    def wait(self) -> None:
+        time.sleep(self.latency)
+        if self._fails():
+            raise ProviderError(f"Simulated {self.kind} failure")
+
+    async def await_(self) -> None:
+        await asyncio.sleep(self.latency)
+        if self._fails():
+            raise ProviderError(f"Simulated {self.kind} failure")
+
+
+class FixtureSearch:
+    """Replays recorded SerpAPI payloads"""
+
+    def __init__(self):
+        self.replay = _Replay(
+            "search",
+            settings.SEARCH_FIXTURE_LATENCY,
+            settings.SEARCH_FIXTURE_ERROR_RATE,
+        )
+
+    def _payload(self, params: Dict[str, Any]) -> Dict:
+        payload = self.replay.lookup(search_fixture_key(params))
+        return payload if payload is not None else {"local_results": []}
+
+    def search(self, params: Dict[str, Any]) -> Dict:
+        self.replay.wait()
+        return self._payload(params)
+
+    async def asearch(self, params: Dict[str, Any]) -> Dict:
+        await self.replay.await_()
+        return self._payload(params)
+
+
+class _RecordingCompletions:
+    """Wraps ``chat.completions`` to save every completion it returns"""
+
+    def __init__(self, completions):
+        self._completions = completions
+
+    def create(self, **kwargs):
+        key = completion_fixture_key(kwargs.get("messages"), kwargs.get("model"))
+        response = self._completions.create(**kwargs)
+        if not kwargs.get("stream"):
+            _record(
+                "completions", key, {"content": response.choices[0].message.content}
+            )
+            return response
+        return self._record_stream(key, response)
+
+    def _record_stream(self, key, stream):
+        parts = []
+        for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            yield chunk
+        _record("completions", key, {"content": "".join(parts)})
+
+
+class _AsyncRecordingCompletions(_RecordingCompletions):
+    async def create(self, **kwargs):
+        key = completion_fixture_key(kwargs.get("messages"), kwargs.get("model"))
+        response = await self._completions.create(**kwargs)
+        if not kwargs.get("stream"):
+            _record(
+                "completions", key, {"content": response.choices[0].message.content}
+            )
+            return response
+        return self._arecord_stream(key, response)
+
+    async def _arecord_stream(self, key, stream):
+        parts = []
+        async for chunk in stream:
+            if chunk.choices and chunk.choices[0].delta.content:
+                parts.append(chunk.choices[0].delta.content)
+            yield chunk
+        _record("completions", key, {"content": "".join(parts)})
+
+
+class _InstrumentedCompletions:
+    """Wraps ``chat.completions`` to count calls, errors and token usage"""
+
+    def __init__(self, completions):
+        self._completions = completions
+
+    def create(self, **kwargs):
+        model = kwargs.get("model", "")
+        try:
+            response = self._completions.create(**kwargs)
+        except Exception:
+            metrics.upstream_calls.inc(provider="llm", outcome="error")
+            raise
+        if not kwargs.get("stream"):
+            metrics.upstream_calls.inc(provider="llm", outcome="ok")
+            metrics.record_usage(model, getattr(response, "usage", None))
+            return response
+        return self._count_stream(model, response)
+
+    def _count_stream(self, model, stream):
+        try:
+            for chunk in stream:
+                # Groq reports usage for streams on the last chunk
+                metrics.record_usage(model, _stream_usage(chunk))
+                yield chunk
+        except Exception:
+            metrics.upstream_calls.inc(provider="llm", outcome="error")
+            raise
+        metrics.upstream_calls.inc(provider="llm", outcome="ok")
+
+
+class _AsyncInstrumentedCompletions(_InstrumentedCompletions):
+    async def create(self, **kwargs):
+        model = kwargs.get("model", "")
+        try:
+            response = await self._completions.create(**kwargs)
+        except Exception:
+            metrics.upstream_calls.inc(provider="llm", outcome="error")
+            raise
+        if not kwargs.get("stream"):
+            metrics.upstream_calls.inc(provider="llm", outcome="ok")
+            metrics.record_usage(model, getattr(response, "usage", None))
+            return response
+        return self._acount_stream(model, response)
+
+    async def _acount_stream(self, model, stream):
+        try:
+            async for chunk in stream:
+                metrics.record_usage(model, _stream_usage(chunk))
+                yield chunk
+        except Exception:
+            metrics.upstream_calls.inc(provider="llm", outcome="error")
+            raise
+        metrics.upstream_calls.inc(provider="llm", outcome="ok")
+
+
+def _stream_usage(chunk):
+    return getattr(getattr(chunk, "x_groq", None), "usage", None)
+
+
+class _GuardedCompletions:
+    """Wraps ``chat.completions`` in the LLM rate limiter, retries and breaker.
+
+    Streams are retried only until they start; an error while streaming still
+    counts against the breaker.
+    """
+
+    def __init__(self, completions):
+        self._completions = completions
+        self.guard = _guard("llm")
+
+    def create(self, **kwargs):
+        response = self.guard.call(self._completions.create, **kwargs)
+        if not kwargs.get("stream"):
+            return response
+        return self._guard_stream(response)
+
+    def _guard_stream(self, stream):
+        try:
+            yield from stream
+        except Exception as e:
+            self.guard.record(e)
+            raise
+
+
+class _AsyncGuardedCompletions(_GuardedCompletions):
+    async def create(self, **kwargs):
+        response = await self.guard.acall(self._completions.create, **kwargs)
+        if not kwargs.get("stream"):
+            return response
+        return self._aguard_stream(response)
+
+    async def _aguard_stream(self, stream):
+        try:
+            async for chunk in stream:
+                yield chunk
+        except Exception as e:
+            self.guard.record(e)
+            raise
+
+
+class GroqLLM:
+    """Live completions from Groq"""
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+        # Async clients hold connections tied to the loop that created them
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                from groq import Groq
+
+                wrappers = [_InstrumentedCompletions, _GuardedCompletions]
+                if settings.PROVIDER_RECORD:
+                    wrappers.insert(0, _RecordingCompletions)
+                # Retries happen in the guard, not again inside the SDK
+                self._client = _wrap(
+                    Groq(api_key=os.getenv("GROQ_API_KEY"), max_retries=0), *wrappers
+                )
+            return self._client
+
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        if loop not in self._async_clients:
+            from groq import AsyncGroq
+
+            wrappers = [_AsyncInstrumentedCompletions, _AsyncGuardedCompletions]
+            if settings.PROVIDER_RECORD:
+                wrappers.insert(0, _AsyncRecordingCompletions)
+            self._async_clients[loop] = _wrap(
+                AsyncGroq(api_key=os.getenv("GROQ_API_KEY"), max_retries=0),
+                *wrappers,
+            )
+        return self._async_clients[loop]
+
+
+def _wrap(client, *wrappers):
+    """Client exposing ``chat.completions`` wrapped innermost-first"""
+    completions = client.chat.completions
+    for wrapper in wrappers:
+        completions = wrapper(completions)
+    return SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+
+def _usage(messages, content: str):
+    # Fixture replies carry no usage; estimate it as prompts are sized
+    prompt = sum(estimate_tokens(str(m.get("content", ""))) for m in messages or ())
+    return SimpleNamespace(
+        prompt_tokens=max(1, prompt),
+        completion_tokens=max(1, estimate_tokens(content)),
+    )
+
+
+def _completion(content: str, usage):
+    message = SimpleNamespace(role="assistant", content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+
+def _chunks(content: str, usage):
+    """Stream a recording line by line, like the upstream does in small deltas"""
+    for line in content.splitlines(keepends=True):
+        delta = SimpleNamespace(content=line)
+        yield SimpleNamespace(choices=[SimpleNamespace(delta=delta)], x_groq=None)
+    yield SimpleNamespace(choices=[], x_groq=SimpleNamespace(usage=usage))
+
+
+class _FixtureCompletions:
+    def __init__(self, replay: _Replay):
+        self.replay = replay
+
+    def _content(self, kwargs) -> str:
+        key = completion_fixture_key(kwargs.get("messages"), kwargs.get("model"))
+        payload = self.replay.lookup(key)
+        return payload["content"] if payload is not None else FALLBACK_COMPLETION
+
+    def create(self, **kwargs):
+        self.replay.wait()
+        content = self._content(kwargs)
+        usage = _usage(kwargs.get("messages"), content)
+        if kwargs.get("stream"):
+            return _chunks(content, usage)
+        return _completion(content, usage)
+
+
+class _AsyncFixtureCompletions(_FixtureCompletions):
+    async def create(self, **kwargs):
+        await self.replay.await_()
+        content = self._content(kwargs)
+        usage = _usage(kwargs.get("messages"), content)
+        if not kwargs.get("stream"):
+            return _completion(content, usage)
+
+        async def stream():
+            for chunk in _chunks(content, usage):
+                yield chunk
+
+        return stream()
+
+
+class FixtureLLM:
+    """Replays recorded completions"""
+
+    def __init__(self):
+        replay = _Replay(
+            "completions",
+            settings.LLM_FIXTURE_LATENCY,
+            settings.LLM_FIXTURE_ERROR_RATE,
+        )
+        fixture = SimpleNamespace(
+            chat=SimpleNamespace(completions=_FixtureCompletions(replay))
+        )
+        self._client = _wrap(fixture, _InstrumentedCompletions, _GuardedCompletions)
+        async_fixture = SimpleNamespace(
+            chat=SimpleNamespace(completions=_AsyncFixtureCompletions(replay))
+        )
+        self._async_client = _wrap(
+            async_fixture, _AsyncInstrumentedCompletions, _AsyncGuardedCompletions
+        )
+
+    def client(self):
+        return self._client
+
+    def async_client(self):
+        return self._async_client
+
+
+class _InstrumentedSearch:
+    """Counts calls and errors of the wrapped search backend"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def search(self, params: Dict[str, Any]) -> Any:
+        try:
+            results = self.backend.search(params)
+        except Exception:
+            metrics.upstream_calls.inc(provider="search", outcome="error")
+            raise
+        metrics.upstream_calls.inc(provider="search", outcome="ok")
+        return results
+
+    async def asearch(self, params: Dict[str, Any]) -> Any:
+        try:
+            results = await self.backend.asearch(params)
+        except Exception:
+            metrics.upstream_calls.inc(provider="search", outcome="error")
+            raise
+        metrics.upstream_calls.inc(provider="search", outcome="ok")
+        return results
+
+
+class _GuardedSearch:
+    """Rate limits, retries and circuit-breaks the wrapped search backend"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.guard = _guard("search")
+
+    def search(self, params: Dict[str, Any]) -> Any:
+        return self.guard.call(self.backend.search, params)
+
+    async def asearch(self, params: Dict[str, Any]) -> Any:
+        return await self.guard.acall(self.backend.asearch, params)
+
+
+SEARCH_PROVIDERS = {"serpapi": SerpApiSearch, "fixture": FixtureSearch}
+LLM_PROVIDERS = {"groq": GroqLLM, "fixture": FixtureLLM}
+
+_providers = {}
+_guards = {}
+# Re-entrant: wrappers look up their guard while a provider is being built
+_providers_lock = threading.RLock()
+
+
+def _guard(kind: str) -> Guard:
+    """The process-wide guard of a provider kind, sized from its settings"""
+    with _providers_lock:
+        if kind not in _guards:
+            prefix = kind.upper()
+            _guards[kind] = Guard(
+                kind,
+                _transient,
+                rate_per_minute=getattr(settings, f"{prefix}_RATE_PER_MINUTE"),
+                burst=getattr(settings, f"{prefix}_RATE_BURST"),
+                max_wait=settings.UPSTREAM_MAX_WAIT_SECONDS,
+                retries=settings.UPSTREAM_RETRIES,
+                backoff=settings.UPSTREAM_BACKOFF_SECONDS,
+                backoff_max=settings.UPSTREAM_BACKOFF_MAX_SECONDS,
+                failure_threshold=settings.UPSTREAM_CIRCUIT_FAILURES,
+                reset_seconds=settings.UPSTREAM_CIRCUIT_RESET_SECONDS,
+            )
+        return _guards[kind]
+
+
+def _provider(kind: str, registry: Dict[str, type], name: str, wrapper=None):
+    with _providers_lock:
+        if kind not in _providers:
+            if name not in registry:
+                raise ValueError(
+                    f"Unknown {kind} provider {name!r}, expected one of "
+                    f"{', '.join(registry)}"
+                )
+            backend = registry[name]()
+            _providers[kind] = wrapper(backend) if wrapper else backend
+        return _providers[kind]
+
+
+def search_provider():
+    """The configured search backend (built on first use)"""
+    return _provider(
+        "search",
+        SEARCH_PROVIDERS,
+        settings.SEARCH_PROVIDER,
+        lambda backend: _GuardedSearch(_InstrumentedSearch(backend)),
+    )
+
+
+def llm_provider():
+    """The configured LLM backend (built on first use)"""
+    return _provider("llm", LLM_PROVIDERS, settings.LLM_PROVIDER)
+
+
+def llm_client():
+    """Groq-compatible client of the configured LLM backend"""
+    return llm_provider().client()
+
+
+def async_llm_client():
+    """AsyncGroq-compatible client of the configured LLM backend for this loop"""
+    return llm_provider().async_client()
+
+
+@receiver(setting_changed)
+def _reset_providers(setting, **kwargs):
+    if setting.startswith(("SEARCH_", "LLM_", "PROVIDER_", "UPSTREAM_")):
+        with _providers_lock:
+            _providers.clear()
+            _guards.clear()
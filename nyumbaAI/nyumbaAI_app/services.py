@@ -1,92 +1,670 @@
-from groq import Groq
-from serpapi import GoogleSearch
+import logging
 import os
-from typing import List, Dict, Any
+import secrets
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import List, Dict, Any, Callable, Iterable, Iterator, Optional, Tuple
 
-client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import metrics
+from .cache import (
+    analysis_cache,
+    cursor_cache,
+    normalize_location,
+    normalize_text,
+    search_cache,
+)
+from .geo import covering_prefixes, encode_geohash, radius_bboxes, within_radius
+from .models import SearchQuery, HouseListing, SearchResult
+from .pipeline import (
+    ADDRESS_PLACEHOLDER,
+    fingerprint_key,
+    iter_raw_items,
+    listing_fingerprint,
+    run_pipeline,
+)
+from .prompts import fit_text, listing_table, record_savings
+from .providers import llm_client, search_provider
+from .singleflight import analysis_flight, search_flight
+from .stats import market_facts, record_appearances
+from .timing import timed
+
+logger = logging.getLogger(__name__)
+
+LISTING_FIELDS = (
+    "title",
+    "price",
+    "price_amount",
+    "price_currency",
+    "address",
+    "link",
+    "latitude",
+    "longitude",
+    "rating",
+    "description",
+)
+
+# Columns refreshed when a search finds an already stored property
+UPSERT_FIELDS = [*LISTING_FIELDS, "geohash", "last_seen"]
 
+# Background refreshes for stale stored searches, keyed by normalized location
+_refresh_executor: Optional[ThreadPoolExecutor] = None
+_refresh_lock = threading.Lock()
+_refreshing = set()
 
-def search_houses(location: str) -> dict:
+
+def build_search_params(location: str, start: int = 0) -> dict:
+    """SerpAPI parameters for a location search, from result offset ``start``"""
+    params = {
+        "num": settings.SEARCH_PAGE_SIZE,
+        "engine": "google_local",
+        "q": "houses for sale",
+        "location": location,
+        "api_key": os.getenv("SERP_API_KEY"),
+        "hl": "en",
+        "gl": "us",
+    }
+    if start:
+        params["start"] = start
+    return params
+
+
+def search_cache_key(params: dict) -> str:
+    """Cache key ignores the API key and uses the normalized location"""
+    return search_cache.make_key(
+        {
+            **{k: v for k, v in params.items() if k != "api_key"},
+            "location": normalize_location(params["location"]),
+        }
+    )
+
+
+def normalize_search_response(results) -> Optional[dict]:
+    """Coerce a SerpAPI payload to {"local_results": [...]}, None if unusable"""
+    if isinstance(results, list):
+        return {"local_results": results}
+    if not isinstance(results, dict) or "local_results" not in results:
+        return None
+    return results
+
+
+def search_houses(location: str, use_cache: bool = True, start: int = 0) -> dict:
     """Fetch raw API response and normalize structure"""
     try:
         if not location or not isinstance(location, str):
             return {"local_results": []}
 
-        params = {
-            "num": 6,
-            "engine": "google_local",
-            "q": "houses for sale",
-            "location": location,
-            "api_key": os.getenv("SERP_API_KEY"),
-            "hl": "en",
-            "gl": "us",
-        }
+        params = build_search_params(location, start)
+        cache_key = search_cache_key(params)
+        if use_cache:
+            cached = search_cache.get(cache_key)
+            if cached is not None:
+                return cached
 
-        search = GoogleSearch(params)
-        results = search.get_dict()
+        def fetch():
+            try:
+                with timed("search"):
+                    response = search_provider().search(params)
+            except Exception as e:
+                # Serve the last good response while the provider is failing
+                stale = search_cache.get_stale(cache_key)
+                if stale is None:
+                    raise
+                metrics.errors.inc(where="search")
+                logger.warning("Search error, serving stale results: %s", e)
+                return stale
+            results = normalize_search_response(response)
+            if results is None:
+                return {"local_results": []}
+            search_cache.set(cache_key, results)
+            return results
 
-        # Normalize response structure
-        if isinstance(results, list):
-            return {"local_results": results}
-        if "local_results" not in results:
-            return {"local_results": []}
-
-        return results
+        # Concurrent searches for the same location share one upstream call
+        return search_flight.do(
+            cache_key,
+            fetch,
+            (lambda: search_cache.backend.get(cache_key)) if use_cache else None,
+        )
 
     except Exception as e:
-        print(f"Search error: {str(e)}")
+        metrics.errors.inc(where="search")
+        logger.warning("Search error: %s", e)
         return {"local_results": []}
 
 
 def process_search_results(raw_results: dict) -> List[Dict[str, Any]]:
     """Convert normalized API response to structured listings"""
-    processed = []
-    listings = raw_results.get("local_results", [])
+    with timed("process"):
+        return list(iter_search_results(raw_results))
 
-    # Handle different result formats
-    if isinstance(listings, dict):
-        listings = [listings]
-    elif not isinstance(listings, list):
-        return []
 
-    for item in listings:
-        processed.append(
+def iter_search_results(
+    raw_results: dict, context: Optional[Dict[str, Any]] = None
+) -> Iterator[Dict[str, Any]]:
+    """Yield structured listings from a normalized API response one at a time"""
+    return run_pipeline(iter_raw_items(raw_results), context=context)
+
+
+def iter_search_pages(
+    location: str, start: int = 0, max_pages: int = 1
+) -> Iterator[Tuple[int, dict]]:
+    """Yield (offset, raw page) for consecutive result pages of a location.
+
+    The next page is fetched in the background while the caller consumes the
+    current one, so at most two raw pages are held at any time. Stops at the
+    first short page. Closing the iterator early doesn't wait for a pending
+    prefetch: it finishes in the background and lands in the search cache,
+    ready for the request that continues the listing.
+    """
+    page_size = settings.SEARCH_PAGE_SIZE
+    pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="page-prefetch")
+    try:
+        pending = pool.submit(search_houses, location, True, start)
+        for page in range(max_pages):
+            offset = start + page * page_size
+            raw_results = pending.result()
+            full = len(raw_results.get("local_results") or []) >= page_size
+            if full and page + 1 < max_pages:
+                pending = pool.submit(search_houses, location, True, offset + page_size)
+            yield offset, raw_results
+            if not full:
+                return
+    finally:
+        pool.shutdown(wait=False)
+
+
+def iter_listing_pages(
+    location: str, start: int = 0, max_pages: int = 1, seen: Optional[set] = None
+) -> Iterator[Tuple[int, Dict]]:
+    """Yield (offset, listing) across result pages, skipping repeated properties.
+
+    Upstream pages are always requested at multiples of SEARCH_PAGE_SIZE, so
+    they hit the search cache whatever ``start`` is; items before ``start`` on
+    the first page are skipped. ``seen`` holds listing fingerprints already
+    served and is updated in place, so deduplication can continue across calls.
+    """
+    context = {"seen": set() if seen is None else seen, "key": fingerprint_key}
+    page_start = start - start % settings.SEARCH_PAGE_SIZE
+    for offset, raw_results in iter_search_pages(location, page_start, max_pages):
+        # One item at a time so the upstream offset survives deduplication
+        for index, item in enumerate(iter_raw_items(raw_results)):
+            if offset + index < start:
+                continue
+            for listing in run_pipeline([item], context=context):
+                yield offset + index, listing
+
+
+def get_listing_page(
+    location: str, cursor: Optional[str] = None, page_size: Optional[int] = None
+) -> Optional[Dict[str, Any]]:
+    """One page of deduplicated listings plus an opaque cursor for the next.
+
+    Cursor state (location, upstream offset, fingerprints served so far) lives
+    in the search cache, so any worker can continue a listing. Returns None for
+    an unknown or expired cursor.
+    """
+    page_size = page_size or settings.SEARCH_PAGE_SIZE
+    if cursor:
+        state = cursor_cache.get(cursor_cache.make_key({"cursor": cursor}))
+        if state is None:
+            return None
+        location = state["location"]
+    else:
+        state = {"location": location, "start": 0, "seen": []}
+
+    listings = []
+    next_start = None
+    pages = iter_listing_pages(
+        location,
+        state["start"],
+        settings.SEARCH_MAX_PAGES_PER_REQUEST,
+        set(state["seen"]),
+    )
+    for offset, listing in pages:
+        listings.append(listing)
+        next_start = offset + 1
+        if len(listings) >= page_size:
+            break
+    pages.close()
+
+    next_cursor = None
+    if len(listings) >= page_size:
+        next_cursor = secrets.token_urlsafe(16)
+        cursor_cache.set(
+            cursor_cache.make_key({"cursor": next_cursor}),
             {
-                "title": item.get("title", "No Title Available"),
-                "price": item.get("price", "Price Not Available"),
-                "address": item.get("address", "Address Not Available"),
-                "latitude": item.get("gps_coordinates", {}).get("latitude"),
-                "longitude": item.get("gps_coordinates", {}).get("longitude"),
-                "rating": item.get("rating"),
-                "description": item.get("description", "No Description Available"),
-                "link": item.get("link")  # Try direct link first
-                or item.get("links", {}).get("website")  # Alternative key
-                or item.get("directions", {}).get("google_url")  # Fallback to maps
-                or "#",  # Ultimate fallback
-            }
+                "location": location,
+                "start": next_start,
+                # Most recent fingerprints only, so cursor state stays small
+                "seen": (state["seen"] + [fingerprint_key(l) for l in listings])[
+                    -settings.SEARCH_CURSOR_MAX_SEEN :
+                ],
+            },
+            settings.SEARCH_CURSOR_TTL,
         )
 
-    return processed
+    return {"location": location, "listings": listings, "next_cursor": next_cursor}
 
 
-def analyze_listings(query: str, listings: List[Dict]) -> str:
-    """Generate analysis using Groq API"""
+def save_search(query: str, location: str, listings: List[Dict]) -> SearchQuery:
+    """Persist a search and its listings"""
+    return save_searches([(query, location, listings)])[0]
+
+
+def save_searches(
+    searches: Iterable[Tuple], batch_size: int = 500
+) -> List[SearchQuery]:
+    """Persist (query, location, listings) searches with bulk inserts.
+
+    A search may carry a fourth item, the datetime it ran (e.g. the crawl time
+    of an imported dump); otherwise it is saved as running now. Listings are
+    upserted by fingerprint, so a property found by many searches is stored
+    once, with the data of the newest search, and linked to each of them.
+    Everything is written in one transaction, so a single search costs a
+    handful of statements and one commit however many listings it has. Used
+    for request-time saves as well as backfills and imports.
+    """
+    searches = list(searches)
+    now = timezone.now()
+    search_queries = [
+        SearchQuery(
+            query=query,
+            location=location,
+            normalized_location=normalize_location(location),
+            results_count=len(listings),
+            timestamp=searched_at[0] if searched_at else now,
+        )
+        for query, location, listings, *searched_at in searches
+    ]
+
+    # One row per property (newest data wins, later searches on ties) and one
+    # link per search and property, in result order
+    rows = {}
+    links = []
+    for search_query, (_, _, listings, *_) in zip(search_queries, searches):
+        linked = set()
+        for listing in listings:
+            row = _listing_row(listing)
+            row.last_seen = search_query.timestamp
+            current = rows.get(row.fingerprint)
+            if current is None or current.last_seen <= row.last_seen:
+                rows[row.fingerprint] = row
+            if row.fingerprint not in linked:
+                linked.add(row.fingerprint)
+                links.append((search_query, row.fingerprint, len(linked) - 1))
+
+    with timed("db_write"), transaction.atomic():
+        SearchQuery.objects.bulk_create(search_queries, batch_size=batch_size)
+        ids, last_seen = {}, {}
+        for fingerprint, pk, seen in _stored_listings(list(rows), batch_size):
+            ids[fingerprint], last_seen[fingerprint] = pk, seen
+        # Properties stored from a newer search keep their data
+        HouseListing.objects.bulk_create(
+            (
+                row
+                for fingerprint, row in rows.items()
+                if last_seen.get(fingerprint) is None
+                or last_seen[fingerprint] <= row.last_seen
+            ),
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["fingerprint"],
+            update_fields=UPSERT_FIELDS,
+        )
+        # Upserts don't set the ids of new rows on every backend
+        created = [fingerprint for fingerprint in rows if fingerprint not in ids]
+        ids.update(
+            (fingerprint, pk)
+            for fingerprint, pk, _ in _stored_listings(created, batch_size)
+        )
+        SearchResult.objects.bulk_create(
+            (
+                SearchResult(
+                    search=search_query, listing_id=ids[fingerprint], position=position
+                )
+                for search_query, fingerprint, position in links
+            ),
+            batch_size=batch_size,
+        )
+        record_appearances(
+            (search_query, ids[fingerprint], rows[fingerprint])
+            for search_query, fingerprint, _ in links
+        )
+
+    return search_queries
+
+
+def _stored_listings(
+    fingerprints: List[str], batch_size: int
+) -> Iterator[Tuple[str, int, Any]]:
+    """(fingerprint, id, last_seen) of the stored listings among fingerprints"""
+    for start in range(0, len(fingerprints), batch_size):
+        yield from HouseListing.objects.filter(
+            fingerprint__in=fingerprints[start : start + batch_size]
+        ).values_list("fingerprint", "id", "last_seen")
+
+
+def _listing_row(listing: Dict) -> HouseListing:
+    latitude = listing.get("latitude")
+    longitude = listing.get("longitude")
+    geohash = listing.get("geohash", "")
+    if not geohash and latitude is not None and longitude is not None:
+        geohash = encode_geohash(latitude, longitude)
+
+    # Save listings with fallback values
+    row = HouseListing(
+        title=listing.get("title", "No Title Available"),
+        price=listing.get("price", "Price Not Available"),
+        price_amount=listing.get("price_amount"),
+        price_currency=listing.get("price_currency", ""),
+        address=listing.get("address", ADDRESS_PLACEHOLDER),
+        link=listing.get("link", "#"),
+        latitude=listing.get("latitude"),
+        longitude=listing.get("longitude"),
+        geohash=geohash,
+        rating=listing.get("rating"),
+        description=listing.get("description", "No Description Available"),
+    )
+    row.fingerprint = row_fingerprint(row)
+    return row
+
+
+def row_fingerprint(row: HouseListing) -> str:
+    """fingerprint_key of a stored listing.
+
+    Computed from the saved fields rather than the raw listing so that
+    compact_listings derives the same key for rows stored before it existed.
+    """
+    return fingerprint_key(
+        {
+            "title": row.title,
+            "link": row.link,
+            "address": row.address,
+            "latitude": row.latitude,
+            "longitude": row.longitude,
+        }
+    )
+
+
+def _bbox_filter(min_lat: float, min_lon: float, max_lat: float, max_lon: float) -> Q:
+    """Filter for listings inside a bounding box, pruned by geohash prefix"""
+    prefixes = Q()
+    for prefix in covering_prefixes(min_lat, min_lon, max_lat, max_lon):
+        # Range scans use the geohash index on every backend, unlike LIKE
+        prefixes |= Q(geohash__gte=prefix, geohash__lt=prefix + "~")
+    return prefixes & Q(
+        latitude__range=(min_lat, max_lat),
+        longitude__range=(min_lon, max_lon),
+    )
+
+
+def _in_bbox(min_lat: float, min_lon: float, max_lat: float, max_lon: float):
+    """Listings inside a bounding box, pruned by geohash prefix in SQL"""
+    return HouseListing.objects.filter(_bbox_filter(min_lat, min_lon, max_lat, max_lon))
+
+
+def find_listings_in_bbox(
+    min_lat: float, min_lon: float, max_lat: float, max_lon: float, limit: int = 200
+) -> List[Dict]:
+    """Stored listings inside a bounding box"""
+    rows = _in_bbox(min_lat, min_lon, max_lat, max_lon).order_by("id")
+    return list(rows.values("id", *LISTING_FIELDS)[:limit])
+
+
+def find_listings_near(
+    latitude: float, longitude: float, radius_km: float, limit: int = 50
+) -> List[Dict]:
+    """Stored listings within radius_km of a point, nearest first.
+
+    SQL narrows the search to the geohash cells around the circle's bounding
+    boxes (two when it crosses the antimeridian); exact haversine distances
+    are then computed over the candidates in one vectorized pass.
+    """
+    boxes = Q()
+    for box in radius_bboxes(latitude, longitude, radius_km):
+        boxes |= _bbox_filter(*box)
+    candidates = list(
+        HouseListing.objects.filter(boxes).values_list("id", "latitude", "longitude")
+    )
+    if not candidates:
+        return []
+
+    ids, latitudes, longitudes = zip(*candidates)
+    order, distances = within_radius(
+        latitude, longitude, latitudes, longitudes, radius_km
+    )
+    nearest = {ids[i]: float(d) for i, d in zip(order[:limit], distances[:limit])}
+
+    listings = HouseListing.objects.filter(pk__in=nearest).values("id", *LISTING_FIELDS)
+    results = sorted(listings, key=lambda listing: nearest[listing["id"]])
+    for listing in results:
+        listing["distance_km"] = round(nearest[listing["id"]], 3)
+    return results
+
+
+def get_stored_listings(
+    location: str, query: str = ""
+) -> Optional[Tuple[SearchQuery, List[Dict]]]:
+    """Serve a recent stored search for the location, if one exists.
+
+    Searches younger than SEARCH_FRESH_SECONDS are returned as-is. Older ones,
+    up to SEARCH_STALE_SECONDS, are still returned but trigger a background
+    refresh so the next request sees fresh data.
+    """
+    if not location or not isinstance(location, str):
+        return None
+
+    key = normalize_location(location)
+    search_query = (
+        SearchQuery.objects.filter(normalized_location=key, results_count__gt=0)
+        .order_by("-timestamp")
+        .first()
+    )
+    if search_query is None:
+        return None
+
+    age = timezone.now() - search_query.timestamp
+    if age > timedelta(seconds=settings.SEARCH_STALE_SECONDS):
+        return None
+    if age > timedelta(seconds=settings.SEARCH_FRESH_SECONDS):
+        schedule_refresh(location, query)
+
+    return search_query, get_search_listings(search_query)
+
+
+def get_search_listings(search_query: SearchQuery) -> List[Dict]:
+    """Stored listings of a search as dicts, in the order they were found"""
+    return list(search_listing_rows(search_query))
+
+
+def search_listing_rows(search_query: SearchQuery):
+    """Queryset of a search's listing dicts (LISTING_FIELDS) in result order"""
+    return search_query.results.order_by("position").values(
+        **{field: F(f"listing__{field}") for field in LISTING_FIELDS}
+    )
+
+
+def schedule_refresh(location: str, query: str = "") -> bool:
+    """Queue a background re-fetch of a location unless one is already running"""
+    global _refresh_executor
+
+    key = normalize_location(location)
+    with _refresh_lock:
+        if key in _refreshing:
+            return False
+        _refreshing.add(key)
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(
+                max_workers=2, thread_name_prefix="search-refresh"
+            )
+    _refresh_executor.submit(_refresh_search, key, location, query)
+    return True
+
+
+def _refresh_search(key: str, location: str, query: str) -> None:
     try:
-        if not listings:
-            return "No listings available for analysis"
-
-        listings_text = "\n".join(
-            [
-                f"{l.get('title', 'Unknown')} - {l.get('price', 'N/A')} ({l.get('address', 'Unknown location')})"
-                for l in listings
-            ]
+        raw_results = search_houses(location, use_cache=False)
+        listings = process_search_results(raw_results)[: settings.SEARCH_PAGE_SIZE]
+        if listings:
+            save_search(query, location, listings)
+    except Exception as e:
+        metrics.errors.inc(where="refresh")
+        logger.warning("Refresh error: %s", e)
+    finally:
+        connection.close()
+        with _refresh_lock:
+            _refreshing.discard(key)
+
+
+def _search_location(location: str, query: str) -> List[Dict]:
+    """Stored or freshly fetched listings for one location of a batch"""
+    try:
+        stored = get_stored_listings(location, query)
+        if stored is not None:
+            return stored[1]
+
+        raw_results = search_houses(location)
+        listings = process_search_results(raw_results)[: settings.SEARCH_PAGE_SIZE]
+        save_search(query, location, listings)
+        return listings
+    finally:
+        # Pool threads are discarded after the batch; don't leak connections
+        connection.close()
+
+
+def search_many(
+    locations: Iterable[str], query: str = "", max_workers: Optional[int] = None
+) -> Dict[str, List[Dict]]:
+    """Search several locations concurrently, one upstream call per distinct place.
+
+    Locations are deduplicated by normalized form (first spelling wins) and
+    fetched through a bounded thread pool, so the wall time is close to the
+    slowest single search rather than the sum.
+    """
+    unique = {}
+    for location in locations:
+        if location and isinstance(location, str):
+            unique.setdefault(normalize_location(location), location.strip())
+    if not unique:
+        return {}
+
+    workers = min(max_workers or settings.BATCH_SEARCH_WORKERS, len(unique))
+    with ThreadPoolExecutor(
+        max_workers=workers, thread_name_prefix="batch-search"
+    ) as pool:
+        futures = {
+            location: pool.submit(_search_location, location, query)
+            for location in unique.values()
+        }
+        return {location: future.result() for location, future in futures.items()}
+
+
+def merge_listings(results: Dict[str, List[Dict]]) -> List[Dict]:
+    """Merge per-location results into one deduplicated set, best rated first"""
+    merged = {}
+    for location, listings in results.items():
+        for listing in listings:
+            merged.setdefault(
+                listing_fingerprint(listing), {**listing, "location": location}
+            )
+
+    def rank(listing):
+        rating = listing.get("rating")
+        price = listing.get("price_amount")
+        return (
+            rating is None,
+            -(rating or 0),
+            price is None,
+            price if price is not None else 0,
         )
 
-        prompt = f"""Real Estate Analysis Request: {query}
+    return sorted(merged.values(), key=rank)
+
+
+def batch_search(locations: Iterable[str], query: str = "") -> Dict[str, Any]:
+    """Fan out a multi-location search and analyze the merged results once"""
+    results = search_many(locations, query)
+    listings = merge_listings(results)
+    compared = ", ".join(results)
+    analysis = analyze_listings(
+        f"{query} (comparing {compared})" if query else f"Comparing {compared}",
+        listings[: settings.BATCH_ANALYSIS_LISTINGS],
+        market_facts(*results),
+    )
+    return {
+        "counts": {location: len(found) for location, found in results.items()},
+        "listings": listings,
+        "analysis": analysis,
+    }
+
+
+def analysis_model() -> str:
+    return os.getenv("GROQ_MODEL_NAME", "mistral-saba-24b")
+
+
+def analysis_listings(listings: List[Dict]) -> List[Dict]:
+    """Listings in a canonical order, so the same results share a prompt"""
+    return sorted(
+        listings,
+        key=lambda listing: [
+            normalize_text(str(listing.get(field) or ""))
+            for field in ("title", "price", "address", "rating")
+        ],
+    )
+
+
+def analysis_cache_key(query: str, listings: List[Dict], model: str) -> str:
+    """Fingerprint of the analysis request: query, listings and model.
+
+    Keyed on the normalized query and the listings table the prompt shows
+    (canonical order, fitted to its budget), so ratings or trimming change the
+    key but spacing, case and result order don't. Market facts are left out:
+    they change whenever the area gains a property, so a cached analysis only
+    picks them up once it expires (ANALYSIS_CACHE_TTL).
+    """
+    listings_text, _ = listing_table(
+        analysis_listings(listings), settings.ANALYSIS_LISTINGS_TOKEN_BUDGET
+    )
+    return analysis_cache.make_key(
+        {"query": normalize_text(query), "listings": listings_text, "model": model}
+    )
+
+
+def build_analysis_prompt(query: str, listings: List[Dict], facts: str = "") -> str:
+    """``facts`` are stats.market_facts lines, so trends come from stored data.
+
+    Listings and facts are fitted to their token budgets, so the prompt stays
+    the same size however many listings the search returned. The query is
+    normalized and the listings put in canonical order, as in the cache key.
+    """
+    listings = analysis_listings(listings)
+    verbatim = "\n".join(
+        [
+            f"{l.get('title', 'Unknown')} - {l.get('price', 'N/A')} ({l.get('address', 'Unknown location')})"
+            for l in listings
+        ]
+    )
+    listings_text, _ = listing_table(listings, settings.ANALYSIS_LISTINGS_TOKEN_BUDGET)
+    record_savings("analysis", verbatim, listings_text)
+
+    market_text = ""
+    if facts:
+        facts = fit_text(facts, settings.ANALYSIS_FACTS_TOKEN_BUDGET)
+        market_text = f"""
+        Market Data (every listing on record for the area):
+        {facts}
+"""
+
+    return f"""Real Estate Analysis Request: {normalize_text(query)}
 
         Listings to Analyze:
         {listings_text}
-
+{market_text}
         Provide detailed analysis covering:
         - Price trends and comparisons
         - Location advantages/disadvantages
@@ -96,28 +674,142 @@ def analyze_listings(query: str, listings: List[Dict]) -> str:
 
         Format using markdown with clear sections."""
 
-        response = client.chat.completions.create(
-            messages=[{"role": "user", "content": prompt}],
-            model=os.getenv("GROQ_MODEL_NAME", "mistral-saba-24b"),
-            temperature=0.2,
-        )
 
-        return response.choices[0].message.content
+def analyze_listings(query: str, listings: List[Dict], facts: str = "") -> str:
+    """Generate analysis using Groq API"""
+    try:
+        return generate_analysis(query, listings, facts)
 
     except Exception as e:
-        print(f"Analysis error: {str(e)}")
+        metrics.errors.inc(where="analysis")
+        logger.warning("Analysis error: %s", e)
         return "Could not generate analysis"
 
 
-from groq import Groq
-from django.conf import settings
+def generate_analysis(query: str, listings: List[Dict], facts: str = "") -> str:
+    """Like analyze_listings, but raises instead of returning a placeholder"""
+    if not listings:
+        return "No listings available for analysis"
+
+    model = analysis_model()
+    cache_key = analysis_cache_key(query, listings, model)
+    cached = analysis_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    def fetch():
+        prompt = build_analysis_prompt(query, listings, facts)
+        try:
+            with timed("analysis"):
+                response = llm_client().chat.completions.create(
+                    messages=[{"role": "user", "content": prompt}],
+                    model=model,
+                    temperature=0.2,
+                )
+        except Exception as e:
+            stale = analysis_cache.get_stale(cache_key)
+            if stale is None:
+                raise
+            metrics.errors.inc(where="analysis")
+            logger.warning("Analysis error, serving stale analysis: %s", e)
+            return stale
+        analysis = response.choices[0].message.content
+        analysis_cache.set(cache_key, analysis)
+        return analysis
 
+    return analysis_flight.do(
+        cache_key, fetch, lambda: analysis_cache.backend.get(cache_key)
+    )
+
+
+def stream_analysis(
+    query: str,
+    listings: List[Dict],
+    on_complete: Optional[Callable[[str], None]] = None,
+    facts: str = "",
+) -> Iterator[str]:
+    """Yield analysis markdown from Groq as it is generated.
+
+    ``on_complete`` receives the full text once a real analysis (cached or
+    freshly generated) has been yielded, never the error placeholder. While an
+    identical analysis is already streaming in this process, wait for it and
+    yield it whole instead of starting another.
+    """
+    if not listings:
+        yield "No listings available for analysis"
+        return
+
+    model = analysis_model()
+    cache_key = analysis_cache_key(query, listings, model)
+    cached = analysis_cache.get(cache_key)
+    call = None
+    if cached is None:
+        call, leader = analysis_flight.begin(cache_key)
+        if not leader:
+            try:
+                cached = analysis_flight.wait(call)
+            except Exception:
+                cached = None
+            call = None
+    if cached is not None:
+        yield cached
+        if on_complete is not None:
+            on_complete(cached)
+        return
+
+    prompt = build_analysis_prompt(query, listings, facts)
+    parts = []
+    analysis = None
+    try:
+        stream = llm_client().chat.completions.create(
+            messages=[{"role": "user", "content": prompt}],
+            model=model,
+            temperature=0.2,
+            stream=True,
+        )
+        for chunk in stream:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                parts.append(delta)
+                yield delta
+        analysis = "".join(parts)
+
+    except Exception as e:
+        metrics.errors.inc(where="analysis")
+        logger.warning("Analysis error: %s", e)
+        if parts:
+            return
+        # Serve the last analysis of these listings while the LLM is failing
+        analysis = analysis_cache.get_stale(cache_key)
+        if analysis is None:
+            yield "Could not generate analysis"
+            return
+        yield analysis
+        if on_complete is not None:
+            on_complete(analysis)
+        return
+    finally:
+        # Also runs when the client goes away mid-stream; waiters then start
+        # their own analysis
+        if call is not None:
+            analysis_flight.finish(cache_key, call, analysis)
 
-def get_groq_response(user_message, analysis):
-    client = Groq(api_key=os.getenv("GROQ_API_KEY"))
+    analysis_cache.set(cache_key, analysis)
+    if on_complete is not None:
+        on_complete(analysis)
 
+
+def build_chat_messages(
+    user_message: str,
+    analysis: str,
+    summary: str = "",
+    history: List[Dict] = (),
+) -> List[Dict]:
+    """System prompt with the budgeted analysis, prior turns, then the new message"""
+    fitted = fit_text(analysis, settings.CHAT_ANALYSIS_TOKEN_BUDGET)
+    record_savings("chat", analysis, fitted)
     system_prompt = f"""You are a real estate expert assistant. Use this analysis to answer questions:
-    {analysis}
+    {fitted}
     
     Guidelines:
     1. Focus on property details from the analysis
@@ -125,13 +817,25 @@ def get_groq_response(user_message, analysis):
     3. Highlight location advantages
     4. Keep responses under 3 sentences unless detailed analysis is requested"""
 
-    completion = client.chat.completions.create(
+    if summary:
+        system_prompt += f"\n\nSummary of the earlier conversation:\n{summary}"
+
+    return [
+        {"role": "system", "content": system_prompt},
+        *history,
+        {"role": "user", "content": user_message},
+    ]
+
+
+def stream_chat_completion(messages: List[Dict]) -> Iterator[str]:
+    """Yield a chat completion from Groq token by token"""
+    stream = llm_client().chat.completions.create(
         model="mistral-saba-24b",
-        messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": user_message},
-        ],
+        messages=messages,
         temperature=0.3,
+        stream=True,
     )
-
-    return completion.choices[0].message.content
\ No newline at end of file
+    for chunk in stream:
+        delta = chunk.choices[0].delta.content if chunk.choices else None
+        if delta:
+            yield delta
@@ -0,0 +1,218 @@
+"""Coalesce concurrent identical upstream calls into one ("single-flight").
+
+Within a process, callers asking for a key that is already being fetched wait
+for that fetch and share its result, across threads (``do``) or tasks on one
+event loop (``ado``). With SINGLEFLIGHT_SHARED the leader also takes a lock in
+the shared cache, so leaders in other processes poll the result cache
+(``recheck``) instead of calling upstream themselves.
+"""
+
+import asyncio
+import secrets
+import threading
+import time
+import weakref
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+from . import metrics
+
+# How often a process waiting on another process's fetch re-checks the cache
+POLL_SECONDS = 0.05
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self, name: str, alias: str = "search_results"):
+        self.name = name
+        self.alias = alias
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._async_calls = weakref.WeakKeyDictionary()
+
+    # Threads
+
+    def begin(self, key: str) -> Tuple[_Call, bool]:
+        """The in-flight call for ``key`` and whether the caller leads it"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                return call, False
+            call = self._calls[key] = _Call()
+            return call, True
+
+    def finish(self, key: str, call: _Call, result: Any = None, error=None) -> None:
+        """Publish the leader's outcome; ``result=None`` lets followers retry"""
+        call.result, call.error = result, error
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.done.set()
+
+    def wait(self, call: _Call) -> Any:
+        """Follower side: the leader's result, None if it gave up or timed out"""
+        if not call.done.wait(settings.SINGLEFLIGHT_WAIT_SECONDS):
+            return None
+        if call.error is not None:
+            raise call.error
+        if call.result is not None:
+            metrics.coalesced_calls.inc(flight=self.name, scope="process")
+        return call.result
+
+    def do(
+        self,
+        key: str,
+        fetch: Callable[[], Any],
+        recheck: Optional[Callable[[], Any]] = None,
+    ) -> Any:
+        """Run ``fetch`` once for all concurrent callers with the same key"""
+        call, leader = self.begin(key)
+        if not leader:
+            result = self.wait(call)
+            if result is not None:
+                return result
+            return fetch()
+
+        try:
+            result = self._shared(key, fetch, recheck)
+        except Exception as e:
+            self.finish(key, call, error=e)
+            raise
+        self.finish(key, call, result)
+        return result
+
+    def _shared(self, key, fetch, recheck):
+        if not settings.SINGLEFLIGHT_SHARED or recheck is None:
+            return fetch()
+
+        backend = caches[self.alias]
+        lock_key = f"singleflight:{self.name}:{key}"
+        token = secrets.token_hex(8)
+        deadline = time.monotonic() + settings.SINGLEFLIGHT_WAIT_SECONDS
+        waited = False
+        while not backend.add(lock_key, token, settings.SINGLEFLIGHT_LOCK_SECONDS):
+            # Another process is fetching; its result lands in the cache
+            waited = True
+            result = recheck()
+            if result is not None:
+                metrics.coalesced_calls.inc(flight=self.name, scope="shared")
+                return result
+            if time.monotonic() > deadline:
+                return fetch()
+            time.sleep(POLL_SECONDS)
+        try:
+            # The previous holder may have stored its result just before
+            # releasing the lock
+            result = recheck() if waited else None
+            if result is not None:
+                metrics.coalesced_calls.inc(flight=self.name, scope="shared")
+                return result
+            return fetch()
+        finally:
+            if backend.get(lock_key) == token:
+                backend.delete(lock_key)
+
+    # Event loop
+
+    def abegin(self, key: str) -> Tuple[asyncio.Future, bool]:
+        """``begin`` for tasks on the running event loop"""
+        calls = self._async_calls.setdefault(asyncio.get_running_loop(), {})
+        future = calls.get(key)
+        if future is not None:
+            return future, False
+        future = calls[key] = asyncio.get_running_loop().create_future()
+        return future, True
+
+    def afinish(
+        self, key: str, future: asyncio.Future, result: Any = None, error=None
+    ) -> None:
+        calls = self._async_calls.get(asyncio.get_running_loop(), {})
+        if calls.get(key) is future:
+            del calls[key]
+        if future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+            # Followers re-raise it; don't warn when nobody was waiting
+            future.exception()
+        else:
+            future.set_result(result)
+
+    async def await_(self, future: asyncio.Future) -> Any:
+        try:
+            result = await asyncio.wait_for(
+                asyncio.shield(future), settings.SINGLEFLIGHT_WAIT_SECONDS
+            )
+        except asyncio.TimeoutError:
+            return None
+        if result is not None:
+            metrics.coalesced_calls.inc(flight=self.name, scope="process")
+        return result
+
+    async def ado(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[Any]],
+        recheck: Optional[Callable[[], Awaitable[Any]]] = None,
+    ) -> Any:
+        """Async ``do`` for callers on the same event loop"""
+        future, leader = self.abegin(key)
+        if not leader:
+            result = await self.await_(future)
+            if result is not None:
+                return result
+            return await fetch()
+
+        try:
+            result = await self._ashared(key, fetch, recheck)
+        except asyncio.CancelledError:
+            # Followers fetch for themselves rather than inherit a cancellation
+            self.afinish(key, future)
+            raise
+        except Exception as e:
+            self.afinish(key, future, error=e)
+            raise
+        self.afinish(key, future, result)
+        return result
+
+    async def _ashared(self, key, fetch, recheck):
+        if not settings.SINGLEFLIGHT_SHARED or recheck is None:
+            return await fetch()
+
+        backend = caches[self.alias]
+        lock_key = f"singleflight:{self.name}:{key}"
+        token = secrets.token_hex(8)
+        deadline = time.monotonic() + settings.SINGLEFLIGHT_WAIT_SECONDS
+        waited = False
+        while not await backend.aadd(
+            lock_key, token, settings.SINGLEFLIGHT_LOCK_SECONDS
+        ):
+            waited = True
+            result = await recheck()
+            if result is not None:
+                metrics.coalesced_calls.inc(flight=self.name, scope="shared")
+                return result
+            if time.monotonic() > deadline:
+                return await fetch()
+            await asyncio.sleep(POLL_SECONDS)
+        try:
+            result = await recheck() if waited else None
+            if result is not None:
+                metrics.coalesced_calls.inc(flight=self.name, scope="shared")
+                return result
+            return await fetch()
+        finally:
+            if await backend.aget(lock_key) == token:
+                await backend.adelete(lock_key)
+
+
+search_flight = SingleFlight("search")
+analysis_flight = SingleFlight("analysis", alias="analysis")
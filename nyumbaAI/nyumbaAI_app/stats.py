@@ -0,0 +1,437 @@
+"""Per-location market statistics for the analysis prompt and the stats API.
+
+Each LocationStats row holds sparse log-scale price histograms (overall, per
+rating bucket and per search month) of the distinct properties found by
+searches of a location. Saves fold newly found properties in with
+``record_appearances``, so old listings are never reread; percentiles are read
+back from the histograms to within half a bin (about 3%). ``rebuild_stats``
+recomputes every row from the stored search results with NumPy, e.g. after
+``compact_listings`` has merged duplicates.
+"""
+
+import logging
+import math
+from collections import Counter, defaultdict
+from decimal import Decimal
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, Optional, Tuple
+
+from django.db import DatabaseError, transaction
+from django.utils import timezone
+
+from . import metrics
+from .cache import normalize_location
+from .models import HouseListing, LocationStats, SearchQuery, SearchResult
+
+# numpy is only needed by rebuild_stats, not in the web workers
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Histogram bins per factor of 10 in price; 40 makes each bin about 6% wide
+BINS_PER_DECADE = 40
+
+# (upper bound, name) of the rating buckets, lowest first
+RATING_BUCKETS = [(3.0, "<3"), (4.0, "3-4"), (4.5, "4-4.5"), (math.inf, "4.5+")]
+UNRATED = "unrated"
+BUCKET_NAMES = [name for _, name in RATING_BUCKETS] + [UNRATED]
+
+# Most recent months of the time series given to the analysis prompt
+PROMPT_MONTHS = 6
+
+# Listing ids per query when checking which properties are new to a location
+ID_CHUNK = 500
+
+UPDATE_FIELDS = [
+    "location",
+    "listing_count",
+    "currency",
+    "priced_count",
+    "price_min",
+    "price_max",
+    "price_histogram",
+    "rating_histograms",
+    "monthly",
+    "updated",
+]
+
+
+def price_bin(amount: float) -> int:
+    return math.floor(math.log10(amount) * BINS_PER_DECADE)
+
+
+def bin_price(index: int) -> float:
+    """Geometric middle of a price bin"""
+    return 10 ** ((index + 0.5) / BINS_PER_DECADE)
+
+
+def rating_bucket(rating: Optional[float]) -> str:
+    if rating is None:
+        return UNRATED
+    for bound, name in RATING_BUCKETS:
+        if rating < bound:
+            return name
+
+
+def percentile(histogram: Dict[str, int], q: float) -> Optional[float]:
+    """Approximate q-quantile (0..1) of the prices in a histogram"""
+    total = sum(histogram.values())
+    if not total:
+        return None
+    seen = 0
+    for index in sorted(map(int, histogram)):
+        seen += histogram[str(index)]
+        if seen >= q * total:
+            return bin_price(index)
+
+
+def _bump(histogram: Dict[str, int], index: int) -> None:
+    key = str(index)
+    histogram[key] = histogram.get(key, 0) + 1
+
+
+def _month(timestamp) -> str:
+    return timestamp.strftime("%Y-%m")
+
+
+def record_appearances(
+    appearances: Iterable[Tuple[SearchQuery, int, HouseListing]],
+) -> None:
+    """Fold properties just linked to searches into their locations' stats.
+
+    ``appearances`` are (search, listing id, listing) for new SearchResult
+    rows. A property an earlier search of the same location already found is
+    not counted again. Runs in the caller's transaction; a failure leaves the
+    stats behind until the next rebuild rather than failing the save.
+    """
+    appearances = list(appearances)
+    if not appearances:
+        return
+    try:
+        with transaction.atomic():
+            _record(appearances)
+    except DatabaseError as e:
+        metrics.errors.inc(where="location_stats")
+        logger.warning("Location stats error: %s", e)
+
+
+def _record(appearances: List[Tuple[SearchQuery, int, HouseListing]]) -> None:
+    searches = {search.pk for search, _, _ in appearances}
+    locations = {search.normalized_location for search, _, _ in appearances}
+    listing_ids = list({listing_id for _, listing_id, _ in appearances})
+    seen = set()
+    for start in range(0, len(listing_ids), ID_CHUNK):
+        # Filtering on location in SQL makes SQLite walk every search of the
+        # location instead of the few results of each listing
+        rows = (
+            SearchResult.objects.filter(
+                listing_id__in=listing_ids[start : start + ID_CHUNK]
+            )
+            .exclude(search_id__in=searches)
+            .values_list("search__normalized_location", "listing_id")
+        )
+        seen.update(row for row in rows if row[0] in locations)
+
+    found = defaultdict(list)
+    for search, listing_id, listing in appearances:
+        key = (search.normalized_location, listing_id)
+        if key not in seen:
+            seen.add(key)
+            found[search.normalized_location].append((search, listing))
+    if not found:
+        return
+
+    existing = {
+        stats.normalized_location: stats
+        for stats in LocationStats.objects.select_for_update().filter(
+            normalized_location__in=found
+        )
+    }
+    created, updated = [], []
+    for key, entries in found.items():
+        stats = existing.get(key)
+        if stats is None:
+            stats = LocationStats(
+                normalized_location=key, location=entries[0][0].location
+            )
+            created.append(stats)
+        else:
+            # bulk_update skips auto_now
+            stats.updated = timezone.now()
+            updated.append(stats)
+        _fold(stats, entries)
+    LocationStats.objects.bulk_create(created)
+    LocationStats.objects.bulk_update(updated, UPDATE_FIELDS)
+
+
+def _fold(stats: LocationStats, entries: List[Tuple[SearchQuery, HouseListing]]):
+    if not stats.currency:
+        currencies = Counter(
+            listing.price_currency
+            for _, listing in entries
+            if listing.price_amount and listing.price_currency
+        )
+        if currencies:
+            stats.currency = currencies.most_common(1)[0][0]
+
+    stats.listing_count += len(entries)
+    for search, listing in entries:
+        month = stats.monthly.setdefault(
+            _month(search.timestamp), {"listings": 0, "prices": {}}
+        )
+        month["listings"] += 1
+
+        # Like rebuild_stats, prices without a currency are not counted
+        amount = listing.price_amount
+        if (
+            not amount
+            or amount <= 0
+            or not listing.price_currency
+            or listing.price_currency != stats.currency
+        ):
+            continue
+        index = price_bin(float(amount))
+        stats.priced_count += 1
+        _bump(stats.price_histogram, index)
+        _bump(
+            stats.rating_histograms.setdefault(rating_bucket(listing.rating), {}),
+            index,
+        )
+        _bump(month["prices"], index)
+        if stats.price_min is None or amount < stats.price_min:
+            stats.price_min = amount
+        if stats.price_max is None or amount > stats.price_max:
+            stats.price_max = amount
+
+
+def _histogram(bins: "np.ndarray") -> Dict[str, int]:
+    import numpy as np
+
+    indexes, counts = np.unique(bins, return_counts=True)
+    return {str(index): int(count) for index, count in zip(indexes, counts)}
+
+
+def rebuild_stats(chunk_size: int = 20_000) -> int:
+    """Recompute every location's stats from stored search results.
+
+    Returns the number of locations written.
+    """
+    import numpy as np
+
+    rows = SearchResult.objects.order_by("search__timestamp", "pk").values_list(
+        "search__normalized_location",
+        "search__location",
+        "search__timestamp",
+        "listing_id",
+        "listing__price_amount",
+        "listing__price_currency",
+        "listing__rating",
+    )
+    keys, names, currencies = {}, [], {}
+    columns = [[] for _ in range(6)]
+    for key, name, timestamp, listing_id, amount, currency, rating in rows.iterator(
+        chunk_size=chunk_size
+    ):
+        if key not in keys:
+            keys[key] = len(names)
+            names.append(name)
+        for column, value in zip(
+            columns,
+            (
+                keys[key],
+                listing_id,
+                timestamp.year * 12 + timestamp.month - 1,
+                float(amount) if amount else np.nan,
+                currencies.setdefault(currency, len(currencies)) if currency else -1,
+                np.nan if rating is None else rating,
+            ),
+        ):
+            column.append(value)
+    if not names:
+        with transaction.atomic():
+            LocationStats.objects.all().delete()
+        return 0
+
+    location, listing, month = (
+        np.array(column, dtype=np.int64) for column in columns[:3]
+    )
+    amount, rating = (np.array(columns[i], dtype=float) for i in (3, 5))
+    currency = np.array(columns[4], dtype=np.int64)
+
+    # First time each location found each property; rows are in time order
+    _, first = np.unique(location * (listing.max() + 1) + listing, return_index=True)
+    order = first[np.argsort(location[first], kind="stable")]
+    location, month, amount, currency, rating = (
+        column[order] for column in (location, month, amount, currency, rating)
+    )
+    bounds = [bound for bound, _ in RATING_BUCKETS[:-1]]
+    bucket = np.where(
+        np.isnan(rating), len(BUCKET_NAMES) - 1, np.digitize(rating, bounds)
+    )
+    normalized = list(keys)
+    currency_names = list(currencies)
+
+    results = []
+    starts = np.flatnonzero(np.diff(location, prepend=-1))
+    for start, end in zip(starts, [*starts[1:], len(location)]):
+        stats = LocationStats(
+            normalized_location=normalized[location[start]],
+            location=names[location[start]],
+            listing_count=int(end - start),
+        )
+        prices = amount[start:end]
+        priced = (prices > 0) & (currency[start:end] >= 0)
+        if priced.any():
+            main = int(np.bincount(currency[start:end][priced]).argmax())
+            stats.currency = currency_names[main]
+            priced &= currency[start:end] == main
+        bins = np.floor(np.log10(prices[priced]) * BINS_PER_DECADE).astype(np.int64)
+        stats.priced_count = int(priced.sum())
+        if stats.priced_count:
+            stats.price_min = Decimal(str(round(prices[priced].min(), 2)))
+            stats.price_max = Decimal(str(round(prices[priced].max(), 2)))
+        stats.price_histogram = _histogram(bins)
+
+        buckets = bucket[start:end][priced]
+        stats.rating_histograms = {
+            BUCKET_NAMES[index]: _histogram(bins[buckets == index])
+            for index in np.unique(buckets)
+        }
+        months = month[start:end]
+        priced_months = months[priced]
+        stats.monthly = {
+            f"{value // 12}-{value % 12 + 1:02d}": {
+                "listings": int((months == value).sum()),
+                "prices": _histogram(bins[priced_months == value]),
+            }
+            for value in np.unique(months)
+        }
+        results.append(stats)
+
+    with transaction.atomic():
+        LocationStats.objects.all().delete()
+        LocationStats.objects.bulk_create(results, batch_size=500)
+    return len(results)
+
+
+def _round(value: Optional[float], low=None, high=None) -> Optional[float]:
+    """Three significant figures, clamped to the exact price range"""
+    if value is None:
+        return None
+    if low is not None:
+        value = min(max(value, float(low)), float(high))
+    return float(f"{value:.3g}")
+
+
+def summarize(stats: LocationStats) -> Dict[str, Any]:
+    """JSON-ready view of a LocationStats row"""
+    low, high = stats.price_min, stats.price_max
+
+    def median(histogram):
+        return _round(percentile(histogram, 0.5), low, high)
+
+    price = None
+    if stats.priced_count:
+        price = {
+            "min": float(low),
+            "p25": _round(percentile(stats.price_histogram, 0.25), low, high),
+            "median": median(stats.price_histogram),
+            "p75": _round(percentile(stats.price_histogram, 0.75), low, high),
+            "max": float(high),
+        }
+    return {
+        "location": stats.location,
+        "listings": stats.listing_count,
+        "priced": stats.priced_count,
+        "currency": stats.currency,
+        "price": price,
+        "by_rating": [
+            {
+                "rating": name,
+                "listings": sum(stats.rating_histograms[name].values()),
+                "median": median(stats.rating_histograms[name]),
+            }
+            for name in BUCKET_NAMES
+            if name in stats.rating_histograms
+        ],
+        "monthly": [
+            {
+                "month": month,
+                "listings": values["listings"],
+                "median": median(values["prices"]),
+            }
+            for month, values in sorted(stats.monthly.items())
+        ],
+        "updated": stats.updated.isoformat() if stats.updated else None,
+    }
+
+
+def get_location_stats(location: str) -> Optional[Dict[str, Any]]:
+    stats = LocationStats.objects.filter(
+        normalized_location=normalize_location(location)
+    ).first()
+    return None if stats is None else summarize(stats)
+
+
+def _short(value: Optional[float]) -> str:
+    if value is None:
+        return "n/a"
+    for size, suffix in ((1e9, "B"), (1e6, "M"), (1e3, "K")):
+        if value >= size:
+            return f"{value / size:.3g}{suffix}"
+    return f"{value:.3g}"
+
+
+def format_facts(summary: Dict[str, Any]) -> str:
+    """One compact line of market facts for the analysis prompt"""
+    head = f"{summary['location']}: {summary['listings']} properties on record"
+    price = summary["price"]
+    if price is None:
+        return f"{head}, none with a price."
+    parts = [
+        f"{head}, {summary['priced']} priced in {summary['currency']}",
+        f"median {_short(price['median'])}, middle half "
+        f"{_short(price['p25'])}-{_short(price['p75'])}, range "
+        f"{_short(price['min'])}-{_short(price['max'])}",
+    ]
+    ratings = [
+        f"{row['rating']} {_short(row['median'])} ({row['listings']})"
+        for row in summary["by_rating"]
+    ]
+    if ratings:
+        parts.append("median by rating: " + ", ".join(ratings))
+    months = [
+        f"{row['month']} {_short(row['median'])} ({row['listings']} new)"
+        for row in summary["monthly"][-PROMPT_MONTHS:]
+        if row["median"] is not None
+    ]
+    if len(months) > 1:
+        parts.append("median by month found: " + ", ".join(months))
+    return "; ".join(parts) + "."
+
+
+def _facts(rows: Iterable[LocationStats], keys: List[str]) -> str:
+    by_key = {stats.normalized_location: stats for stats in rows}
+    return "\n".join(
+        format_facts(summarize(by_key[key])) for key in keys if key in by_key
+    )
+
+
+def _keys(locations: Iterable[str]) -> List[str]:
+    return list(dict.fromkeys(normalize_location(l) for l in locations if l))
+
+
+def market_facts(*locations: str) -> str:
+    """Stored statistics of the locations as prompt lines, "" if none"""
+    keys = _keys(locations)
+    if not keys:
+        return ""
+    return _facts(LocationStats.objects.filter(normalized_location__in=keys), keys)
+
+
+async def amarket_facts(*locations: str) -> str:
+    keys = _keys(locations)
+    if not keys:
+        return ""
+    rows = LocationStats.objects.filter(normalized_location__in=keys)
+    return _facts([stats async for stats in rows], keys)
@@ -1,3 +1,1850 @@
-from django.test import TestCase
+import asyncio
+import io
+import itertools
+import json
+import math
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from django.core.cache import caches
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection
+from django.db.utils import ConnectionHandler
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import chat, jobs, metrics, providers, services, timing
+from .async_services import aget_stored_listings
+from .cache import ResultCache, search_cache
+from .chat import (
+    compact_history,
+    history_window,
+    schedule_compaction,
+    start_session,
+)
+from .geo import covering_prefixes, encode_geohash, radius_bboxes
+from .models import (
+    AnalysisJob,
+    ChatMessage,
+    HouseListing,
+    LocationStats,
+    SearchQuery,
+    SearchResult,
+)
+from .pipeline import (
+    STAGES,
+    iter_json_array,
+    iter_json_lines,
+    listing_fingerprint,
+    run_pipeline,
+    stage,
+)
+from .pricing import parse_price
+from .prompts import estimate_tokens, fit_text, listing_table, record_savings
+from .singleflight import SingleFlight
+from .upstream import (
+    CLOSED,
+    HALF_OPEN,
+    OPEN,
+    CircuitBreaker,
+    CircuitOpen,
+    Guard,
+    RateLimited,
+    TokenBucket,
+)
+from .services import (
+    analysis_cache_key,
+    batch_search,
+    build_analysis_prompt,
+    build_search_params,
+    find_listings_near,
+    generate_analysis,
+    get_listing_page,
+    get_stored_listings,
+    merge_listings,
+    process_search_results,
+    row_fingerprint,
+    search_cache_key,
+    save_search,
+    save_searches,
+    schedule_refresh,
+    search_houses,
+    search_many,
+)
+from .stats import rebuild_stats
+
+
+class CollectTests(SimpleTestCase):
+    def test_nested_collect_reaches_enclosing(self):
+        with timing.collect() as outer:
+            timing.record("search", 1.0)
+            with timing.collect() as inner:
+                timing.record("search", 0.5)
+                timing.record("render", 0.25)
+            timing.record("chat", 2.0)
+
+        self.assertEqual(inner, {"search": 0.5, "render": 0.25})
+        self.assertEqual(outer, {"search": 1.5, "render": 0.25, "chat": 2.0})
+
+    def test_collect_outside_collect(self):
+        with timing.collect() as timings:
+            timing.record("search", 1.0)
+        self.assertEqual(timings, {"search": 1.0})
+        self.assertEqual(timing.current(), {})
+
+
+class MetricsTests(SimpleTestCase):
+    def histogram(self):
+        histogram = metrics.Histogram(
+            "test_seconds", "Test histogram", ["view"], buckets=(0.1, 1.0)
+        )
+        self.addCleanup(metrics._registry.remove, histogram)
+        return histogram
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.histogram()
+        for seconds in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(seconds, view='say "hi"')
+        lines = list(histogram.render())
+        self.assertEqual(lines[1], "# TYPE test_seconds histogram")
+        self.assertEqual(
+            lines[2:],
+            [
+                'test_seconds_bucket{view="say \\"hi\\"",le="0.1"} 1',
+                'test_seconds_bucket{view="say \\"hi\\"",le="1.0"} 3',
+                'test_seconds_bucket{view="say \\"hi\\"",le="+Inf"} 4',
+                'test_seconds_sum{view="say \\"hi\\""} 6.05',
+                'test_seconds_count{view="say \\"hi\\""} 4',
+            ],
+        )
+
+    def test_stage_timings_reach_metrics(self):
+        before = metrics.stage_seconds._values.get(("test_stage",), [0, 0.0, 0])[2]
+        timing.record("test_stage", 0.2)
+        self.assertEqual(metrics.stage_seconds._values[("test_stage",)][2], before + 1)
+
+
+class FakeLLM:
+    """LLM provider answering every completion with ``reply``; records the
+    messages of each call"""
+
+    def __init__(self, reply="Reply"):
+        self.reply = reply
+        self.calls = []
+
+    def client(self):
+        return SimpleNamespace(chat=SimpleNamespace(completions=self))
+
+    def create(self, messages, stream=False, **kwargs):
+        self.calls.append(messages)
+        if stream:
+            return iter(
+                [
+                    SimpleNamespace(
+                        choices=[
+                            SimpleNamespace(delta=SimpleNamespace(content=self.reply))
+                        ]
+                    )
+                ]
+            )
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=self.reply))]
+        )
+
+
+def _locmem(location, timeout):
+    return {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": location,
+        "TIMEOUT": timeout,
+        "OPTIONS": {"MAX_ENTRIES": 3},
+    }
+
+
+@override_settings(
+    CACHES={
+        "test_live": _locmem("test-live", 60),
+        "test_stale": _locmem("test-stale", 3600),
+    },
+    UPSTREAM_STALE_SECONDS=3600,
+)
+class ResultCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = ResultCache("test_live", "test", stale_alias="test_stale")
+        for alias in ("test_live", "test_stale"):
+            caches[alias].clear()
+
+    def test_hits_and_misses_counted(self):
+        key = self.cache.make_key({"location": "Kilimani"})
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, "results")
+        self.assertEqual(self.cache.get(key), "results")
+        self.cache.get_stale(key)
+        self.assertEqual(self.cache.stats(), {"hits": 1, "misses": 1})
+
+    def test_stale_copy_outlives_ttl(self):
+        key = self.cache.make_key({"location": "Kilimani"})
+        with mock.patch("time.time", return_value=1000.0):
+            self.cache.set(key, "results")
+        with mock.patch("time.time", return_value=1059.0):
+            self.assertEqual(self.cache.get(key), "results")
+        with mock.patch("time.time", return_value=1061.0):
+            self.assertIsNone(self.cache.get(key))
+            self.assertEqual(self.cache.get_stale(key), "results")
+        with mock.patch("time.time", return_value=4601.0):
+            self.assertIsNone(self.cache.get_stale(key))
+
+    def test_stale_copies_leave_live_capacity(self):
+        keys = [self.cache.make_key({"page": page}) for page in range(3)]
+        for key in keys:
+            self.cache.set(key, key)
+        self.assertEqual([self.cache.get(key) for key in keys], keys)
+        self.assertEqual([self.cache.get_stale(key) for key in keys], keys)
+
+    def test_async_stale_fallback(self):
+        key = self.cache.make_key({"location": "Kilimani"})
+
+        async def run():
+            await self.cache.aset(key, "results")
+            self.cache.backend.delete(key)
+            return await self.cache.aget(key), await self.cache.aget_stale(key)
+
+        self.assertEqual(asyncio.run(run()), (None, "results"))
+
+    def test_without_stale_alias(self):
+        cache = ResultCache("test_live", "cursor")
+        cache.set("cursor:1", "page")
+        self.assertIsNone(caches["test_stale"].get("stale:cursor:1"))
+
+
+class FixtureProviderTests(SimpleTestCase):
+    messages = [{"role": "user", "content": "Compare Kilimani and Karen"}]
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        fixtures = override_settings(
+            PROVIDER_FIXTURES_DIR=self.directory,
+            PROVIDER_RECORD=False,
+            SEARCH_PROVIDER="fixture",
+            LLM_PROVIDER="fixture",
+            SEARCH_FIXTURE_LATENCY=0,
+            SEARCH_FIXTURE_ERROR_RATE=0,
+            LLM_FIXTURE_LATENCY=0,
+            LLM_FIXTURE_ERROR_RATE=0,
+            SEARCH_RATE_PER_MINUTE=0,
+            LLM_RATE_PER_MINUTE=0,
+            UPSTREAM_RETRIES=0,
+        )
+        fixtures.enable()
+        self.addCleanup(fixtures.disable)
+
+    def write(self, kind, key, payload):
+        os.makedirs(os.path.join(self.directory, kind), exist_ok=True)
+        with open(os.path.join(self.directory, kind, f"{key}.json"), "w") as out:
+            json.dump(payload, out)
+
+    def test_search_replays_recording(self):
+        params = build_search_params("Kilimani")
+        recorded = {"local_results": [{"title": "Recorded"}]}
+        self.write("search", providers.search_fixture_key(params), recorded)
+        self.write("search", "0" * 24, {"local_results": [{"title": "Other"}]})
+
+        search = providers.search_provider()
+        self.assertEqual(search.search(params), recorded)
+        self.assertEqual(search.search(build_search_params(" kilimani")), recorded)
+        self.assertEqual(asyncio.run(search.asearch(params)), recorded)
+        # Unrecorded searches get a stable pick among the recordings
+        other = build_search_params("Karen")
+        self.assertEqual(search.search(other), search.search(other))
+
+    def test_search_without_recordings(self):
+        search = providers.search_provider()
+        self.assertEqual(
+            search.search(build_search_params("Kilimani")), {"local_results": []}
+        )
+
+    def test_simulated_latency_and_errors(self):
+        with override_settings(SEARCH_FIXTURE_LATENCY=0.05):
+            started = time.perf_counter()
+            providers.search_provider().search(build_search_params("Kilimani"))
+            self.assertGreaterEqual(time.perf_counter() - started, 0.05)
+        with override_settings(LLM_FIXTURE_ERROR_RATE=1.0):
+            with self.assertRaises(providers.ProviderError):
+                providers.llm_client().chat.completions.create(
+                    messages=self.messages, model="model"
+                )
+
+    def test_recorded_completion_replayed(self):
+        recorder = providers._RecordingCompletions(FakeLLM("## Karen\nQuieter"))
+        with override_settings(PROVIDER_RECORD=True):
+            recorder.create(messages=self.messages, model="model")
+
+        completions = providers.llm_client().chat.completions
+        reply = completions.create(messages=self.messages, model="model")
+        self.assertEqual(reply.choices[0].message.content, "## Karen\nQuieter")
+        chunks = completions.create(messages=self.messages, model="model", stream=True)
+        self.assertEqual(
+            [c.choices[0].delta.content for c in chunks if c.choices],
+            ["## Karen\n", "Quieter"],
+        )
+        # Other prompts fall back to a recording too
+        other = completions.create(
+            messages=[{"role": "user", "content": "Hi"}], model="model"
+        )
+        self.assertEqual(other.choices[0].message.content, "## Karen\nQuieter")
+
+    def test_unknown_provider(self):
+        with override_settings(SEARCH_PROVIDER="bing"):
+            with self.assertRaisesMessage(ValueError, "Unknown search provider 'bing'"):
+                providers.search_provider()
+
+
+class AnalysisCacheKeyTests(SimpleTestCase):
+    listings = [
+        {"title": "Garden flat", "price": "KSh 80,000", "address": "Kilimani"},
+        {"title": "Penthouse", "price": "KSh 250,000", "address": "Westlands"},
+    ]
+
+    def key(self, listings, query="2 bed", model="model"):
+        return analysis_cache_key(query, listings, model)
+
+    def test_same_request_same_key(self):
+        self.assertEqual(self.key(self.listings), self.key(list(self.listings)))
+
+    def test_query_spacing_and_case_share_key(self):
+        self.assertEqual(
+            self.key(self.listings, "Family homes"),
+            self.key(self.listings, "family  homes "),
+        )
+        self.assertNotEqual(
+            self.key(self.listings, "Family homes"), self.key(self.listings, "Flats")
+        )
+
+    def test_order_shares_key_and_prompt(self):
+        reversed_listings = list(reversed(self.listings))
+        self.assertEqual(self.key(self.listings), self.key(reversed_listings))
+        self.assertEqual(
+            build_analysis_prompt("2 bed", self.listings),
+            build_analysis_prompt("2 bed", reversed_listings),
+        )
+
+    def test_rating_changes_key(self):
+        rated = [dict(self.listings[0], rating=4.5), self.listings[1]]
+        self.assertNotEqual(self.key(self.listings), self.key(rated))
+
+    def test_model_changes_key(self):
+        self.assertNotEqual(
+            self.key(self.listings), self.key(self.listings, model="other")
+        )
+
+    def test_facts_stay_out_of_key(self):
+        llm = FakeLLM("Analysis")
+        self.addCleanup(caches["analysis"].clear)
+        with mock.patch.dict(providers._providers, {"llm": llm}):
+            for facts in ("12 properties on record", "13 properties on record"):
+                self.assertEqual(
+                    generate_analysis("Family homes", self.listings, facts), "Analysis"
+                )
+            generate_analysis("family  homes", list(reversed(self.listings)))
+        self.assertEqual(len(llm.calls), 1)
+        self.assertIn("12 properties on record", llm.calls[0][0]["content"])
+
+
+class ParsePriceTests(SimpleTestCase):
+    def assertPrice(self, text, amount, currency):
+        self.assertEqual(
+            parse_price(text), (None if amount is None else Decimal(amount), currency)
+        )
+
+    def test_currency_and_magnitude(self):
+        self.assertPrice("$350,000", "350000.00", "USD")
+        self.assertPrice("KSh 12M", "12000000.00", "KES")
+        self.assertPrice("KSh12M", "12000000.00", "KES")
+        self.assertPrice("Kshs. 80,000", "80000.00", "KES")
+        self.assertPrice("US$1,500", "1500.00", "USD")
+        self.assertPrice("KES 2.5 million", "2500000.00", "KES")
+
+    def test_amount_after_currency_wins(self):
+        self.assertPrice("3 bedroom Ksh 45,000", "45000.00", "KES")
+        self.assertPrice("$300K - $400K", "300000.00", "USD")
+
+    def test_currency_after_amount(self):
+        self.assertPrice("45,000 KES", "45000.00", "KES")
+
+    def test_currency_codes_are_whole_words(self):
+        self.assertPrice("Lakes view 3M", "3000000.00", "")
+
+    def test_bare_numbers_are_not_prices(self):
+        self.assertPrice("2 Bedroom Apartment", None, "")
+        self.assertPrice("150000", None, "")
+        self.assertPrice("1e9", None, "")
+        self.assertPrice("Price Not Available", None, "")
+        self.assertPrice(None, None, "")
+
+    def test_amounts_too_large_to_store(self):
+        self.assertPrice("$" + "9" * 27, None, "")
+        self.assertPrice("KSh 100,000,000,000,000", None, "")
+        self.assertPrice("KSh 99,999 billion", "99999000000000.00", "KES")
+        self.assertPrice("KSh 100,000 billion", None, "")
+
+
+class CountingFlight(SingleFlight):
+    """SingleFlight that lets a test wait until every caller has joined"""
+
+    def __init__(self, name):
+        super().__init__(name)
+        self.joined = threading.Semaphore(0)
+
+    def begin(self, key):
+        try:
+            return super().begin(key)
+        finally:
+            self.joined.release()
+
+    def abegin(self, key):
+        try:
+            return super().abegin(key)
+        finally:
+            self.joined.release()
+
+
+@override_settings(SINGLEFLIGHT_SHARED=False, SINGLEFLIGHT_WAIT_SECONDS=5)
+class SingleFlightThreadTests(SimpleTestCase):
+    callers = 8
+
+    def run_callers(self, flight, fetch):
+        outcomes = []
+
+        def call():
+            try:
+                outcomes.append(flight.do("key", fetch))
+            except Exception as e:
+                outcomes.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(self.callers)]
+        for thread in threads:
+            thread.start()
+        return threads, outcomes
+
+    def test_concurrent_callers_share_one_fetch(self):
+        flight = CountingFlight("test")
+        release = threading.Event()
+        fetches = []
+
+        def fetch():
+            fetches.append(1)
+            release.wait(5)
+            return "result"
+
+        threads, outcomes = self.run_callers(flight, fetch)
+        for _ in range(self.callers):
+            self.assertTrue(flight.joined.acquire(timeout=5))
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(outcomes, ["result"] * self.callers)
+        # The next call fetches again
+        self.assertEqual(flight.do("key", lambda: "again"), "again")
+
+    def test_leader_error_reaches_every_caller(self):
+        flight = CountingFlight("test")
+        release = threading.Event()
+        fetches = []
+
+        def fetch():
+            fetches.append(1)
+            release.wait(5)
+            raise ValueError("upstream down")
+
+        threads, outcomes = self.run_callers(flight, fetch)
+        for _ in range(self.callers):
+            self.assertTrue(flight.joined.acquire(timeout=5))
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(len(outcomes), self.callers)
+        for outcome in outcomes:
+            self.assertIsInstance(outcome, ValueError)
+
+
+@override_settings(SINGLEFLIGHT_SHARED=False, SINGLEFLIGHT_WAIT_SECONDS=5)
+class SearchCoalescingTests(SimpleTestCase):
+    def setUp(self):
+        for alias in ("search_results", "search_stale"):
+            caches[alias].clear()
+            self.addCleanup(caches[alias].clear)
+
+    def test_concurrent_searches_share_one_upstream_call(self):
+        provider = PagedSearch(total=2)
+        entered = threading.Event()
+        search = provider.search
+
+        def blocking_search(params):
+            entered.set()
+            provider.release.wait(5)
+            return search(params)
+
+        provider.search = blocking_search
+        self.addCleanup(provider.release.set)
+        coalesced = metrics.coalesced_calls.value(flight="search", scope="process")
+        results = []
+
+        def run():
+            results.append(search_houses("Coalesce"))
+
+        with mock.patch.dict(providers._providers, {"search": provider}):
+            threads = [threading.Thread(target=run)]
+            threads[0].start()
+            self.assertTrue(entered.wait(5))
+            threads += [threading.Thread(target=run) for _ in range(3)]
+            for thread in threads[1:]:
+                thread.start()
+            # Let the followers join the in-flight call
+            time.sleep(0.2)
+            provider.release.set()
+            for thread in threads:
+                thread.join(5)
+
+        self.assertEqual(provider.starts, [0])
+        self.assertEqual(len(results), 4)
+        self.assertTrue(all(result == results[0] for result in results))
+        self.assertEqual(
+            metrics.coalesced_calls.value(flight="search", scope="process"),
+            coalesced + 3,
+        )
+
+
+@override_settings(SINGLEFLIGHT_SHARED=True, SINGLEFLIGHT_WAIT_SECONDS=5)
+class SingleFlightSharedTests(SimpleTestCase):
+    def setUp(self):
+        self.cache = caches["search_results"]
+        self.lock_key = "singleflight:test:key"
+        self.addCleanup(self.cache.delete, self.lock_key)
+
+    def test_recheck_short_circuits_while_another_process_fetches(self):
+        # Another process holds the lock and has stored its result
+        self.cache.add(self.lock_key, "other", 60)
+
+        def fetch():
+            raise AssertionError("fetched despite a cached result")
+
+        result = SingleFlight("test").do("key", fetch, lambda: "cached")
+        self.assertEqual(result, "cached")
+        self.assertEqual(self.cache.get(self.lock_key), "other")
+
+    def test_leader_fetches_without_recheck_when_lock_is_free(self):
+        rechecks = []
+
+        def recheck():
+            rechecks.append(1)
+            return "cached"
+
+        result = SingleFlight("test").do("key", lambda: "fresh", recheck)
+        self.assertEqual(result, "fresh")
+        self.assertEqual(rechecks, [])
+        self.assertIsNone(self.cache.get(self.lock_key))
+
+    def test_async_recheck_short_circuits(self):
+        self.cache.add(self.lock_key, "other", 60)
+
+        async def fetch():
+            raise AssertionError("fetched despite a cached result")
+
+        async def recheck():
+            return "cached"
+
+        result = asyncio.run(SingleFlight("test").ado("key", fetch, recheck))
+        self.assertEqual(result, "cached")
+
+
+@override_settings(SINGLEFLIGHT_SHARED=False, SINGLEFLIGHT_WAIT_SECONDS=5)
+class SingleFlightAsyncTests(SimpleTestCase):
+    callers = 8
+
+    def run_callers(self, fetch):
+        flight = CountingFlight("test")
+
+        async def main():
+            release = asyncio.Event()
+
+            async def gated():
+                await release.wait()
+                return await fetch()
+
+            tasks = [
+                asyncio.ensure_future(flight.ado("key", gated))
+                for _ in range(self.callers)
+            ]
+            for _ in range(self.callers):
+                while not flight.joined.acquire(blocking=False):
+                    await asyncio.sleep(0)
+            release.set()
+            return await asyncio.gather(*tasks, return_exceptions=True)
+
+        return asyncio.run(main())
+
+    def test_concurrent_tasks_share_one_fetch(self):
+        fetches = []
+
+        async def fetch():
+            fetches.append(1)
+            return "result"
+
+        self.assertEqual(self.run_callers(fetch), ["result"] * self.callers)
+        self.assertEqual(len(fetches), 1)
+
+    def test_leader_error_reaches_every_task(self):
+        fetches = []
+
+        async def fetch():
+            fetches.append(1)
+            raise ValueError("upstream down")
+
+        outcomes = self.run_callers(fetch)
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(len(outcomes), self.callers)
+        for outcome in outcomes:
+            self.assertIsInstance(outcome, ValueError)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+class TokenBucketTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        # One call per second, bursts of two
+        self.bucket = TokenBucket(60, 2, self.clock)
+
+    def test_burst_then_wait(self):
+        self.assertEqual(self.bucket.reserve(max_wait=5), 0.0)
+        self.assertEqual(self.bucket.reserve(max_wait=5), 0.0)
+        self.assertAlmostEqual(self.bucket.reserve(max_wait=5), 1.0)
+        self.assertAlmostEqual(self.bucket.reserve(max_wait=5), 2.0)
+
+    def test_rejects_long_waits_without_taking_a_token(self):
+        self.bucket.reserve(max_wait=0)
+        self.bucket.reserve(max_wait=0)
+        with self.assertRaises(RateLimited):
+            self.bucket.reserve(max_wait=0.5)
+        self.clock.advance(1)
+        self.assertEqual(self.bucket.reserve(max_wait=0), 0.0)
+
+    def test_refill_is_capped_at_burst(self):
+        self.bucket.reserve(max_wait=0)
+        self.bucket.reserve(max_wait=0)
+        self.clock.advance(60)
+        self.assertEqual(self.bucket.reserve(max_wait=0), 0.0)
+        self.assertEqual(self.bucket.reserve(max_wait=0), 0.0)
+        with self.assertRaises(RateLimited):
+            self.bucket.reserve(max_wait=0)
+
+    def test_zero_rate_disables_limit(self):
+        bucket = TokenBucket(0, 1, self.clock)
+        for _ in range(100):
+            self.assertEqual(bucket.reserve(max_wait=0), 0.0)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker("test", 2, 30, self.clock)
+
+    def open(self):
+        self.breaker.before_call()
+        self.breaker.failure()
+        self.breaker.before_call()
+        self.breaker.failure()
+
+    def test_opens_after_consecutive_failures(self):
+        self.breaker.failure()
+        self.breaker.success()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+
+    def test_half_open_probe_closes_on_success(self):
+        self.open()
+        self.clock.advance(29)
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+
+        self.clock.advance(1)
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.state, HALF_OPEN)
+        # Only one probe at a time
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+
+        self.breaker.success()
+        self.assertEqual(self.breaker.state, CLOSED)
+        self.breaker.before_call()
+
+    def test_half_open_probe_reopens_on_failure(self):
+        self.open()
+        self.clock.advance(30)
+        self.breaker.before_call()
+        self.breaker.failure()
+        self.assertEqual(self.breaker.state, OPEN)
+        self.clock.advance(29)
+        with self.assertRaises(CircuitOpen):
+            self.breaker.before_call()
+
+
+class FailingSearch:
+    def __init__(self):
+        self.calls = 0
+
+    def search(self, params):
+        self.calls += 1
+        raise ConnectionError("search provider down")
+
+
+class GuardTests(SimpleTestCase):
+    def guard(self, clock, retries=0, failure_threshold=1):
+        return Guard(
+            "search",
+            lambda e: isinstance(e, ConnectionError),
+            rate_per_minute=0,
+            burst=1,
+            max_wait=0,
+            retries=retries,
+            backoff=0,
+            backoff_max=0,
+            failure_threshold=failure_threshold,
+            reset_seconds=60,
+            clock=clock,
+        )
+
+    def test_retries_transient_errors(self):
+        outcomes = [ConnectionError("reset"), ConnectionError("reset"), "ok"]
+
+        def flaky():
+            outcome = outcomes.pop(0)
+            if isinstance(outcome, Exception):
+                raise outcome
+            return outcome
+
+        guard = self.guard(FakeClock(), retries=2, failure_threshold=5)
+        self.assertEqual(guard.call(flaky), "ok")
+        self.assertEqual(guard.breaker.state, CLOSED)
+
+    def test_open_breaker_serves_stale_search(self):
+        clock = FakeClock()
+        backend = FailingSearch()
+        search = providers._GuardedSearch(backend)
+        search.guard = self.guard(clock)
+
+        key = search_cache_key(build_search_params("Guard test"))
+        stale = {"local_results": [{"title": "Stored"}]}
+        search_cache.set(key, stale)
+        search_cache.backend.delete(key)
+        self.addCleanup(search_cache.stale_backend.delete, search_cache.stale_key(key))
+
+        with mock.patch.dict(providers._providers, {"search": search}), self.assertLogs(
+            "nyumbaAI_app.services", "WARNING"
+        ):
+            # The failure opens the breaker; both calls get the stale results
+            self.assertEqual(search_houses("Guard test"), stale)
+            self.assertEqual(search.guard.breaker.state, OPEN)
+            self.assertEqual(search_houses("Guard test"), stale)
+            self.assertEqual(backend.calls, 1)
+
+            # After the reset period one probe reaches the provider again
+            clock.advance(60)
+            self.assertEqual(search_houses("Guard test"), stale)
+            self.assertEqual(backend.calls, 2)
+
+
+class PagedSearch:
+    """Search provider with numbered results; pages after the first block
+    until ``release`` is set"""
+
+    def __init__(self, total):
+        self.total = total
+        self.starts = []
+        self.release = threading.Event()
+
+    def search(self, params):
+        start = params.get("start", 0)
+        self.starts.append(start)
+        if start:
+            self.release.wait(5)
+        stop = min(start + params["num"], self.total)
+        return {
+            "local_results": [
+                {"title": f"House {n}", "link": f"https://example.com/listing/{n}"}
+                for n in range(start, stop)
+            ]
+        }
+
+
+@override_settings(SEARCH_PAGE_SIZE=3, SEARCH_MAX_PAGES_PER_REQUEST=2)
+class ListingPageTests(SimpleTestCase):
+    def setUp(self):
+        caches["search_results"].clear()
+        self.addCleanup(caches["search_results"].clear)
+        self.provider = PagedSearch(total=7)
+        patcher = mock.patch.dict(providers._providers, {"search": self.provider})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.provider.release.set)
+
+    def titles(self, page):
+        return [listing["title"] for listing in page["listings"]]
+
+    def test_pages_reuse_prefetched_upstream_pages(self):
+        # Returns while the prefetch of the second upstream page is blocked
+        first = get_listing_page("Paging test", page_size=2)
+        self.assertEqual(self.titles(first), ["House 0", "House 1"])
+
+        self.provider.release.set()
+        second = get_listing_page("", first["next_cursor"], page_size=2)
+        self.assertEqual(self.titles(second), ["House 2", "House 3"])
+        third = get_listing_page("", second["next_cursor"], page_size=2)
+        self.assertEqual(self.titles(third), ["House 4", "House 5"])
+        last = get_listing_page("", third["next_cursor"], page_size=2)
+        self.assertEqual(self.titles(last), ["House 6"])
+        self.assertIsNone(last["next_cursor"])
+
+        # Each upstream page was fetched once, at a page boundary
+        self.assertEqual(self.provider.starts, [0, 3, 6])
+
+
+def _listing(number, amount=None, currency="", rating=None):
+    return {
+        "title": f"House {number}",
+        "price": f"{currency} {amount}" if amount else "Price Not Available",
+        "price_amount": None if amount is None else Decimal(amount),
+        "price_currency": currency,
+        "address": f"{number} Ngong Road",
+        "link": f"https://example.com/listing/{number}",
+        "rating": rating,
+    }
+
+
+ANALYSIS_MARKDOWN = """# Summary
+
+**Kilimani** is the best value. Prices are falling. Many listings are new.
+
+## Risks
+
+Traffic is heavy at rush hour. Parking is limited and costly near the mall.
+
+## Picks
+
+- House 1 is cheap.
+- House 3 has a garden.
+"""
+
+
+class PromptBudgetTests(SimpleTestCase):
+    listings = [
+        {**_listing(1, "50000", "KES", rating=4.5), "address": "Kilimani"},
+        {**_listing(2), "address": "Kilimani"},
+        {**_listing(3, "70000", "KES", rating=4.0), "address": "Kilimani"},
+        {**_listing(4, "90000", "KES"), "address": "Address Not Available"},
+        {**_listing(5, "60000", "KES", rating=3.9), "address": "Kilimani"},
+    ]
+
+    def test_estimate_tokens(self):
+        self.assertEqual(estimate_tokens(""), 0)
+        # Letter runs by length, digit groups of up to three, symbols one each
+        self.assertEqual(estimate_tokens("Westlands"), 2)
+        self.assertEqual(estimate_tokens("KSh 1,250,000"), 6)
+
+    def test_table_within_budget(self):
+        table, dropped = listing_table(self.listings, 1000)
+        self.assertEqual(dropped, 0)
+        lines = table.splitlines()
+        self.assertEqual(lines[0], "title | price | address | rating")
+        # Placeholders are left blank
+        self.assertEqual(lines[2], "House 2 | - | Kilimani | -")
+        self.assertEqual(lines[4], "House 4 | KES 90000 | - | -")
+
+    def test_table_drops_least_informative_rows(self):
+        table, dropped = listing_table(self.listings, 70)
+        self.assertLessEqual(estimate_tokens(table), 70)
+        self.assertEqual(dropped, 3)
+        self.assertEqual(
+            table.splitlines()[1:],
+            [
+                "House 1 | KES 50000 | Kilimani | 4.5",
+                "House 3 | KES 70000 | Kilimani | 4.0",
+                "(+3 more listings, priced KES 60,000-90,000)",
+            ],
+        )
+
+    def test_long_cells_truncated(self):
+        listing = {"title": "Villa | " + "garden " * 20, "price": "KES 1"}
+        table, _ = listing_table([listing], 1000)
+        title = table.splitlines()[1].split(" | ")[0]
+        self.assertEqual(len(title), 48)
+        self.assertTrue(title.startswith("Villa / garden"))
+        self.assertTrue(title.endswith("…"))
+
+    def test_fit_text_keeps_headings_and_first_sentences(self):
+        self.assertEqual(fit_text(ANALYSIS_MARKDOWN, 1000), ANALYSIS_MARKDOWN)
+        self.assertEqual(
+            fit_text(ANALYSIS_MARKDOWN, 40),
+            "# Summary\nKilimani is the best value.\n## Risks\n"
+            "Traffic is heavy at rush hour.\n## Picks\n- House 1 is cheap.\n…",
+        )
+        for budget in (25, 12, 3):
+            self.assertLessEqual(
+                estimate_tokens(fit_text(ANALYSIS_MARKDOWN, budget)), budget
+            )
+
+    @override_settings(ANALYSIS_LISTINGS_TOKEN_BUDGET=50)
+    def test_analysis_prompt_uses_listing_budget(self):
+        prompt = build_analysis_prompt("family homes", self.listings)
+        self.assertIn("House 1 | KES 50000 | Kilimani | 4.5", prompt)
+        self.assertIn("(+4 more listings, priced KES 60,000-90,000)", prompt)
+        self.assertNotIn("House 3", prompt)
+
+    def test_savings_counted(self):
+        sent = metrics.prompt_tokens.value(prompt="test", kind="sent")
+        saved = metrics.prompt_tokens.value(prompt="test", kind="saved")
+        self.assertEqual(record_savings("test", "Westlands Westlands", "Westlands"), 2)
+        self.assertEqual(
+            metrics.prompt_tokens.value(prompt="test", kind="sent"), sent + 2
+        )
+        self.assertEqual(
+            metrics.prompt_tokens.value(prompt="test", kind="saved"), saved + 2
+        )
+
+
+@override_settings(SEARCH_FRESH_SECONDS=3600, SEARCH_STALE_SECONDS=86400)
+class StoredListingsTests(TestCase):
+    def store(self, age, location="Kilimani", count=1):
+        searched_at = datetime.now(timezone.utc) - age
+        listings = [_listing(n, "50000", "KES") for n in range(count)]
+        save_searches([("houses", location, listings, searched_at)])
+
+    def test_fresh_search_served_without_refresh(self):
+        self.store(timedelta(minutes=10), count=2)
+        with mock.patch.object(services, "schedule_refresh") as refresh:
+            search, listings = get_stored_listings(" kilimani ", "houses")
+        refresh.assert_not_called()
+        self.assertEqual(search.location, "Kilimani")
+        self.assertEqual([l["title"] for l in listings], ["House 0", "House 1"])
+
+    def test_stale_search_served_and_refreshed(self):
+        self.store(timedelta(hours=2))
+        with mock.patch.object(services, "schedule_refresh") as refresh:
+            self.assertIsNotNone(get_stored_listings("Kilimani", "houses"))
+        refresh.assert_called_once_with("Kilimani", "houses")
+
+    def test_expired_and_empty_searches_not_served(self):
+        self.store(timedelta(days=2))
+        self.store(timedelta(minutes=1), location="Karen", count=0)
+        with mock.patch.object(services, "schedule_refresh") as refresh:
+            self.assertIsNone(get_stored_listings("Kilimani"))
+            self.assertIsNone(get_stored_listings("Karen"))
+            self.assertIsNone(get_stored_listings("Lavington"))
+        refresh.assert_not_called()
+
+    def test_newest_search_wins(self):
+        self.store(timedelta(hours=3), count=1)
+        self.store(timedelta(minutes=5), count=2)
+        search, listings = get_stored_listings("Kilimani")
+        self.assertEqual(search.results_count, 2)
+        self.assertEqual(len(listings), 2)
+
+    async def test_async_stale_search_served_and_refreshed(self):
+        await sync_to_async(self.store)(timedelta(hours=2))
+        with mock.patch("nyumbaAI_app.async_services.schedule_refresh") as refresh:
+            search, listings = await aget_stored_listings("Kilimani", "houses")
+        refresh.assert_called_once_with("Kilimani", "houses")
+        self.assertEqual([l["title"] for l in listings], ["House 0"])
+
+
+class RefreshTests(TestCase):
+    def setUp(self):
+        for alias in ("search_results", "search_stale"):
+            caches[alias].clear()
+            self.addCleanup(caches[alias].clear)
+
+    def test_one_refresh_per_location_at_a_time(self):
+        release = threading.Event()
+        done = threading.Semaphore(0)
+
+        def refresh(key, location, query):
+            release.wait(5)
+            with services._refresh_lock:
+                services._refreshing.discard(key)
+            done.release()
+
+        with mock.patch.object(services, "_refresh_search", refresh):
+            self.assertTrue(schedule_refresh("Kilimani"))
+            self.assertFalse(schedule_refresh(" kilimani"))
+            self.assertTrue(schedule_refresh("Karen"))
+            release.set()
+            for location in ("Kilimani", "Karen"):
+                self.assertTrue(done.acquire(timeout=5))
+
+    def test_refresh_stores_a_fresh_search(self):
+        provider = PagedSearch(total=2)
+        services._refreshing.add("kilimani")
+        with mock.patch.dict(
+            providers._providers, {"search": provider}
+        ), mock.patch.object(services, "connection"):
+            services._refresh_search("kilimani", "Kilimani", "houses")
+        self.assertNotIn("kilimani", services._refreshing)
+        search, listings = get_stored_listings("Kilimani")
+        self.assertEqual(search.query, "houses")
+        self.assertEqual([l["title"] for l in listings], ["House 0", "House 1"])
+
+
+class SearchManyTests(SimpleTestCase):
+    def test_distinct_locations_searched_concurrently(self):
+        # Fails with BrokenBarrierError unless all three searches overlap
+        barrier = threading.Barrier(3, timeout=5)
+        searched = []
+
+        def search(location, query):
+            searched.append(location)
+            barrier.wait()
+            return [_listing(len(location))]
+
+        with mock.patch.object(services, "_search_location", search):
+            results = search_many(
+                ["Kilimani", " kilimani ", "Karen", "", "Runda", "KAREN"], "houses"
+            )
+        self.assertEqual(sorted(searched), ["Karen", "Kilimani", "Runda"])
+        self.assertEqual(list(results), ["Kilimani", "Karen", "Runda"])
+
+    def test_worker_pool_is_bounded(self):
+        active = []
+        peak = []
+        lock = threading.Lock()
+
+        def search(location, query):
+            with lock:
+                active.append(location)
+                peak.append(len(active))
+            time.sleep(0.01)
+            with lock:
+                active.remove(location)
+            return []
+
+        with mock.patch.object(services, "_search_location", search):
+            search_many([f"Area {n}" for n in range(6)], max_workers=2)
+        self.assertEqual(max(peak), 2)
+
+    def test_no_locations(self):
+        self.assertEqual(search_many(["", None]), {})
+
+
+class MergeListingsTests(SimpleTestCase):
+    def test_duplicates_merged_and_ranked(self):
+        merged = merge_listings(
+            {
+                "Kilimani": [
+                    _listing(1, "90000", "KES", rating=4.0),
+                    _listing(2, "50000", "KES"),
+                    _listing(3, "70000", "KES", rating=4.5),
+                ],
+                "Karen": [
+                    _listing(3, "70000", "KES", rating=4.5),
+                    _listing(4, "60000", "KES", rating=4.0),
+                    _listing(5),
+                ],
+            }
+        )
+        self.assertEqual(
+            [(listing["title"], listing["location"]) for listing in merged],
+            [
+                ("House 3", "Kilimani"),
+                # Equal ratings: cheaper first
+                ("House 4", "Karen"),
+                ("House 1", "Kilimani"),
+                # Unrated last, unpriced after priced
+                ("House 2", "Kilimani"),
+                ("House 5", "Karen"),
+            ],
+        )
+
+
+class BatchSearchTests(TestCase):
+    def setUp(self):
+        caches["analysis"].clear()
+        self.addCleanup(caches["analysis"].clear)
+
+    def test_one_analysis_of_merged_results(self):
+        results = {
+            "Kilimani": [_listing(1, "50000", "KES"), _listing(2, "60000", "KES")],
+            "Karen": [_listing(2, "60000", "KES")],
+        }
+        llm = FakeLLM("Karen is quieter")
+        with mock.patch.object(
+            services, "search_many", return_value=results
+        ), mock.patch.dict(providers._providers, {"llm": llm}):
+            result = batch_search(["Kilimani", "Karen"], "family homes")
+        self.assertEqual(result["counts"], {"Kilimani": 2, "Karen": 1})
+        self.assertEqual(len(result["listings"]), 2)
+        self.assertEqual(result["analysis"], "Karen is quieter")
+        self.assertEqual(len(llm.calls), 1)
+        self.assertIn("comparing kilimani, karen", llm.calls[0][0]["content"])
+
+    @override_settings(BATCH_SEARCH_MAX_LOCATIONS=2)
+    def test_view_validates_locations(self):
+        for payload in (
+            {},
+            {"locations": []},
+            {"locations": ["Kilimani", 3]},
+            {"locations": ["Kilimani", "Karen", "Runda"]},
+            {"locations": ["Kilimani"], "query": 1},
+        ):
+            response = self.client.post(
+                "/search/batch/", payload, content_type="application/json"
+            )
+            self.assertEqual(response.status_code, 400, payload)
+
+    def test_view_renders_analysis(self):
+        result = {"counts": {"Karen": 0}, "listings": [], "analysis": "**None**"}
+        with mock.patch("nyumbaAI_app.views.batch_search", return_value=result):
+            response = self.client.post(
+                "/search/batch/",
+                {"locations": ["Karen"]},
+                content_type="application/json",
+            )
+        self.assertEqual(
+            response.json()["analysis_html"], "<p><strong>None</strong></p>"
+        )
+
+
+class ServerTimingTests(TestCase):
+    def setUp(self):
+        for alias in ("search_results", "search_stale"):
+            caches[alias].clear()
+            self.addCleanup(caches[alias].clear)
+
+    def test_search_stages_in_header_and_metrics(self):
+        provider = PagedSearch(total=2)
+        with mock.patch.dict(providers._providers, {"search": provider}):
+            response = self.client.post(
+                "/search/", {"location": "Timingtown", "query": "houses"}
+            )
+        self.assertEqual(response.status_code, 200)
+        stages = [
+            entry.split(";")[0] for entry in response["Server-Timing"].split(", ")
+        ]
+        self.assertEqual(stages, ["search", "process", "db_write", "render", "total"])
+
+        scrape = self.client.get("/metrics")
+        self.assertTrue(scrape["Content-Type"].startswith("text/plain"))
+        body = scrape.content.decode()
+        self.assertIn(
+            'nyumbaai_request_seconds_count{view="nyumbaAI_app:search",'
+            'method="POST",status="200"}',
+            body,
+        )
+        self.assertIn('nyumbaai_stage_seconds_count{stage="db_write"}', body)
+        self.assertIn("total;dur=", scrape["Server-Timing"])
+
+
+class LocationStatsTests(TestCase):
+    fields = [
+        "location",
+        "listing_count",
+        "currency",
+        "priced_count",
+        "price_min",
+        "price_max",
+        "price_histogram",
+        "rating_histograms",
+        "monthly",
+    ]
+
+    def snapshot(self):
+        return {
+            stats.normalized_location: {
+                field: getattr(stats, field) for field in self.fields
+            }
+            for stats in LocationStats.objects.all()
+        }
+
+    def test_incremental_matches_rebuild(self):
+        save_search(
+            "houses",
+            "Kilimani",
+            [
+                _listing(1, "3000000"),
+                _listing(2, "50000", "KES", 4.2),
+                _listing(3, "80000", "KES"),
+                _listing(4),
+            ],
+        )
+        save_search(
+            "houses",
+            "Kilimani",
+            [_listing(2, "50000", "KES", 4.2), _listing(5, "65000", "KES", 3.1)],
+        )
+        # Only prices without a currency
+        save_search("houses", "Lakeside", [_listing(6, "2500000"), _listing(7)])
+
+        incremental = self.snapshot()
+        self.assertEqual(incremental["kilimani"]["listing_count"], 5)
+        self.assertEqual(incremental["kilimani"]["priced_count"], 3)
+        self.assertEqual(incremental["lakeside"]["priced_count"], 0)
+
+        rebuild_stats()
+        self.assertEqual(self.snapshot(), incremental)
+
+
+@override_settings(ANALYSIS_JOB_WORKERS=0, ANALYSIS_JOB_MAX_ATTEMPTS=2)
+class AnalysisJobTests(TestCase):
+    def setUp(self):
+        search = save_search("houses", "Jobtown", [_listing(1, "50000", "KES")])
+        self.session = start_session(search, "houses")
+        self.job = jobs.enqueue_analysis(self.session)
+
+    def refresh(self):
+        self.job.refresh_from_db()
+        return self.job
+
+    def test_failed_job_is_retried_after_backoff(self):
+        with mock.patch.object(
+            jobs, "generate_analysis", side_effect=[RuntimeError("down"), "Analysis"]
+        ), mock.patch.object(jobs, "_wake_later") as wake_later, self.assertLogs(
+            "nyumbaAI_app.jobs", "WARNING"
+        ), self.captureOnCommitCallbacks(
+            execute=True
+        ):
+            self.assertTrue(jobs.run_next())
+            self.assertEqual(self.refresh().status, AnalysisJob.PENDING)
+            # Not claimable until the backoff has passed
+            self.assertFalse(jobs.run_next())
+            AnalysisJob.objects.update(available_at=datetime.now(timezone.utc))
+            self.assertTrue(jobs.run_next())
+        wake_later.assert_called_once_with(10)
+        self.assertEqual(self.refresh().status, AnalysisJob.DONE)
+        self.assertEqual(self.job.attempts, 2)
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.analysis, "Analysis")
+
+    @override_settings(ANALYSIS_JOB_RETRY_SECONDS=0)
+    def test_job_fails_after_max_attempts(self):
+        with mock.patch.object(
+            jobs, "generate_analysis", side_effect=RuntimeError("down")
+        ), self.assertLogs("nyumbaAI_app.jobs", "WARNING"):
+            self.assertTrue(jobs.run_next())
+            self.assertTrue(jobs.run_next())
+            self.assertFalse(jobs.run_next())
+        self.assertEqual(self.refresh().status, AnalysisJob.FAILED)
+        self.assertEqual(self.job.error, "down")
+
+    @override_settings(ANALYSIS_JOB_RETRY_SECONDS=10, ANALYSIS_JOB_RETRY_MAX_SECONDS=25)
+    def test_retry_delay_doubles_up_to_max(self):
+        self.assertEqual(
+            [jobs.retry_delay(attempts) for attempts in range(1, 5)], [10, 20, 25, 25]
+        )
+
+    @override_settings(ANALYSIS_JOB_WORKERS=2)
+    def test_first_request_drains_queued_jobs(self):
+        with mock.patch.object(jobs, "_resumed", False), mock.patch.object(
+            jobs, "_wake"
+        ) as wake:
+            jobs.resume_pending(sender=None)
+            jobs.resume_pending(sender=None)
+        wake.assert_called_once_with()
+
+    @override_settings(ANALYSIS_JOB_WORKERS=2)
+    def test_first_request_schedules_backed_off_jobs(self):
+        AnalysisJob.objects.update(
+            attempts=1, available_at=datetime.now(timezone.utc) + timedelta(seconds=30)
+        )
+        with mock.patch.object(jobs, "_resumed", False), mock.patch.object(
+            jobs, "_wake"
+        ) as wake, mock.patch.object(jobs, "_wake_later") as wake_later:
+            jobs.resume_pending(sender=None)
+        wake.assert_not_called()
+        (delay,), _ = wake_later.call_args
+        self.assertAlmostEqual(delay, 30, delta=1)
+
+
+def _turns(*tokens):
+    """Alternating user and assistant messages with the given token counts"""
+    return [
+        ChatMessage(
+            role="assistant" if index % 2 else "user",
+            content=f"Message {index}",
+            tokens=count,
+        )
+        for index, count in enumerate(tokens)
+    ]
+
+
+class ChatHistoryTests(TestCase):
+    def setUp(self):
+        search = save_search("houses", "Chatville", [_listing(1, "50000", "KES")])
+        self.session = start_session(search, "houses")
+
+    def test_window_keeps_whole_turns(self):
+        history = _turns(5, 10, 10, 20)
+        # The first reply alone would fit, but not with its question
+        window, older = history_window(history, 42)
+        self.assertEqual(window, history[2:])
+        self.assertEqual(older, history[:2])
+        self.assertEqual(history_window(history, 45), (history, []))
+        self.assertEqual(history_window(history, 29), ([], history))
+
+    @override_settings(CHAT_HISTORY_TOKEN_BUDGET=30)
+    def test_compact_folds_older_turns_into_summary(self):
+        messages = _turns(10, 10, 10, 10)
+        for message in messages:
+            message.session = self.session
+        ChatMessage.objects.bulk_create(messages)
+        llm = FakeLLM("Wants 2 bedrooms")
+        with mock.patch.dict(providers._providers, {"llm": llm}):
+            self.assertTrue(compact_history(self.session))
+            # Nothing left outside the window
+            self.assertFalse(compact_history(self.session))
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.summary, "Wants 2 bedrooms")
+        prompt = llm.calls[0][0]["content"]
+        self.assertIn("User: Message 0\nAssistant: Message 1", prompt)
+        self.assertNotIn("Message 2", prompt)
+        self.assertEqual(
+            list(
+                self.session.messages.filter(summarized=False).values_list(
+                    "content", flat=True
+                )
+            ),
+            ["Message 2", "Message 3"],
+        )
+
+    def test_chat_reply_does_not_wait_for_summary(self):
+        llm = FakeLLM("Try Kilimani")
+        with mock.patch.dict(providers._providers, {"llm": llm}), mock.patch(
+            "nyumbaAI_app.views.schedule_compaction"
+        ) as schedule:
+            response = self.client.post(
+                "/chat/", {"message": "Any gardens?", "session": self.session.pk}
+            )
+            events = b"".join(response.streaming_content)
+        self.assertIn(b"event: done", events)
+        self.assertEqual(len(llm.calls), 1)
+        schedule.assert_called_once_with(self.session.pk)
+        self.assertEqual(self.session.messages.count(), 2)
+
+    def test_one_compaction_per_session_at_a_time(self):
+        release = threading.Event()
+        done = threading.Semaphore(0)
+
+        def compact(session_id):
+            release.wait(5)
+            # Mirror _compact_session's bookkeeping without touching the database
+            with chat._compact_lock:
+                chat._compacting.discard(session_id)
+            done.release()
+
+        with mock.patch.object(chat, "_compact_session", compact):
+            self.assertTrue(schedule_compaction(self.session.pk))
+            self.assertFalse(schedule_compaction(self.session.pk))
+            release.set()
+            self.assertTrue(done.acquire(timeout=5))
+            self.assertTrue(schedule_compaction(self.session.pk))
+            self.assertTrue(done.acquire(timeout=5))
+
+
+class PipelineTests(SimpleTestCase):
+    def test_search_results_become_listings(self):
+        raw = {
+            "local_results": [
+                {
+                    "title": "Garden flat",
+                    "price": "KSh 80,000",
+                    "links": {"website": "https://example.com/garden"},
+                    "gps_coordinates": {"latitude": -1.29, "longitude": 36.78},
+                },
+                {"title": "Villa", "directions": {"google_url": "https://maps/villa"}},
+                {"title": "Bedsitter", "gps_coordinates": {"latitude": 95}},
+                "not a listing",
+            ]
+        }
+        flat, villa, bedsitter = process_search_results(raw)
+        self.assertEqual(flat["link"], "https://example.com/garden")
+        self.assertEqual(
+            (flat["price_amount"], flat["price_currency"]), (Decimal("80000"), "KES")
+        )
+        self.assertEqual(flat["geohash"], encode_geohash(-1.29, 36.78))
+        self.assertEqual(villa["link"], "https://maps/villa")
+        self.assertEqual(villa["address"], "Address Not Available")
+        # Out of range coordinates are dropped, the listing is kept
+        self.assertEqual(bedsitter["link"], "#")
+        self.assertIsNone(bedsitter["latitude"])
+        self.assertEqual(bedsitter["geohash"], "")
+
+    def test_geo_coerces_and_blanks_pairs(self):
+        items = [
+            {"latitude": "-1.5", "longitude": "36.8"},
+            {"latitude": 1.0, "longitude": float("nan")},
+            {"latitude": None, "longitude": 36.8},
+        ]
+        self.assertEqual(
+            [
+                (listing["latitude"], listing["longitude"])
+                for listing in run_pipeline(items, ["geo"])
+            ],
+            [(-1.5, 36.8), (None, None), (None, None)],
+        )
+
+    def test_stages_pull_one_item_at_a_time(self):
+        pulled = []
+
+        def raw_items():
+            for n in itertools.count():
+                pulled.append(n)
+                yield {"title": f"House {n}", "link": f"https://example.com/{n}"}
+
+        listings = run_pipeline(raw_items())
+        self.assertEqual(pulled, [])
+        self.assertEqual(len(list(itertools.islice(listings, 3))), 3)
+        self.assertEqual(pulled, [0, 1, 2])
+
+    def test_dedupe_shares_seen_across_runs(self):
+        context = {}
+        first = [{"title": "A", "link": "https://example.com/a"}]
+        second = first + [{"title": "B", "link": "https://example.com/b"}]
+        self.assertEqual(len(list(run_pipeline(first, context=context))), 1)
+        titles = [listing["title"] for listing in run_pipeline(second, context=context)]
+        self.assertEqual(titles, ["B"])
+
+    def test_registered_stage_from_settings(self):
+        @stage("shout")
+        def shout(items, context):
+            for listing in items:
+                listing["title"] = listing["title"].upper()
+                yield listing
+
+        self.addCleanup(STAGES.pop, "shout")
+        with override_settings(LISTING_PIPELINE=["normalize", "shout"]):
+            (listing,) = run_pipeline([{"title": "Villa"}])
+        self.assertEqual(listing["title"], "VILLA")
+        self.assertNotIn("price_amount", listing)
+
+
+class JsonReaderTests(SimpleTestCase):
+    records = [
+        {"search_parameters": {"location": "Kilimani"}, "local_results": []},
+        {"title": 'Flat, "2 bed" [new]', "price": 12345},
+        [1, 2, 3],
+        123456789,
+        "text ] with brackets",
+    ]
+
+    def test_array_across_chunk_boundaries(self):
+        text = json.dumps(self.records, indent=1)
+        for chunk_size in (1, 3, 7, 64, 1 << 16):
+            with self.subTest(chunk_size=chunk_size):
+                records = iter_json_array(io.StringIO(text), chunk_size)
+                self.assertEqual(list(records), self.records)
+
+    def test_single_document_and_empty_array(self):
+        self.assertEqual(list(iter_json_array(io.StringIO('{"a": 1}'))), [{"a": 1}])
+        self.assertEqual(list(iter_json_array(io.StringIO(" [ ] "))), [])
+
+    def test_truncated_array(self):
+        with self.assertRaises(ValueError):
+            list(iter_json_array(io.StringIO('[{"a": 1}, {"b"'), 4))
+
+    def test_json_lines_skip_blank_and_malformed(self):
+        lines = io.StringIO('{"a": 1}\n\nnot json\n[2]\n')
+        errors = []
+        records = list(iter_json_lines(lines, errors.append))
+        self.assertEqual(records, [{"a": 1}, [2]])
+        self.assertEqual(errors, ["not json"])
+
+
+def _in_boxes(boxes, latitude, longitude):
+    return any(
+        min_lat <= latitude <= max_lat and min_lon <= longitude <= max_lon
+        for min_lat, min_lon, max_lat, max_lon in boxes
+    )
+
+
+def _destination(latitude, longitude, km, bearing):
+    """Point km along a great circle from lat/lon, normalized to +-180"""
+    angle = km / 6371.0088
+    lat1, lon1, theta = map(math.radians, (latitude, longitude, bearing))
+    lat2 = math.asin(
+        math.sin(lat1) * math.cos(angle)
+        + math.cos(lat1) * math.sin(angle) * math.cos(theta)
+    )
+    lon2 = lon1 + math.atan2(
+        math.sin(theta) * math.sin(angle) * math.cos(lat1),
+        math.cos(angle) - math.sin(lat1) * math.sin(lat2),
+    )
+    lon2 = (math.degrees(lon2) + 540.0) % 360.0 - 180.0
+    return math.degrees(lat2), lon2
+
+
+class GeohashTests(SimpleTestCase):
+    def test_known_vectors(self):
+        self.assertEqual(encode_geohash(57.64911, 10.40744), "u4pruydqq")
+        self.assertEqual(encode_geohash(42.6, -5.6, 5), "ezs42")
+        self.assertEqual(encode_geohash(-90.0, -180.0, 4), "0000")
+        self.assertEqual(encode_geohash(90.0, 180.0, 4), "zzzz")
+
+    def test_shorter_hash_is_prefix(self):
+        full = encode_geohash(-1.2921, 36.8219)
+        for precision in range(1, 9):
+            self.assertEqual(
+                encode_geohash(-1.2921, 36.8219, precision), full[:precision]
+            )
+
+    def test_covering_prefixes_cover_box(self):
+        boxes = [
+            (-1.30, 36.78, -1.26, 36.84),
+            (-1.2921, 36.8219, -1.2921, 36.8219),
+            (10.0, -0.5, 10.5, 0.5),
+            (-60.0, -170.0, 60.0, 170.0),
+        ]
+        for box in boxes:
+            with self.subTest(box=box):
+                prefixes = covering_prefixes(*box, max_cells=32)
+                self.assertLessEqual(len(prefixes), 32)
+                min_lat, min_lon, max_lat, max_lon = box
+                for i in range(11):
+                    for j in range(11):
+                        geohash = encode_geohash(
+                            min_lat + (max_lat - min_lat) * i / 10,
+                            min_lon + (max_lon - min_lon) * j / 10,
+                        )
+                        self.assertTrue(
+                            any(geohash.startswith(p) for p in prefixes), geohash
+                        )
+
+    def test_radius_boxes_enclose_circle(self):
+        centres = [(-1.29, 36.8), (60.0, 10.0), (-45.0, 179.9), (10.0, -179.95)]
+        for latitude, longitude in centres:
+            for radius_km in (1.0, 50.0, 500.0):
+                boxes = radius_bboxes(latitude, longitude, radius_km)
+                for bearing in range(0, 360, 5):
+                    point = _destination(
+                        latitude, longitude, radius_km * 0.999, bearing
+                    )
+                    with self.subTest(centre=(latitude, longitude), point=point):
+                        self.assertTrue(_in_boxes(boxes, *point))
+
+    def test_radius_boxes_split_at_antimeridian(self):
+        east = radius_bboxes(0.0, 179.95, 20.0)
+        self.assertEqual(len(east), 2)
+        self.assertEqual(east[0][3], 180.0)
+        self.assertEqual(east[1][1], -180.0)
+        self.assertTrue(_in_boxes(east, 0.0, -179.9))
+
+        west = radius_bboxes(0.0, -179.95, 20.0)
+        self.assertEqual(len(west), 2)
+        self.assertTrue(_in_boxes(west, 0.0, 179.9))
+
+        self.assertEqual(len(radius_bboxes(0.0, 179.0, 20.0)), 1)
+
+    def test_radius_boxes_over_pole(self):
+        (box,) = radius_bboxes(89.9, 0.0, 50.0)
+        self.assertEqual(box[1:], (-180.0, 90.0, 180.0))
+
+
+class FindListingsNearTests(TestCase):
+    def test_across_antimeridian(self):
+        places = [(1, 179.99), (2, -179.99), (3, -179.5), (4, 179.5)]
+        save_search(
+            "houses",
+            "Taveuni",
+            [
+                dict(_listing(number), latitude=-16.8, longitude=longitude)
+                for number, longitude in places
+            ],
+        )
+        results = find_listings_near(-16.8, 179.999, 10.0)
+        self.assertEqual(
+            [listing["title"] for listing in results], ["House 1", "House 2"]
+        )
+        self.assertLess(results[1]["distance_km"], 10.0)
+
+
+class FingerprintTests(SimpleTestCase):
+    def test_listings_without_location_stay_apart(self):
+        raw = [{"title": f"Apartment {n}"} for n in range(3)]
+        listings = list(run_pipeline(raw))
+        self.assertEqual(len(listings), 3)
+        self.assertEqual(
+            len(merge_listings({"Kilimani": listings[:2], "Karen": listings[2:]})), 3
+        )
+
+    def test_placeholder_address_is_not_an_address(self):
+        self.assertEqual(
+            listing_fingerprint({"title": "A", "address": "Address Not Available"}),
+            listing_fingerprint({"title": "A"}),
+        )
+
+    def test_shared_link_needs_matching_place(self):
+        homepage = "https://agency.example.com/"
+        first = {"link": homepage, "address": "1 Ngong Road"}
+        second = {"link": homepage, "address": "2 Ngong Road"}
+        self.assertNotEqual(listing_fingerprint(first), listing_fingerprint(second))
+        self.assertEqual(
+            listing_fingerprint(first),
+            listing_fingerprint(
+                {"link": "http://www.agency.example.com", "address": "1  ngong road"}
+            ),
+        )
+
+    def test_coordinates_rounded(self):
+        self.assertEqual(
+            listing_fingerprint({"latitude": -1.29001, "longitude": 36.80001}),
+            listing_fingerprint({"latitude": -1.29004, "longitude": 36.80004}),
+        )
+
+
+class BulkSaveTests(TestCase):
+    def queries(self, location, count):
+        listings = [_listing(n, "50000", "KES") for n in range(count)]
+        with CaptureQueriesContext(connection) as context:
+            save_search("houses", location, listings)
+        return len(context)
+
+    def test_statements_do_not_grow_with_listings(self):
+        # Warm up the per-location statistics row
+        self.queries("Kilimani", 1)
+        self.assertEqual(self.queries("Kilimani", 2), self.queries("Kilimani", 40))
+
+    def test_search_saved_in_one_transaction(self):
+        with mock.patch.object(
+            SearchResult.objects, "bulk_create", side_effect=RuntimeError("disk full")
+        ), self.assertRaises(RuntimeError):
+            save_search("houses", "Kilimani", [_listing(1, "50000", "KES")])
+        self.assertFalse(SearchQuery.objects.exists())
+        self.assertFalse(HouseListing.objects.exists())
+
+    def test_batch_of_searches(self):
+        searches = save_searches(
+            [
+                ("houses", "Kilimani", [_listing(1), _listing(2)]),
+                ("flats", "Karen", [_listing(3)]),
+                ("houses", "Runda", []),
+            ],
+            batch_size=2,
+        )
+        self.assertTrue(all(search.pk for search in searches))
+        self.assertEqual(
+            [(search.location, search.results_count) for search in searches],
+            [("Kilimani", 2), ("Karen", 1), ("Runda", 0)],
+        )
+        self.assertEqual(
+            list(
+                searches[0]
+                .results.order_by("position")
+                .values_list("position", "listing__title")
+            ),
+            [(0, "House 1"), (1, "House 2")],
+        )
+        self.assertEqual(HouseListing.objects.count(), 3)
+
+
+class ListingUpsertTests(TestCase):
+    def test_save_searches_upserts_properties(self):
+        first, second = save_searches(
+            [
+                ("houses", "Kilimani", [_listing(1, "50000", "KES"), _listing(2)]),
+                ("houses", "Kilimani", [_listing(2), _listing(1, "45000", "KES")]),
+            ]
+        )
+        self.assertEqual(HouseListing.objects.count(), 2)
+        # Later data wins
+        house = HouseListing.objects.get(title="House 1")
+        self.assertEqual(house.price_amount, Decimal("45000"))
+        self.assertEqual(
+            list(second.results.order_by("position").values_list("listing", flat=True)),
+            [HouseListing.objects.get(title="House 2").pk, house.pk],
+        )
+        self.assertEqual(SearchResult.objects.filter(listing=house).count(), 2)
+
+        # A later search updates the stored row instead of adding one
+        save_search("houses", "Karen", [_listing(1, "40000", "KES")])
+        self.assertEqual(HouseListing.objects.count(), 2)
+        house.refresh_from_db()
+        self.assertEqual(house.price_amount, Decimal("40000"))
+
+    def test_listings_without_location_are_kept_apart(self):
+        save_search(
+            "houses",
+            "Kilimani",
+            [{"title": f"Apartment {n}", "link": "#"} for n in range(3)],
+        )
+        self.assertEqual(HouseListing.objects.count(), 3)
+
+    def test_compact_merges_legacy_rows(self):
+        old, new = save_searches(
+            [
+                ("houses", "Kilimani", [_listing(1, "50000", "KES"), _listing(2)]),
+                ("houses", "Kilimani", [_listing(1, "45000", "KES")]),
+            ]
+        )
+        # Rows as stored before deduplication: one per result, no fingerprint
+        legacy = HouseListing.objects.create(
+            title="House 1",
+            price="KES 45000",
+            address="1 Ngong Road",
+            link="https://example.com/listing/1/",
+        )
+        SearchResult.objects.create(search=old, listing=legacy)
+        SearchResult.objects.create(search=new, listing=legacy, position=1)
+        stale = HouseListing.objects.create(
+            title="House 3",
+            address="3 Ngong Road",
+            link="https://example.com/listing/3",
+            fingerprint="0123456789abcdef",
+        )
+
+        out = io.StringIO()
+        call_command("compact_listings", "--dry-run", stdout=out)
+        self.assertIn("Would merge 1 duplicate listings", out.getvalue())
+        self.assertEqual(HouseListing.objects.count(), 4)
+
+        call_command("compact_listings", stdout=io.StringIO())
+        self.assertFalse(HouseListing.objects.filter(pk=legacy.pk).exists())
+        stale.refresh_from_db()
+        self.assertEqual(stale.fingerprint, row_fingerprint(stale))
+        keeper = HouseListing.objects.get(title="House 1")
+        # Both searches link to the keeper, once each
+        self.assertEqual(
+            sorted(keeper.appearances.values_list("search", flat=True)),
+            [old.pk, new.pk],
+        )
+        self.assertEqual(HouseListing.objects.count(), 3)
+
+
+class SqlitePragmaTests(SimpleTestCase):
+    def connect(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        # A separate handler, so the test database is not touched
+        handler = ConnectionHandler(
+            {
+                "default": {"ENGINE": "django.db.backends.dummy"},
+                "pragma": {
+                    "ENGINE": "django.db.backends.sqlite3",
+                    "NAME": f"{directory.name}/pragma.sqlite3",
+                },
+            }
+        )
+        connection = handler["pragma"]
+        self.addCleanup(connection.close)
+        return connection
+
+    def pragma(self, connection, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    @override_settings(
+        SQLITE_JOURNAL_MODE="wal", SQLITE_SYNCHRONOUS="normal", SQLITE_BUSY_TIMEOUT=2.5
+    )
+    def test_pragmas_applied(self):
+        connection = self.connect()
+        self.assertEqual(self.pragma(connection, "journal_mode"), "wal")
+        self.assertEqual(self.pragma(connection, "synchronous"), 1)
+        self.assertEqual(self.pragma(connection, "busy_timeout"), 2500)
+
+    @override_settings(SQLITE_JOURNAL_MODE="", SQLITE_SYNCHRONOUS="")
+    def test_file_mode_kept_by_default(self):
+        connection = self.connect()
+        self.assertEqual(self.pragma(connection, "journal_mode"), "delete")
+        self.assertEqual(self.pragma(connection, "synchronous"), 2)
+
+    @override_settings(SQLITE_JOURNAL_MODE="bogus")
+    def test_unknown_journal_mode(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, "SQLITE_JOURNAL_MODE"):
+            self.connect().ensure_connection()
+
+    @override_settings(SQLITE_JOURNAL_MODE="", SQLITE_SYNCHRONOUS="sometimes")
+    def test_unknown_synchronous_level(self):
+        with self.assertRaisesMessage(ImproperlyConfigured, "SQLITE_SYNCHRONOUS"):
+            self.connect().ensure_connection()
+
+
+def _crawl(created_at, price):
+    return {
+        "search_metadata": {"created_at": created_at},
+        "search_parameters": {"q": "houses for sale", "location": "Kilimani"},
+        "local_results": [
+            {"title": "House 1", "price": price, "link": "https://example.com/1"}
+        ],
+    }
+
+
+class IngestTests(TestCase):
+    def ingest(self, *responses):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, "dump.jsonl")
+        with open(path, "w") as dump:
+            dump.writelines(json.dumps(response) + "\n" for response in responses)
+        call_command("ingest_listings", path, stdout=io.StringIO())
+
+    def test_searches_dated_by_crawl_time(self):
+        self.ingest(_crawl("2024-01-15 10:20:30 UTC", "KSh 5M"))
+        search = SearchQuery.objects.get()
+        self.assertEqual(
+            search.timestamp, datetime(2024, 1, 15, 10, 20, 30, tzinfo=timezone.utc)
+        )
+        self.assertEqual(HouseListing.objects.get().last_seen, search.timestamp)
+
+    def test_older_crawl_keeps_newer_data(self):
+        self.ingest(_crawl("2024-03-01 00:00:00 UTC", "KSh 6M"))
+        self.ingest(
+            _crawl("2024-01-01 00:00:00 UTC", "KSh 5M"),
+            _crawl(None, "KSh 7M"),
+        )
+        house = HouseListing.objects.get()
+        # The undated response counts as now and wins; the January crawl doesn't
+        self.assertEqual(house.price_amount, Decimal("7000000"))
+        self.assertEqual(house.appearances.count(), 3)
+
+        self.ingest(_crawl("2024-01-02 00:00:00 UTC", "KSh 4M"))
+        house.refresh_from_db()
+        self.assertEqual(house.price_amount, Decimal("7000000"))
+
+    def test_save_searches_newest_data_wins_in_one_call(self):
+        now = datetime.now(timezone.utc)
+        save_searches(
+            [
+                ("houses", "Kilimani", [_listing(1, "50000", "KES")], now),
+                (
+                    "houses",
+                    "Kilimani",
+                    [_listing(1, "40000", "KES")],
+                    now - timedelta(days=30),
+                ),
+            ]
+        )
+        self.assertEqual(HouseListing.objects.get().price_amount, Decimal("50000"))
@@ -0,0 +1,61 @@
+"""Per-request stage timings (search, process, db_write, analysis, ...).
+
+Code wraps a stage in ``with timed("name")``. Inside ``collect()`` the
+durations are summed per stage for the current request or task, and every
+measurement is also passed to the registered listeners, e.g. for metrics.
+"""
+
+import contextvars
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List
+
+_timings: contextvars.ContextVar = contextvars.ContextVar("stage_timings", default=None)
+_listeners: List[Callable[[str, float], None]] = []
+
+
+def add_listener(listener: Callable[[str, float], None]) -> None:
+    """Call ``listener(stage, seconds)`` for every measured stage"""
+    if listener not in _listeners:
+        _listeners.append(listener)
+
+
+def record(stage: str, seconds: float) -> None:
+    timings = _timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+    for listener in _listeners:
+        listener(stage, seconds)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, time.perf_counter() - started)
+
+
+@contextmanager
+def collect() -> Iterator[Dict[str, float]]:
+    """Gather the stage timings of the enclosed work into the yielded dict.
+
+    Nested collections (e.g. the Server-Timing middleware inside a benchmark)
+    each see their own stages, which are added to the enclosing one on exit.
+    """
+    outer = _timings.get()
+    timings = {}
+    token = _timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _timings.reset(token)
+        if outer is not None:
+            for stage, seconds in timings.items():
+                outer[stage] = outer.get(stage, 0.0) + seconds
+
+
+def current() -> Dict[str, float]:
+    """Timings gathered so far by the enclosing collect(), empty outside one"""
+    return _timings.get() or {}
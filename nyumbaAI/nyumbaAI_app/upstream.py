@@ -0,0 +1,241 @@
+"""Client-side protection for calls to the search and LLM providers.
+
+A ``Guard`` per provider combines a token-bucket rate limiter sized to the
+plan quota, jittered exponential retries for transient errors and a circuit
+breaker that fails fast while the provider keeps failing. Guards are shared by
+all threads and event loops of a process. Breaker state, retries and limiter
+waits are exported in /metrics.
+"""
+
+import asyncio
+import random
+import threading
+import time
+from typing import Any, Awaitable, Callable, Optional
+
+from . import metrics
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a provider whose breaker is open"""
+
+
+class RateLimited(Exception):
+    """Raised when a call would wait too long for a rate limit token"""
+
+
+class TokenBucket:
+    """Allows ``rate_per_minute`` calls on average and bursts of ``burst``"""
+
+    def __init__(
+        self,
+        rate_per_minute: float,
+        burst: int,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.clock = clock
+        self.tokens = float(self.capacity)
+        self.updated = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, max_wait: float) -> float:
+        """Take a token and return how long to wait before using it.
+
+        Raises RateLimited, without taking the token, when the wait would
+        exceed ``max_wait``. A rate of 0 disables the limit.
+        """
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = self.clock()
+            self.tokens = min(
+                self.capacity, self.tokens + (now - self.updated) * self.rate
+            )
+            self.updated = now
+            wait = max(0.0, (1 - self.tokens) / self.rate)
+            if wait > max_wait:
+                raise RateLimited(f"Rate limit wait of {wait:.1f}s exceeds {max_wait}s")
+            self.tokens -= 1
+            return wait
+
+
+class CircuitBreaker:
+    """Opens after ``failure_threshold`` consecutive failures.
+
+    While open, calls fail with CircuitOpen. After ``reset_seconds`` a single
+    probe call is let through (half-open): success closes the breaker, failure
+    opens it again.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int,
+        reset_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        metrics.circuit_state.set(0, provider=name)
+
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        metrics.circuit_state.set(_STATE_VALUES[state], provider=self.name)
+
+    def before_call(self) -> None:
+        with self._lock:
+            if self.state == OPEN:
+                if self.clock() - self.opened_at < self.reset_seconds:
+                    raise CircuitOpen(f"{self.name} circuit is open")
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    raise CircuitOpen(f"{self.name} circuit is half-open")
+                self._probing = True
+
+    def cancel(self) -> None:
+        """The admitted call was not made after all"""
+        with self._lock:
+            self._probing = False
+
+    def success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._probing = False
+            if self.state != CLOSED:
+                self._set_state(CLOSED)
+
+    def failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            self._probing = False
+            if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+                self.opened_at = self.clock()
+                if self.state != OPEN:
+                    self._set_state(OPEN)
+
+
+class Guard:
+    """Rate limit, retry and circuit-break calls to one provider"""
+
+    def __init__(
+        self,
+        name: str,
+        transient: Callable[[BaseException], bool],
+        rate_per_minute: float,
+        burst: int,
+        max_wait: float,
+        retries: int,
+        backoff: float,
+        backoff_max: float,
+        failure_threshold: int,
+        reset_seconds: float,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.transient = transient
+        self.limiter = TokenBucket(rate_per_minute, burst, clock)
+        self.max_wait = max_wait
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.breaker = CircuitBreaker(name, failure_threshold, reset_seconds, clock)
+
+    def _admit(self) -> float:
+        """Check the breaker and take a rate limit token; returns the wait"""
+        try:
+            self.breaker.before_call()
+        except CircuitOpen:
+            metrics.upstream_calls.inc(provider=self.name, outcome="circuit_open")
+            raise
+        try:
+            wait = self.limiter.reserve(self.max_wait)
+        except RateLimited:
+            self.breaker.cancel()
+            metrics.upstream_calls.inc(provider=self.name, outcome="rate_limited")
+            raise
+        metrics.rate_limit_wait_seconds.observe(wait, provider=self.name)
+        return wait
+
+    def record(self, error: Optional[BaseException]) -> None:
+        """Feed the outcome of a call (or of a stream it returned) to the breaker"""
+        if error is not None and self.transient(error):
+            self.breaker.failure()
+        else:
+            # Non-transient errors (bad request, auth) say nothing about health
+            self.breaker.success()
+
+    def _retry_delay(self, error: BaseException, attempt: int) -> Optional[float]:
+        """Seconds to sleep before retrying, None to give up"""
+        self.record(error)
+        if (
+            attempt >= self.retries
+            or not self.transient(error)
+            or self.breaker.state == OPEN
+        ):
+            return None
+        metrics.upstream_retries.inc(provider=self.name)
+        # Full jitter spreads out retries of callers that failed together
+        delay = random.uniform(0, min(self.backoff_max, self.backoff * 2**attempt))
+        return min(self.backoff_max, max(delay, _retry_after(error)))
+
+    def call(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        attempt = 0
+        while True:
+            time.sleep(self._admit())
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                attempt += 1
+                continue
+            self.record(None)
+            return result
+
+    async def acall(self, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        attempt = 0
+        while True:
+            await asyncio.sleep(self._admit())
+            try:
+                result = await fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._retry_delay(e, attempt)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.record(None)
+            return result
+
+
+def _retry_after(error: BaseException) -> float:
+    """Retry-After of an HTTP error response, 0 when absent"""
+    headers = getattr(getattr(error, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after", 0))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def status_code(error: BaseException) -> Optional[int]:
+    """HTTP status of an SDK or httpx error, if it carries one"""
+    status = getattr(error, "status_code", None)
+    if status is None:
+        status = getattr(getattr(error, "response", None), "status_code", None)
+    return status if isinstance(status, int) else None
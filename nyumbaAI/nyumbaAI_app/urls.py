@@ -8,7 +8,29 @@ app_name = "nyumbaAI_app"
 urlpatterns = [
     path("", views.home, name="home"),
     path("search/", views.search, name="search"),
+    path("search/async/", views.search_async, name="search_async"),
+    path("search/batch/", views.search_batch, name="search_batch"),
+    path("search/pages/", views.search_pages, name="search_pages"),
+    path(
+        "analysis/<int:session_id>/job/",
+        views.analysis_job,
+        name="analysis_job",
+    ),
+    path(
+        "analysis/<int:session_id>/stream/",
+        views.analysis_stream,
+        name="analysis_stream",
+    ),
+    path(
+        "analysis/<int:session_id>/stream/async/",
+        views.analysis_stream_async,
+        name="analysis_stream_async",
+    ),
     path("chat/", views.chat, name="chat"),
+    path("listings/nearby/", views.listings_nearby, name="listings_nearby"),
+    path("listings/bbox/", views.listings_in_bbox, name="listings_in_bbox"),
+    path("listings/stats/", views.location_stats, name="location_stats"),
+    path("metrics", views.metrics_view, name="metrics"),
 ]
 # Serve static files during development
 if settings.DEBUG:
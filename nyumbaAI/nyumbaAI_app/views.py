@@ -1,17 +1,58 @@
-from django.shortcuts import render, redirect
-from django.http import HttpResponseBadRequest, JsonResponse
-from .models import SearchQuery, HouseListing
+from django.conf import settings
+from django.shortcuts import get_object_or_404, render, redirect
+from django.http import (
+    Http404,
+    HttpResponse,
+    HttpResponseBadRequest,
+    HttpResponseNotAllowed,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.urls import reverse
+from . import metrics
+from .jobs import enqueue_analysis
+from .models import AnalysisJob, ChatSession
+from .chat import (
+    asave_analysis,
+    astart_session,
+    save_analysis,
+    schedule_compaction,
+    start_session,
+    stream_reply,
+)
+from .async_services import (
+    aget_search_listings,
+    aget_stored_listings,
+    asave_search,
+    asearch_houses,
+    astream_analysis,
+)
+from .stats import amarket_facts, get_location_stats, market_facts
+from .timing import timed
 from .services import (
-    get_groq_response,
+    batch_search,
+    find_listings_in_bbox,
+    find_listings_near,
+    get_listing_page,
+    get_search_listings,
+    get_stored_listings,
+    save_search,
     search_houses,
     process_search_results,
-    analyze_listings,
+    stream_analysis,
 )
+from functools import partial
 from urllib.parse import quote_plus
-from groq import Groq
+import json
+import logging
 import os
-import markdown
-from django.views.decorators.http import require_POST
+from django.views.decorators.http import require_GET, require_POST
+
+logger = logging.getLogger(__name__)
+
+# Re-render the streamed analysis at least this often (in characters) even
+# when no line break has arrived yet
+ANALYSIS_RENDER_EVERY = 200
 
 
 def home(request):
@@ -19,6 +60,30 @@ def home(request):
     return render(request, "nyumbaAI_app/index.html")
 
 
+def _results_context(
+    query, location, listings, session, raw_results, stream_url, poll=False
+):
+    """Template context shared by the sync and async search views"""
+    # Create Google Maps URL
+    encoded_location = quote_plus(location)
+    maps_url = f"https://www.google.com/maps/search/?api=1&query={encoded_location}"
+
+    # The analysis is streamed (or, with ``poll``, polled for) separately so
+    # the listings render immediately
+    analysis_url = reverse(stream_url, args=[session.pk])
+
+    return {
+        "listings": listings,
+        "analysis_url": analysis_url if listings else None,
+        "analysis_poll": poll,
+        "session_id": session.pk,
+        "query": query,
+        "location": location,
+        "maps_url": maps_url,
+        "raw_results": raw_results if os.getenv("DEBUG") else None,
+    }
+
+
 def search(request):
     """Handle property search requests"""
     if request.method == "POST":
@@ -31,56 +96,92 @@ def search(request):
             if not location:
                 return HttpResponseBadRequest("Location is required")
 
-            # Perform house search
-            raw_results = search_houses(location)
-            result = process_search_results(raw_results)[:6]
-            processed_listings = result
+            # Serve a recent stored search when available, else hit the API
+            stored = get_stored_listings(location, raw_query)
+            if stored is not None:
+                search_query, processed_listings = stored
+                raw_results = None
+            else:
+                raw_results = search_houses(location)
+                processed_listings = process_search_results(raw_results)[
+                    : settings.SEARCH_PAGE_SIZE
+                ]
 
-            # Save search to database
-            search_query = SearchQuery.objects.create(
-                query=raw_query,
-                location=location,
-                results_count=len(processed_listings),
-            )
+                # Save search to database
+                search_query = save_search(raw_query, location, processed_listings)
 
-            # Save listings with fallback values
-            for listing in processed_listings:
-                HouseListing.objects.create(
-                    search=search_query,
-                    title=listing.get("title", "No Title Available"),
-                    price=listing.get("price", "Price Not Available"),
-                    address=listing.get("address", "Address Not Available"),
-                    link=listing.get("link", "#"),
-                    latitude=listing.get("latitude"),
-                    longitude=listing.get("longitude"),
-                    rating=listing.get("rating"),
-                    description=listing.get("description", "No Description Available"),
-                )
+            # Analysis and chat history are kept server-side per results page
+            session = start_session(search_query, raw_query)
 
-            # Generate analysis
-            analysis = analyze_listings(raw_query, processed_listings)
-            analysis_html = markdown.markdown(analysis)
+            # Queue the analysis so this worker is done once the page renders
+            poll = settings.ANALYSIS_JOBS and bool(processed_listings)
+            if poll:
+                enqueue_analysis(session)
 
-            # Create Google Maps URL
-            encoded_location = quote_plus(location)
-            maps_url = (
-                f"https://www.google.com/maps/search/?api=1&query={encoded_location}"
+            context = _results_context(
+                raw_query,
+                location,
+                processed_listings,
+                session,
+                raw_results,
+                "nyumbaAI_app:analysis_job" if poll else "nyumbaAI_app:analysis_stream",
+                poll=poll,
             )
+            with timed("render"):
+                return render(request, "nyumbaAI_app/results.html", context)
+
+        except Exception as e:
+            # Log error and show error page
+            metrics.errors.inc(where="search_view")
+            logger.exception("Search error: %s", e)
+            return render(
+                request,
+                "nyumbaAI_app/error.html",
+                {"error_message": "Could not complete search. Please try again."},
+            )
+
+    return redirect("nyumbaAI_app:home")
+
+
+async def search_async(request):
+    """Handle property search requests without blocking the event loop (ASGI)"""
+    if request.method == "POST":
+        try:
+            raw_query = request.POST.get("query", "")
+            location = request.POST.get("location", "")
+
+            if not location:
+                return HttpResponseBadRequest("Location is required")
+
+            stored = await aget_stored_listings(location, raw_query)
+            if stored is not None:
+                search_query, processed_listings = stored
+                raw_results = None
+            else:
+                raw_results = await asearch_houses(location)
+                processed_listings = process_search_results(raw_results)[
+                    : settings.SEARCH_PAGE_SIZE
+                ]
+                search_query = await asave_search(
+                    raw_query, location, processed_listings
+                )
 
-            context = {
-                "listings": processed_listings,
-                "analysis": analysis_html,
-                "query": raw_query,
-                "location": location,
-                "maps_url": maps_url,
-                "raw_results": raw_results if os.getenv("DEBUG") else None,
-            }
+            session = await astart_session(search_query, raw_query)
 
-            return render(request, "nyumbaAI_app/results.html", context)
+            context = _results_context(
+                raw_query,
+                location,
+                processed_listings,
+                session,
+                raw_results,
+                "nyumbaAI_app:analysis_stream_async",
+            )
+            with timed("render"):
+                return render(request, "nyumbaAI_app/results.html", context)
 
         except Exception as e:
-            # Log error and show error page
-            print(f"Search error: {str(e)}")
+            metrics.errors.inc(where="search_view")
+            logger.exception("Search error: %s", e)
             return render(
                 request,
                 "nyumbaAI_app/error.html",
@@ -91,20 +192,294 @@ def search(request):
 
 
 @require_POST
-def chat(request):
+def search_batch(request):
+    """Search several locations at once and analyze the merged results (JSON)"""
     try:
-        message = request.POST.get("message", "").strip()
-        analysis = request.POST.get("analysis", "")
+        payload = json.loads(request.body or b"{}")
+    except ValueError:
+        return JsonResponse({"error": "Invalid JSON"}, status=400)
+
+    locations = payload.get("locations")
+    query = payload.get("query") or ""
+    if (
+        not isinstance(locations, list)
+        or not locations
+        or not all(isinstance(location, str) for location in locations)
+    ):
+        return JsonResponse(
+            {"error": "locations must be a non-empty list of strings"}, status=400
+        )
+    if len(locations) > settings.BATCH_SEARCH_MAX_LOCATIONS:
+        return JsonResponse(
+            {"error": f"At most {settings.BATCH_SEARCH_MAX_LOCATIONS} locations"},
+            status=400,
+        )
+    if not isinstance(query, str):
+        return JsonResponse({"error": "query must be a string"}, status=400)
+
+    try:
+        result = batch_search(locations, query)
+    except Exception as e:
+        metrics.errors.inc(where="batch_search")
+        logger.exception("Batch search error: %s", e)
+        return JsonResponse({"error": "Could not complete search"}, status=500)
+
+    result["analysis_html"] = _markdown(result["analysis"])
+    return JsonResponse(result)
+
+
+@require_GET
+def search_pages(request):
+    """Page through upstream results for a location with an opaque cursor (JSON)"""
+    location = request.GET.get("location", "").strip()
+    cursor = request.GET.get("cursor", "").strip()
+    if not location and not cursor:
+        return JsonResponse({"error": "location or cursor is required"}, status=400)
+    try:
+        page_size = int(request.GET.get("page_size") or settings.SEARCH_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({"error": "page_size must be an integer"}, status=400)
+    if not 0 < page_size <= settings.SEARCH_PAGE_SIZE * 5:
+        return JsonResponse(
+            {"error": f"page_size must be in (0, {settings.SEARCH_PAGE_SIZE * 5}]"},
+            status=400,
+        )
+
+    try:
+        page = get_listing_page(location, cursor or None, page_size)
+    except Exception as e:
+        metrics.errors.inc(where="search_pages")
+        logger.exception("Search error: %s", e)
+        return JsonResponse({"error": "Could not complete search"}, status=500)
+    if page is None:
+        return JsonResponse({"error": "Unknown or expired cursor"}, status=400)
 
-        if not message:
-            return JsonResponse({"error": "Empty message"}, status=400)
+    page["count"] = len(page["listings"])
+    return JsonResponse(page)
 
-        # Get response from Groq with analysis context
-        response = get_groq_response(message, analysis)
-        result = markdown.markdown(response)
 
-        return JsonResponse({"response": result, "status": "success"})
+@require_GET
+def metrics_view(request):
+    """Prometheus scrape endpoint"""
+    return HttpResponse(
+        metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
 
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def _event_stream(events):
+    response = StreamingHttpResponse(events, content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"  # Stop nginx from buffering the stream
+    return response
+
+
+def _markdown(text):
+    # Imported on first render rather than at worker startup
+    import markdown
+
+    with timed("markdown"):
+        return markdown.markdown(text)
+
+
+def _timed_chunks(chunks, stage):
+    """Iterate chunks, counting the time spent waiting for each as ``stage``"""
+    chunks = iter(chunks)
+    while True:
+        with timed(stage):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        yield chunk
+
+
+async def _atimed_chunks(chunks, stage):
+    while True:
+        with timed(stage):
+            try:
+                chunk = await chunks.__anext__()
+            except StopAsyncIteration:
+                return
+        yield chunk
+
+
+def _analysis_events(chunks):
+    """Turn streamed markdown into SSE events carrying the rendered HTML so far"""
+    text = ""
+    rendered = 0
+    for chunk in _timed_chunks(chunks, "analysis"):
+        text += chunk
+        # Markdown blocks only settle at line breaks, so render there
+        if "\n" in chunk or len(text) - rendered >= ANALYSIS_RENDER_EVERY:
+            rendered = len(text)
+            yield _sse("analysis", {"html": _markdown(text)})
+    yield _sse("done", {"html": _markdown(text)})
+
+
+async def _aanalysis_events(chunks):
+    text = ""
+    rendered = 0
+    async for chunk in _atimed_chunks(chunks, "analysis"):
+        text += chunk
+        if "\n" in chunk or len(text) - rendered >= ANALYSIS_RENDER_EVERY:
+            rendered = len(text)
+            yield _sse("analysis", {"html": _markdown(text)})
+    yield _sse("done", {"html": _markdown(text)})
+
+
+@require_GET
+def analysis_job(request, session_id):
+    """Status of a queued analysis, with the rendered HTML once done (JSON)"""
+    session = get_object_or_404(ChatSession, pk=session_id)
+    if session.analysis:
+        return JsonResponse(
+            {"status": AnalysisJob.DONE, "html": _markdown(session.analysis)}
+        )
+    job = AnalysisJob.objects.filter(session=session).only("status").first()
+    if job is None:
+        return JsonResponse({"error": "No analysis queued"}, status=404)
+    return JsonResponse({"status": job.status})
+
+
+@require_GET
+def analysis_stream(request, session_id):
+    """Stream the Groq analysis for a results page as server-sent events"""
+    session = get_object_or_404(
+        ChatSession.objects.select_related("search"), pk=session_id
+    )
+    if session.analysis:
+        chunks = [session.analysis]
+    else:
+        listings = get_search_listings(session.search)
+        chunks = stream_analysis(
+            session.query,
+            listings,
+            partial(save_analysis, session.pk),
+            market_facts(session.search.location),
+        )
+    return _event_stream(_analysis_events(chunks))
+
+
+async def analysis_stream_async(request, session_id):
+    """Async variant of analysis_stream for ASGI deployments"""
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    session = (
+        await ChatSession.objects.select_related("search")
+        .filter(pk=session_id)
+        .afirst()
+    )
+    if session is None:
+        raise Http404("Unknown chat session")
+    if session.analysis:
+        return _event_stream(_analysis_events([session.analysis]))
+    listings = await aget_search_listings(session.search)
+    chunks = astream_analysis(
+        session.query,
+        listings,
+        partial(asave_analysis, session.pk),
+        await amarket_facts(session.search.location),
+    )
+    return _event_stream(_aanalysis_events(chunks))
+
+
+def _chat_events(session, message):
+    """Forward chat tokens as SSE events, then the rendered reply"""
+    reply = ""
+    try:
+        for token in _timed_chunks(stream_reply(session, message), "chat"):
+            reply += token
+            yield _sse("token", {"text": token})
     except Exception as e:
-        print(f"Chat error: {str(e)}")
-        return JsonResponse({"error": str(e)}, status=500)
+        metrics.errors.inc(where="chat")
+        logger.exception("Chat error: %s", e)
+        yield _sse("error", {"error": str(e)})
+        return
+    yield _sse("done", {"html": _markdown(reply)})
+
+    # Summarize turns that fell out of the history window off the request,
+    # so the response ends with the reply
+    schedule_compaction(session.pk)
+
+
+@require_POST
+def chat(request):
+    message = request.POST.get("message", "").strip()
+    session_id = request.POST.get("session", "")
+
+    if not message:
+        return JsonResponse({"error": "Empty message"}, status=400)
+    if not session_id.isdigit():
+        return JsonResponse({"error": "Missing chat session"}, status=400)
+
+    session = get_object_or_404(ChatSession, pk=session_id)
+
+    # Stream the response from Groq with the stored analysis and history
+    return _event_stream(_chat_events(session, message))
+
+
+def _float_param(request, name, default=None):
+    value = request.GET.get(name)
+    if value is None or value == "":
+        if default is None:
+            raise ValueError(f"{name} is required")
+        return default
+    try:
+        return float(value)
+    except ValueError:
+        raise ValueError(f"{name} must be a number")
+
+
+@require_GET
+def listings_nearby(request):
+    """Stored listings within radius_km of lat/lon, nearest first"""
+    try:
+        latitude = _float_param(request, "lat")
+        longitude = _float_param(request, "lon")
+        radius_km = _float_param(request, "radius_km", 3.0)
+        limit = int(_float_param(request, "limit", 50))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return JsonResponse({"error": "Coordinates out of range"}, status=400)
+    if not 0 < radius_km <= 500:
+        return JsonResponse({"error": "radius_km must be in (0, 500]"}, status=400)
+
+    results = find_listings_near(latitude, longitude, radius_km, min(limit, 500))
+    return JsonResponse({"count": len(results), "results": results})
+
+
+@require_GET
+def location_stats(request):
+    """Stored market statistics for a location (JSON)"""
+    location = request.GET.get("location", "")
+    if not location:
+        return JsonResponse({"error": "location is required"}, status=400)
+    stats = get_location_stats(location)
+    if stats is None:
+        return JsonResponse({"error": "No listings on record"}, status=404)
+    return JsonResponse(stats)
+
+
+@require_GET
+def listings_in_bbox(request):
+    """Stored listings inside the min_lat/min_lon/max_lat/max_lon box"""
+    try:
+        bbox = [
+            _float_param(request, name)
+            for name in ("min_lat", "min_lon", "max_lat", "max_lon")
+        ]
+        limit = int(_float_param(request, "limit", 200))
+    except ValueError as e:
+        return JsonResponse({"error": str(e)}, status=400)
+
+    min_lat, min_lon, max_lat, max_lon = bbox
+    if min_lat > max_lat or min_lon > max_lon:
+        return JsonResponse({"error": "min values must not exceed max"}, status=400)
+
+    results = find_listings_in_bbox(*bbox, limit=min(limit, 1000))
+    return JsonResponse({"count": len(results), "results": results})